@@ -38,11 +38,11 @@ class PacingCells(df.SubDomain):
         return pow(x[0], 2) + pow(x[1], 2) < 1.0
 
 markers = {'STIMULUS': 1, 'NONE': 0}
-mf = df.MeshFunction('size_t', mesh, mesh.geometric_dimension()-1)
+mf = df.MeshFunction('size_t', mesh, mesh.topology().dim())
 mf.set_all(0)
 pacing_cells = PacingCells()
 pacing_cells.mark(mf, markers['STIMULUS'])
-markerfunctions = MarkerFunctions2D(ffun=mf)
+markerfunctions = MarkerFunctions2D(cfun=mf)
 
 geo = Geometry2D(mesh, markers=markers, markerfunctions=markerfunctions)
 
@@ -57,28 +57,21 @@ eparam['M_e'] = 2.0
 eparam['I_s'].update({'period': 400, 'amplitude': 100, 'duration': 5})
 eparam['dt'] = 1e-3
 
-starttime = parameters['start_time']
-endtime = parameters['end_time']
-dt = eparam['dt']
-time = df.Constant(starttime)
-steps = int((endtime-starttime)/dt)
+time = df.Constant(parameters['start_time'])
 
 # Setup simulation
 model = M3H3(geo, parameters, time=time)
 
-# File for output
-f = df.XDMFFile(comm, "demo_electrophysiology.xdmf")
-f.parameters["flush_output"] = True
-f.parameters["rewrite_function_mesh"] = True
-f.parameters["functions_share_mesh"] = True
+# Output every 10 ms. The mesh is written once and fields are written in the
+# background.
+output = model.setup_output("demo_electrophysiology.xdmf")
+prev_current, solution = model.get_solution_fields()[str(Physics.ELECTRO)]
+output.add_field("prev_current", prev_current, interval=10.0)
+output.add_field("solution", solution, interval=10.0)
 
 
-# Loop over time
-for step in range(steps):
-    time, fields = model.step()
-    if time % 10 < dt:
-        for field in fields:
-            if field is not None:
-                f.write(field, int(time))
+# Solve over the whole interval and report progress every 100 ms
+for time, fields in model.solve(yield_every=100.0):
+    m3h3.log(df.LogLevel.INFO, "Solved up to t = {} ms".format(time))
 
-f.close()
+output.close()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""This module implements in-situ recording of activation and repolarization
+time maps.
+
+Instead of writing the transmembrane potential at a high frequency and
+post-processing it, the :py:class:`ActivationRecorder` is updated by the
+electro solver after every step. It keeps one activation and one
+repolarization time per dof, found by linear interpolation of the threshold
+crossing within the step, and only writes these maps.
+"""
+
+import numpy as np
+
+from dolfin import Function, XDMFFile
+
+
+class ActivationRecorder(object):
+    """Records the times at which a field crosses thresholds upwards
+    (activation) and downwards (repolarization).
+
+    Parameters
+    ----------
+    function : :py:class:`dolfin.Function`
+        The transmembrane potential, e.g. ``prev_current`` of the electro
+        problem.
+    threshold : float
+        Activation threshold.
+    repolarization_threshold : float, optional
+        Repolarization threshold. Defaults to threshold.
+    mode : str
+        ``"first"`` keeps the first activation of every dof. ``"latest"``
+        starts a new beat at every upstroke, so the maps hold the latest
+        beat.
+    start_time : float
+        Time of the current values of function.
+    """
+
+    def __init__(self, function, threshold=0.0, repolarization_threshold=None,
+                                            mode="first", start_time=0.0):
+        if mode not in ("first", "latest"):
+            msg = "Unknown activation recorder mode {}. Use 'first' or "\
+                    "'latest'.".format(mode)
+            raise ValueError(msg)
+        self.function = function
+        self.threshold = threshold
+        self.repolarization_threshold = repolarization_threshold\
+                    if repolarization_threshold is not None else threshold
+        self.mode = mode
+
+        self._previous = function.vector().get_local()
+        self._time = float(start_time)
+        self.activation = np.full(self._previous.shape, np.nan)
+        self.repolarization = np.full(self._previous.shape, np.nan)
+
+
+    def __call__(self, time, function=None):
+        """Updates the maps with the current values of the field at time.
+        Can be registered with
+        :py:meth:`m3h3.pde.solver.BasicBidomainSolver.register_observer`.
+        """
+        self.update(time)
+
+
+    def update(self, time):
+        """Updates the maps in one vectorized pass over the owned dofs.
+        """
+        v0 = self._previous
+        v1 = self.function.vector().get_local()
+        t0, t1 = self._time, float(time)
+
+        upstroke = (v0 < self.threshold) & (v1 >= self.threshold)
+        if self.mode == "first":
+            upstroke &= np.isnan(self.activation)
+        if np.any(upstroke):
+            self.activation[upstroke] = _crossing(t0, t1, v0[upstroke],
+                                                v1[upstroke], self.threshold)
+            self.repolarization[upstroke] = np.nan
+
+        r = self.repolarization_threshold
+        downstroke = (v0 >= r) & (v1 < r) & ~np.isnan(self.activation)\
+                                            & np.isnan(self.repolarization)
+        if np.any(downstroke):
+            self.repolarization[downstroke] = _crossing(t0, t1,
+                                    v0[downstroke], v1[downstroke], r)
+
+        self._previous = v1
+        self._time = t1
+
+
+    def maps(self):
+        """Returns the activation, repolarization and action potential
+        duration maps as functions. Dofs without crossing are NaN.
+        """
+        V = self.function.function_space()
+        fields = []
+        for name, values in (("activation_time", self.activation),
+                             ("repolarization_time", self.repolarization),
+                             ("action_potential_duration",
+                                    self.repolarization - self.activation)):
+            f = Function(V, name=name)
+            f.vector().set_local(values)
+            f.vector().apply("insert")
+            fields.append(f)
+        return fields
+
+
+    def write(self, filename, time=None, append=True):
+        """Writes the maps to an XDMF file, as time series if time is given.
+        This is a collective call.
+        """
+        time = time if time is not None else self._time
+        comm = self.function.function_space().mesh().mpi_comm()
+        xdmf = XDMFFile(comm, filename)
+        try:
+            for i, f in enumerate(self.maps()):
+                xdmf.write_checkpoint(f, f.name(), time,
+                                        append=append or i > 0)
+        finally:
+            xdmf.close()
+
+
+def _crossing(t0, t1, v0, v1, threshold):
+    # Linear interpolation of the time at which v crosses threshold
+    dv = v1 - v0
+    s = np.where(dv != 0, (threshold - v0)/np.where(dv != 0, dv, 1.0), 1.0)
+    return t0 + s*(t1 - t0)
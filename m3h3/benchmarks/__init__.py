@@ -0,0 +1,17 @@
+"""Performance benchmarks for M3H3.
+
+Every benchmark is a module with a ``run(**config)`` function that returns a
+dict of results and a command line interface, e.g.::
+
+    mpirun -n 4 python -m m3h3.benchmarks.niederer_slab --dx 0.2 --dt 0.01
+
+Available benchmarks are
+
+- ``niederer_slab``: the N-version benchmark slab of Niederer et al. (2011),
+- ``single_cell``: pacing of a single TP06 cell,
+- ``electromechanics``: coupled electromechanics on a truncated ellipsoid,
+- ``startup``: the time to ``import m3h3`` in a fresh interpreter.
+
+``m3h3.benchmarks.scaling`` runs a benchmark over a range of process counts
+and reports parallel efficiency and per-rank load imbalance.
+"""
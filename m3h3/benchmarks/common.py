@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""This module contains set-up and reporting shared by the M3H3 benchmarks.
+"""
+
+import argparse
+import json
+import resource
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import dolfin as df
+from dolfin import Constant, FunctionAssigner
+
+from m3h3.ode import MultiCellModel
+from m3h3.partitioning import cell_costs
+from m3h3.profiling import profiler, timer
+
+
+def argument_parser(description):
+    """Returns an argument parser with the options that are common to all
+    benchmarks.
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--dt", type=float, default=None,
+                        help="time step size in ms")
+    parser.add_argument("--end-time", type=float, default=None,
+                        help="simulated time in ms")
+    parser.add_argument("--linear-solver", default=None,
+                        help="linear solver of the electro problem")
+    parser.add_argument("--preconditioner", default=None,
+                        help="preconditioner of the electro problem")
+    parser.add_argument("--reference", default=None,
+                        help="JSON results of a reference run to compute "
+                             "accuracy metrics against")
+    parser.add_argument("--output", default=None,
+                        help="write results as JSON to this file")
+    return parser
+
+
+def set_solver_parameters(parameters, linear_solver=None,
+                                                        preconditioner=None):
+    """Updates the linear solver of an electro parameter set.
+    """
+    solver = parameters["linear_variational_solver"]
+    if linear_solver is not None:
+        solver["linear_solver"] = linear_solver
+    if preconditioner is not None:
+        solver["preconditioner"] = preconditioner
+
+
+class CellModelSplitting(object):
+    """Observer of the electro solver that adds the ionic current of a cell
+    model to the bidomain equations by Godunov operator splitting.
+
+    The electro solver solves the bidomain equations without ionic current.
+    After every step, the cell model is integrated at the vertices over the
+    same step with cbcbeat's CardiacODESolver, starting from the
+    transmembrane potential of the PDE step, and the potential is replaced
+    by the result. The ODE steps are timed in the ``ode`` phase.
+
+    Parameters
+    ----------
+    cell_model : :py:class:`m3h3.ode.CardiacCellModel`
+        The cell model, in ms, mV and pA/pF.
+    v : :py:class:`dolfin.Function`
+        The transmembrane potential of the electro solver.
+    start_time : float
+        Time of the initial state.
+    scheme : str
+        Name of the cbcbeat ODE scheme.
+    """
+
+    def __init__(self, cell_model, v, start_time=0.0, scheme="RL1"):
+        import cbcbeat
+
+        parameters = cbcbeat.CardiacODESolver.default_parameters()
+        parameters["scheme"] = scheme
+        self.solver = cbcbeat.CardiacODESolver(v.function_space().mesh(),
+                        Constant(start_time), cell_model, params=parameters)
+        self.vs_, self.vs = self.solver.solution_fields()
+        self.vs_.assign(cell_model.initial_conditions())
+        self.v = v
+        VS = self.vs.function_space()
+        self._to_ode = FunctionAssigner(VS.sub(0), v.function_space())
+        self._from_ode = FunctionAssigner(v.function_space(), VS.sub(0))
+        self._time = float(start_time)
+
+
+    @classmethod
+    def couple(cls, model, scheme="RL1"):
+        """Couples the cell model of the electro problem of an
+        :py:class:`m3h3.M3H3` simulation to its electro solver, and sets
+        the transmembrane potential to the initial potential of the cell
+        model.
+        """
+        v = model.electro_problem.prev_current
+        splitting = cls(model.electro_problem.cell_model, v,
+                                            float(model.time), scheme)
+        splitting._from_ode.assign(v, splitting.vs_.sub(0))
+        model.electro_solver.register_observer(splitting)
+        return splitting
+
+
+    def __call__(self, time, v):
+        if time <= self._time:
+            return
+        with timer("ode"):
+            self._to_ode.assign(self.vs_.sub(0), self.v)
+            self.solver.step((self._time, time))
+            self.vs_.assign(self.vs)
+            self._from_ode.assign(self.v, self.vs.sub(0))
+        self._time = time
+
+
+def memory_high_water(comm):
+    """Returns the minimum and maximum resident set size high-water mark over
+    all processes in MB.
+    """
+    # ru_maxrss is given in kB on Linux
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0
+    return OrderedDict([("min", df.MPI.min(comm, rss)),
+                        ("max", df.MPI.max(comm, rss))])
+
+
+class Stopwatch(object):
+    """Measures the wall time of a block as the maximum over all processes.
+    """
+
+    def __init__(self, comm):
+        self.comm = comm
+        self.elapsed = None
+
+
+    def __enter__(self):
+        self.comm.barrier()
+        self._start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, *args):
+        elapsed = time.perf_counter() - self._start
+        self.elapsed = df.MPI.max(self.comm, elapsed)
+
+
+def per_rank_counts(comm, mesh=None, function_space=None, cfun=None):
+    """Gathers the phase timings and the local problem size of every process.
+
+    Parameters
+    ----------
+    comm : MPI communicator
+        Communicator the benchmark was run on.
+    mesh : :py:class:`dolfin.Mesh`, optional
+        If given, the number of local cells is reported.
+    function_space : :py:class:`dolfin.FunctionSpace`, optional
+        If given, the number of owned dofs is reported.
+    cfun : :py:class:`dolfin.MeshFunction`, optional
+        If given, the number of local cells per marker value is reported,
+        which shows how heterogeneous regions are distributed.
+    """
+    local = OrderedDict()
+    local["timers"] = profiler.local_times()
+    if mesh is not None:
+        local["cells"] = mesh.num_cells()
+    if function_space is not None:
+        first, last = function_space.dofmap().ownership_range()
+        local["dofs"] = last - first
+    if cfun is not None:
+        values, counts = np.unique(cfun.array(), return_counts=True)
+        local["regions"] = OrderedDict((str(v), int(c))
+                                            for v, c in zip(values, counts))
+    return comm.allgather(local)
+
+
+def summarize(name, config, comm, wall_time, simulated_time, num_dofs,
+                            num_steps, mesh=None, function_space=None,
+                            cfun=None, cell_model=None, assembly_cost=1.0,
+                            **metrics):
+    """Collects the standard benchmark metrics in a dict.
+
+    Parameters
+    ----------
+    name : str
+        Name of the benchmark.
+    config : dict
+        Configuration the benchmark was run with.
+    comm : MPI communicator
+        Communicator the benchmark was run on.
+    wall_time : float
+        Wall time of the time loop in s.
+    simulated_time : float
+        Simulated time in ms.
+    num_dofs : int
+        Global number of unknowns that are updated in every step.
+    num_steps : int
+        Number of time steps.
+    mesh, function_space, cfun : optional
+        Passed to :py:func:`per_rank_counts`.
+    cell_model : :py:class:`m3h3.ode.CardiacCellModel`, optional
+        If given, the estimated cost of a cell in every region is reported,
+        see :py:func:`m3h3.partitioning.cell_costs`. The regions of a
+        :py:class:`m3h3.ode.MultiCellModel` replace cfun.
+    assembly_cost : float
+        Cost of the PDEs per cell relative to the cell model costs.
+    metrics : dict
+        Benchmark specific results, e.g. accuracy metrics.
+    """
+    results = OrderedDict()
+    results["benchmark"] = name
+    results["config"] = config
+    results["num_processes"] = df.MPI.size(comm)
+    results["num_dofs"] = num_dofs
+    results["num_steps"] = num_steps
+    results["wall_time"] = wall_time
+    results["wall_time_per_ms"] = wall_time/simulated_time
+    results["dofs_per_second"] = num_dofs*num_steps/wall_time
+    results["memory_high_water_mb"] = memory_high_water(comm)
+    results["timings"] = profiler.report(comm, dolfin_timings=False)
+    if isinstance(cell_model, MultiCellModel):
+        cfun = cell_model.markers()
+    results["per_rank"] = per_rank_counts(comm, mesh, function_space, cfun)
+    if cell_model is not None:
+        costs, default = cell_costs(cell_model, assembly_cost)
+        results["region_costs"] = OrderedDict([("costs", OrderedDict(
+                            (str(key), cost) for key, cost in costs.items())),
+                            ("default", default)])
+    results.update(metrics)
+    return results
+
+
+def load_reference(filename):
+    if filename is None:
+        return None
+    with open(filename) as f:
+        return json.load(f)
+
+
+def write_results(results, filename, comm):
+    """Prints the results on rank 0 and writes them to filename as JSON.
+    """
+    if df.MPI.rank(comm) != 0:
+        return
+    text = json.dumps(results, indent=2)
+    print(text)
+    if filename is not None:
+        with open(filename, "w") as f:
+            f.write(text + "\n")
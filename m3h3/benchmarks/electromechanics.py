@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""Coupled electromechanics benchmark on a truncated ellipsoidal left
+ventricle.
+
+The ventricle is generated with mshr at the requested resolution and is
+stimulated at the apex. The ionic current of the ten Tusscher-Panfilov
+(2006) M cell model is added by operator splitting, see
+:py:class:`m3h3.benchmarks.common.CellModelSplitting`. The electro problem
+drives the active stress of the
+solid problem through the fraction of activated tissue. The benchmark
+reports throughput metrics and the activation time of the base.
+
+Example of usage::
+
+    mpirun -n 4 python -m m3h3.benchmarks.electromechanics --resolution 20
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+import dolfin as df
+from dolfin import (Function, FunctionSpace, MeshFunction, Point,
+                    VectorFunctionSpace, facets)
+
+from geometry import HeartGeometry, MarkerFunctions, Microstructure
+
+from m3h3 import M3H3, Interaction, Parameters, Physics
+from m3h3.material import HolzapfelOgden
+from m3h3.ode import Tentusscher_panfilov_2006_M_cell
+from m3h3.benchmarks.common import (argument_parser, load_reference,
+                                    set_solver_parameters, summarize,
+                                    write_results, CellModelSplitting,
+                                    Stopwatch)
+from m3h3.benchmarks.niederer_slab import CHI, C_M, PointActivation
+
+
+# Semi-axes (mm) of the endo- and epicardial ellipsoids and base height. The
+# base plane passes through the origin, as the cavity volume of
+# m3h3.circulation assumes.
+R_SHORT_ENDO, R_LONG_ENDO = 7.0, 17.0
+R_SHORT_EPI, R_LONG_EPI = 10.0, 20.0
+BASE_Z = 0.0
+
+MARKERS = {'BASE': (10, 2), 'ENDO': (30, 2), 'EPI': (40, 2),
+           'STIMULUS': (1, 3), 'NONE': (0, 3)}
+
+
+def ellipsoid_geometry(resolution=20, segments=40):
+    """Returns a HeartGeometry of a truncated ellipsoidal left ventricle with
+    base, endo- and epicardium marked in the facet function, the apex marked
+    as stimulus region in the cell function and a rule-based
+    microstructure. Requires mshr.
+    """
+    import mshr
+
+    far = 2*R_LONG_EPI
+    domain = mshr.Ellipsoid(Point(0, 0, 0), R_SHORT_EPI, R_SHORT_EPI,
+                                                        R_LONG_EPI, segments)\
+            - mshr.Ellipsoid(Point(0, 0, 0), R_SHORT_ENDO, R_SHORT_ENDO,
+                                                        R_LONG_ENDO, segments)\
+            - mshr.Box(Point(-far, -far, BASE_Z), Point(far, far, far))
+    mesh = mshr.generate_mesh(domain, resolution)
+
+    def level(x, r_short, r_long):
+        return (x[0]**2 + x[1]**2)/r_short**2 + x[2]**2/r_long**2
+
+    ffun = MeshFunction("size_t", mesh, 2, 0)
+    for facet in facets(mesh):
+        if not facet.exterior():
+            continue
+        x = facet.midpoint().array()
+        if abs(x[2] - BASE_Z) < 1e-3*R_LONG_EPI:
+            ffun[facet] = MARKERS['BASE'][0]
+        elif abs(level(x, R_SHORT_ENDO, R_LONG_ENDO) - 1)\
+                                < abs(level(x, R_SHORT_EPI, R_LONG_EPI) - 1):
+            ffun[facet] = MARKERS['ENDO'][0]
+        else:
+            ffun[facet] = MARKERS['EPI'][0]
+
+    cfun = MeshFunction("size_t", mesh, 3, 0)
+    apex = df.CompiledSubDomain("x[2] < -R + 2.0", R=R_LONG_ENDO)
+    apex.mark(cfun, MARKERS['STIMULUS'][0])
+
+    return HeartGeometry(mesh, markers=MARKERS,
+                            microstructure=_microstructure(mesh),
+                            markerfunctions=MarkerFunctions(ffun=ffun,
+                                                                cfun=cfun))
+
+
+def _microstructure(mesh):
+    # Circumferential fibres, sheet normals along the gradient of the
+    # ellipsoidal coordinate and sheets orthogonal to both.
+    V = VectorFunctionSpace(mesh, "P", 1)
+    x = V.tabulate_dof_coordinates().reshape((-1, 3))
+    r_short = 0.5*(R_SHORT_ENDO + R_SHORT_EPI)
+    r_long = 0.5*(R_LONG_ENDO + R_LONG_EPI)
+
+    n = np.column_stack((x[:, 0]/r_short**2, x[:, 1]/r_short**2,
+                                                        x[:, 2]/r_long**2))
+    f = np.column_stack((-x[:, 1], x[:, 0], np.zeros(len(x))))
+    f[np.linalg.norm(f, axis=1) < 1e-8] = (1.0, 0.0, 0.0)
+    n /= np.linalg.norm(n, axis=1)[:, None]
+    f -= np.sum(f*n, axis=1)[:, None]*n
+    f /= np.linalg.norm(f, axis=1)[:, None]
+    s = np.cross(n, f)
+
+    fields = []
+    for values in (f, s, n):
+        field = Function(V)
+        array = field.vector().get_local()
+        for i in range(3):
+            dofs = V.sub(i).dofmap().dofs()
+            local = dofs - V.dofmap().ownership_range()[0]
+            array[local] = values[local, i]
+        field.vector().set_local(array)
+        field.vector().apply("insert")
+        fields.append(field)
+    return Microstructure(f0=fields[0], s0=fields[1], n0=fields[2])
+
+
+def run(resolution=20, dt=0.05, solid_dt=None, end_time=50.0,
+        linear_solver=None, preconditioner=None, threshold=0.0,
+        max_activation=0.2, scheme="RL1", reference=None, comm=None):
+    """Runs the benchmark and returns a dict of results.
+
+    Parameters
+    ----------
+    resolution : int
+        mshr mesh resolution.
+    dt, solid_dt : float
+        Time step sizes of the electro and solid problem in ms. The solid
+        time step defaults to dt.
+    end_time : float
+        Simulated time in ms.
+    linear_solver, preconditioner : str, optional
+        Linear solver configuration of the electro problem.
+    threshold : float
+        Transmembrane potential (mV) that defines activation.
+    max_activation : float
+        Active stress (kPa) if the whole ventricle is activated.
+    scheme : str
+        Name of the cbcbeat ODE scheme of the cell model.
+    reference : dict, optional
+        Results of a reference run to compute the activation time error.
+    """
+    comm = comm if comm is not None else df.MPI.comm_world
+    solid_dt = solid_dt if solid_dt is not None else dt
+    config = OrderedDict([("resolution", resolution), ("dt", dt),
+                          ("solid_dt", solid_dt), ("end_time", end_time),
+                          ("linear_solver", linear_solver),
+                          ("preconditioner", preconditioner),
+                          ("threshold", threshold),
+                          ("max_activation", max_activation),
+                          ("scheme", scheme)])
+
+    geometry = ellipsoid_geometry(resolution)
+    parameters = Parameters("M3H3")
+    parameters["end_time"] = end_time
+    parameters.set_electro_parameters()
+    electro = parameters[str(Physics.ELECTRO)]
+    electro["dt"] = dt
+    electro["M_i"] = 0.17/(CHI*C_M)
+    electro["M_e"] = 0.62/(CHI*C_M)
+    electro["I_s"].update({"amplitude": 50.0/(CHI*C_M), "duration": 2.0,
+                                                                "period": 0})
+    set_solver_parameters(electro, linear_solver, preconditioner)
+    parameters.set_solid_parameters({"dt": solid_dt})
+
+    activation = Function(FunctionSpace(geometry.mesh, "R", 0))
+    material = HolzapfelOgden(activation=activation,
+                              parameters=HolzapfelOgden.default_parameters(),
+                              active_model="active_stress",
+                              f0=geometry.f0, s0=geometry.s0, n0=geometry.n0)
+    model = M3H3(geometry, parameters, material=material,
+                    cell_model=Tentusscher_panfilov_2006_M_cell(),
+                    interactions=[Interaction(Physics.ELECTRO, Physics.SOLID)])
+
+    prev_current, solution = model.get_solution_fields()[str(Physics.ELECTRO)]
+    CellModelSplitting.couple(model, scheme)
+    num_dofs = prev_current.function_space().dim()
+
+    def couple(time, solution_fields):
+        v = prev_current.vector().get_local()
+        activated = df.MPI.sum(comm, float(np.count_nonzero(v >= threshold)))
+        activation.assign(df.Constant(max_activation*activated/num_dofs))
+    model.register_callback(couple, every=solid_dt)
+
+    base = (0.0, R_SHORT_ENDO + 0.5*(R_SHORT_EPI - R_SHORT_ENDO), BASE_Z)
+    tracker = PointActivation(prev_current, {"base": base}, threshold)
+    model.register_callback(tracker)
+
+    with Stopwatch(comm) as stopwatch:
+        for _ in model.solve((0.0, end_time)):
+            pass
+
+    activation_times = tracker.gather(comm)
+    metrics = OrderedDict([("activation_times", activation_times)])
+    if reference is not None:
+        t = activation_times["base"]
+        t_ref = reference["activation_times"]["base"]
+        metrics["activation_time_error"] = abs(t - t_ref)\
+                                        if None not in (t, t_ref) else None
+
+    num_steps = int(round(end_time/dt))
+    total_dofs = solution.function_space().dim()\
+                            + model.solid_problem.state_space.dim()
+    return summarize("electromechanics", config, comm, stopwatch.elapsed,
+                        end_time, total_dofs, num_steps, mesh=geometry.mesh,
+                        function_space=solution.function_space(),
+                        cfun=geometry.cfun,
+                        cell_model=model.electro_problem.cell_model,
+                        **metrics)
+
+
+def main():
+    parser = argument_parser(__doc__.split("\n\n")[0])
+    parser.add_argument("--resolution", type=int, default=20,
+                        help="mshr mesh resolution")
+    parser.add_argument("--solid-dt", type=float, default=None,
+                        help="time step size of the solid problem in ms")
+    parser.add_argument("--threshold", type=float, default=0.0,
+                        help="activation threshold in mV")
+    parser.add_argument("--scheme", default="RL1",
+                        help="ODE scheme of the cell model")
+    args = parser.parse_args()
+    comm = df.MPI.comm_world
+    results = run(resolution=args.resolution, dt=args.dt or 0.05,
+                  solid_dt=args.solid_dt, end_time=args.end_time or 50.0,
+                  linear_solver=args.linear_solver,
+                  preconditioner=args.preconditioner,
+                  threshold=args.threshold, scheme=args.scheme,
+                  reference=load_reference(args.reference), comm=comm)
+    write_results(results, args.output, comm)
+
+
+if __name__ == "__main__":
+    main()
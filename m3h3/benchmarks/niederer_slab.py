@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""The N-version benchmark of Niederer et al. (2011), "Verification of
+cardiac tissue electrophysiology simulators using an N-version benchmark",
+Phil. Trans. R. Soc. A 369:4331-4351.
+
+A 20 x 7 x 3 mm slab with fibres along its long axis is stimulated in a
+1.5 mm cube at one corner. The conductivities are transversely isotropic,
+with the values of the original publication. The ionic current of the ten
+Tusscher-Panfilov (2006) M cell model is added to the bidomain equations
+by operator splitting, see
+:py:class:`m3h3.benchmarks.common.CellModelSplitting`. The benchmark
+reports throughput metrics and the activation times at the points P1-P9 of
+the original publication. If the results of a reference run (e.g.
+at the finest resolution) are given, the activation time errors at these
+points are reported as well.
+
+Example of usage::
+
+    mpirun -n 4 python -m m3h3.benchmarks.niederer_slab --dx 0.2 --dt 0.01
+"""
+
+import math
+from collections import OrderedDict
+
+import dolfin as df
+from dolfin import (BoxMesh, CompiledSubDomain, Constant, MeshFunction,
+                    Point, VectorFunctionSpace)
+
+from geometry import HeartGeometry, MarkerFunctions, Microstructure
+
+from m3h3 import M3H3, Parameters, Physics
+from m3h3.ode import Tentusscher_panfilov_2006_M_cell
+from m3h3.benchmarks.common import (argument_parser, load_reference,
+                                    set_solver_parameters, summarize,
+                                    write_results, CellModelSplitting,
+                                    Stopwatch)
+
+
+SLAB = (20.0, 7.0, 3.0) # mm
+STIMULUS_SIZE = 1.5 # mm
+
+POINTS = OrderedDict([("P1", (0.0, 0.0, 0.0)), ("P2", (0.0, 7.0, 0.0)),
+                      ("P3", (20.0, 0.0, 0.0)), ("P4", (20.0, 7.0, 0.0)),
+                      ("P5", (0.0, 0.0, 3.0)), ("P6", (0.0, 7.0, 3.0)),
+                      ("P7", (20.0, 0.0, 3.0)), ("P8", (20.0, 7.0, 3.0)),
+                      ("P9", (10.0, 3.5, 1.5))])
+
+# Surface-to-volume ratio (1/mm) and membrane capacitance (uF/mm^2)
+CHI = 140.0
+C_M = 0.01
+
+
+def slab_geometry(dx, comm=None):
+    """Returns a HeartGeometry of the benchmark slab with resolution dx (mm),
+    fibres along the x axis and the stimulus region marked in the cell
+    function.
+    """
+    comm = comm if comm is not None else df.MPI.comm_world
+    N = [max(int(round(L/dx)), 1) for L in SLAB]
+    mesh = BoxMesh(comm, Point(0.0, 0.0, 0.0), Point(*SLAB), *N)
+
+    markers = {'STIMULUS': 1, 'NONE': 0}
+    cfun = MeshFunction("size_t", mesh, mesh.topology().dim(), 0)
+    stimulus = CompiledSubDomain("x[0] <= L + tol && x[1] <= L + tol "
+                                 "&& x[2] <= L + tol", L=STIMULUS_SIZE,
+                                 tol=1e-8)
+    stimulus.mark(cfun, markers['STIMULUS'])
+
+    V = VectorFunctionSpace(mesh, "P", 1)
+    f0, s0, n0 = [df.interpolate(Constant(direction), V) for direction in
+                    ((1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0))]
+    return HeartGeometry(mesh, markers=markers,
+                            microstructure=Microstructure(f0=f0, s0=s0, n0=n0),
+                            markerfunctions=MarkerFunctions(cfun=cfun))
+
+
+class PointActivation(object):
+    """Callback for :py:meth:`m3h3.M3H3.solve` that records the first time
+    the transmembrane potential crosses a threshold at a set of points.
+    """
+
+    def __init__(self, function, points, threshold):
+        self.function = function
+        self.threshold = threshold
+        mesh = function.function_space().mesh()
+        tree = mesh.bounding_box_tree()
+        self._local = OrderedDict()
+        for name, x in points.items():
+            point = Point(*x)
+            if tree.compute_first_entity_collision(point) < mesh.num_cells():
+                self._local[name] = point
+        self._previous = {}
+        self.times = OrderedDict((name, math.inf) for name in points.keys())
+
+
+    def __call__(self, time, solution_fields):
+        for name, point in self._local.items():
+            if self.times[name] < math.inf:
+                continue
+            v = self.function(point)
+            if name in self._previous and v >= self.threshold:
+                t0, v0 = self._previous[name]
+                s = (self.threshold - v0)/(v - v0) if v != v0 else 1.0
+                self.times[name] = t0 + s*(time - t0)
+            self._previous[name] = (time, v)
+
+
+    def gather(self, comm):
+        """Returns the activation times of all points, or None for points
+        that have not been activated. This is a collective call.
+        """
+        times = OrderedDict()
+        for name, t in self.times.items():
+            t = df.MPI.min(comm, t)
+            times[name] = t if t < math.inf else None
+        return times
+
+
+def run(dx=0.5, dt=0.05, end_time=100.0, linear_solver=None,
+        preconditioner=None, threshold=0.0, scheme="RL1", reference=None,
+        comm=None):
+    """Runs the benchmark and returns a dict of results.
+
+    Parameters
+    ----------
+    dx : float
+        Mesh resolution in mm.
+    dt : float
+        Time step size in ms.
+    end_time : float
+        Simulated time in ms.
+    linear_solver, preconditioner : str, optional
+        Linear solver configuration of the electro problem.
+    threshold : float
+        Transmembrane potential (mV) that defines activation.
+    scheme : str
+        Name of the cbcbeat ODE scheme of the cell model.
+    reference : dict, optional
+        Results of a reference run to compute activation time errors.
+    """
+    comm = comm if comm is not None else df.MPI.comm_world
+    config = OrderedDict([("dx", dx), ("dt", dt), ("end_time", end_time),
+                          ("linear_solver", linear_solver),
+                          ("preconditioner", preconditioner),
+                          ("threshold", threshold), ("scheme", scheme)])
+
+    geometry = slab_geometry(dx, comm)
+    parameters = Parameters("M3H3")
+    parameters["end_time"] = end_time
+    parameters.set_electro_parameters()
+    electro = parameters[str(Physics.ELECTRO)]
+    electro["dt"] = dt
+    # Longitudinal and transverse conductivities (mS/mm) scaled by chi*C_m,
+    # so that time is in ms and the potential in mV.
+    electro["M_i"] = 0.17/(CHI*C_M)
+    electro["M_e"] = 0.62/(CHI*C_M)
+    for name in ("M_i_t", "M_i_n"):
+        electro[name] = 0.019/(CHI*C_M)
+    for name in ("M_e_t", "M_e_n"):
+        electro[name] = 0.24/(CHI*C_M)
+    # 50000 uA/cm^3 for 2 ms
+    electro["I_s"].update({"amplitude": 50.0/(CHI*C_M), "duration": 2.0,
+                                                                "period": 0})
+    set_solver_parameters(electro, linear_solver, preconditioner)
+
+    model = M3H3(geometry, parameters,
+                    cell_model=Tentusscher_panfilov_2006_M_cell())
+    prev_current, solution = model.get_solution_fields()[str(Physics.ELECTRO)]
+    CellModelSplitting.couple(model, scheme)
+
+    activation = PointActivation(prev_current, POINTS, threshold)
+    model.register_callback(activation)
+
+    with Stopwatch(comm) as stopwatch:
+        for _ in model.solve((0.0, end_time)):
+            pass
+
+    activation_times = activation.gather(comm)
+    metrics = OrderedDict([("activation_times", activation_times)])
+    if reference is not None:
+        errors = OrderedDict()
+        for name, t in activation_times.items():
+            t_ref = reference["activation_times"].get(name)
+            errors[name] = abs(t - t_ref) if None not in (t, t_ref) else None
+        metrics["activation_time_error"] = errors
+        known = [e for e in errors.values() if e is not None]
+        metrics["max_activation_time_error"] = max(known) if known else None
+
+    num_steps = int(round(end_time/dt))
+    return summarize("niederer_slab", config, comm, stopwatch.elapsed,
+                        end_time, solution.function_space().dim(), num_steps,
+                        mesh=geometry.mesh,
+                        function_space=solution.function_space(),
+                        cfun=geometry.cfun,
+                        cell_model=model.electro_problem.cell_model,
+                        **metrics)
+
+
+def main():
+    parser = argument_parser(__doc__.split("\n\n")[0])
+    parser.add_argument("--dx", type=float, default=0.5,
+                        help="mesh resolution in mm")
+    parser.add_argument("--threshold", type=float, default=0.0,
+                        help="activation threshold in mV")
+    parser.add_argument("--scheme", default="RL1",
+                        help="ODE scheme of the cell model")
+    args = parser.parse_args()
+    comm = df.MPI.comm_world
+    results = run(dx=args.dx, dt=args.dt or 0.05,
+                  end_time=args.end_time or 100.0,
+                  linear_solver=args.linear_solver,
+                  preconditioner=args.preconditioner,
+                  threshold=args.threshold, scheme=args.scheme,
+                  reference=load_reference(args.reference), comm=comm)
+    write_results(results, args.output, comm)
+
+
+if __name__ == "__main__":
+    main()
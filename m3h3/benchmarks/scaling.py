@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""Strong and weak scaling harness for the M3H3 benchmarks.
+
+The harness runs a benchmark with ``mpirun`` for a range of process counts,
+either with a fixed problem size (strong scaling) or with a problem size
+proportional to the number of processes (weak scaling). From the per-rank
+phase timings, dof and cell counts that every benchmark reports it computes
+the parallel efficiency and the load imbalance (maximum over mean) of every
+phase, including the cell model integration (``ode``), and of the cells per
+marked region, which shows where heterogeneous regions are distributed
+unevenly. If a benchmark reports the estimated cost of a cell per region,
+see :py:func:`m3h3.partitioning.cell_costs`, the regions are weighted by
+it, and the imbalance of the total estimated workload is reported.
+
+Example of usage::
+
+    python -m m3h3.benchmarks.scaling niederer_slab --ranks 1 2 4 8 \\
+        --mode weak --size 0.5 --output scaling.json -- --end-time 10
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from collections import OrderedDict
+
+
+# Name of the size option of each benchmark and the exponent with which it
+# has to be scaled by the number of processes to keep the work per process
+# constant in 3D.
+SIZE_OPTIONS = {"niederer_slab": ("--dx", -1.0/3),
+                "electromechanics": ("--resolution", 1.0/3)}
+
+# Environment variables of a surrounding MPI job that must not leak into the
+# mpirun child processes.
+_MPI_ENVIRONMENT_PREFIXES = ("OMPI_", "PMIX_", "PMI_", "HYDRA_", "I_MPI_")
+
+
+def run_benchmark(benchmark, num_processes, arguments, mpirun="mpirun",
+                                                        mpirun_arguments=()):
+    """Runs a benchmark on num_processes processes and returns its results.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output = os.path.join(tmpdir, "results.json")
+        command = [mpirun, "-n", str(num_processes)] + list(mpirun_arguments)\
+                    + [sys.executable, "-m",
+                       "m3h3.benchmarks.{}".format(benchmark)]\
+                    + list(arguments) + ["--output", output]
+        environment = {key: value for key, value in os.environ.items()
+                        if not key.startswith(_MPI_ENVIRONMENT_PREFIXES)}
+        subprocess.run(command, check=True, env=environment,
+                                                    stdout=subprocess.DEVNULL)
+        with open(output) as f:
+            return json.load(f)
+
+
+def imbalance(values):
+    """Returns the ratio of the maximum to the mean of values, or None if the
+    mean is zero.
+    """
+    mean = sum(values)/len(values)
+    return max(values)/mean if mean > 0 else None
+
+
+def analyze(runs, mode):
+    """Computes speedup, parallel efficiency and load imbalance of a series of
+    benchmark results relative to the first (smallest) run.
+    """
+    base = runs[0]
+    analysis = []
+    for run in runs:
+        n = run["num_processes"]
+        ratio = base["wall_time"]/run["wall_time"]
+        if mode == "strong":
+            efficiency = ratio*base["num_processes"]/n
+        else:
+            efficiency = ratio
+        per_rank = run["per_rank"]
+
+        phases = OrderedDict()
+        for name in _union(rank["timers"] for rank in per_rank):
+            times = [rank["timers"].get(name, 0.0) for rank in per_rank]
+            phases[name] = OrderedDict([("max", max(times)),
+                                        ("imbalance", imbalance(times))])
+
+        region_costs = run.get("region_costs")
+        regions = OrderedDict()
+        workload = [0.0]*len(per_rank)
+        for name in _union(rank.get("regions", {}) for rank in per_rank):
+            cells = [rank.get("regions", {}).get(name, 0) for rank in per_rank]
+            cost = region_costs["costs"].get(name, region_costs["default"])\
+                                        if region_costs is not None else 1.0
+            regions[name] = OrderedDict([("cost", cost),
+                                        ("max_workload", max(cells)*cost),
+                                        ("imbalance", imbalance(cells))])
+            workload = [w + c*cost for w, c in zip(workload, cells)]
+
+        result = OrderedDict()
+        result["num_processes"] = n
+        result["num_dofs"] = run["num_dofs"]
+        result["wall_time"] = run["wall_time"]
+        result["speedup"] = ratio
+        result["efficiency"] = efficiency
+        if "dofs" in per_rank[0]:
+            result["dof_imbalance"] = imbalance(
+                                        [rank["dofs"] for rank in per_rank])
+        if "cells" in per_rank[0]:
+            result["cell_imbalance"] = imbalance(
+                                        [rank["cells"] for rank in per_rank])
+        result["region_imbalance"] = regions
+        if regions:
+            result["workload_imbalance"] = imbalance(workload)
+        result["phases"] = phases
+        analysis.append(result)
+    return analysis
+
+
+def format_table(analysis):
+    """Returns a text table of the most important scaling metrics.
+    """
+    lines = ["{:>6} {:>12} {:>10} {:>8} {:>8} {:>8} {:>9}  {}".format(
+                "ranks", "dofs", "wall [s]", "speedup", "eff.", "dof imb.",
+                "load imb.", "worst phase imbalance")]
+    for result in analysis:
+        worst = max(((p["imbalance"] or 0.0, name)
+                        for name, p in result["phases"].items()),
+                    default=(0.0, "-"))
+        lines.append("{:>6} {:>12} {:>10.3f} {:>8.2f} {:>8.2f} {:>8.2f} "
+                     "{:>9.2f}  {} ({:.2f})".format(result["num_processes"],
+                        result["num_dofs"], result["wall_time"],
+                        result["speedup"], result["efficiency"],
+                        result.get("dof_imbalance") or 0.0,
+                        result.get("workload_imbalance") or 0.0, worst[1],
+                        worst[0]))
+    return "\n".join(lines)
+
+
+def _union(dicts):
+    keys = OrderedDict()
+    for d in dicts:
+        for key in d.keys():
+            keys[key] = None
+    return list(keys.keys())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("benchmark", choices=sorted(SIZE_OPTIONS.keys()))
+    parser.add_argument("--ranks", type=int, nargs="+", default=[1, 2, 4],
+                        help="process counts to run the benchmark on")
+    parser.add_argument("--mode", choices=["strong", "weak"], default="strong")
+    parser.add_argument("--size", type=float, default=None,
+                        help="problem size option of the benchmark on the "
+                             "smallest process count")
+    parser.add_argument("--mpirun", default="mpirun")
+    parser.add_argument("--mpirun-args", default="",
+                        help="extra arguments to mpirun, e.g. "
+                             "'--oversubscribe'")
+    parser.add_argument("--output", default=None,
+                        help="write raw results and analysis as JSON")
+    args, benchmark_arguments = parser.parse_known_args()
+    benchmark_arguments = [a for a in benchmark_arguments if a != "--"]
+
+    option, exponent = SIZE_OPTIONS[args.benchmark]
+    ranks = sorted(args.ranks)
+    runs = []
+    for n in ranks:
+        arguments = list(benchmark_arguments)
+        if args.size is not None:
+            size = args.size
+            if args.mode == "weak":
+                size *= (n/ranks[0])**exponent
+            if option == "--resolution":
+                size = int(round(size))
+            arguments += [option, str(size)]
+        runs.append(run_benchmark(args.benchmark, n, arguments, args.mpirun,
+                                                    args.mpirun_args.split()))
+
+    analysis = analyze(runs, args.mode)
+    print(format_table(analysis))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"mode": args.mode, "runs": runs, "analysis": analysis},
+                                                                f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Pacing benchmark of a single ten Tusscher-Panfilov (2006) M cell.
+
+The cell is paced with a periodic stimulus for a number of beats. The
+benchmark reports throughput metrics and the action potential of the last
+beat (resting and peak potential, APD90). If the results of a reference run
+(e.g. with a small time step) are given, the APD90 error is reported as well.
+
+Example of usage::
+
+    python -m m3h3.benchmarks.single_cell --dt 0.01 --scheme RL1
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+import dolfin as df
+from dolfin import Constant, Expression
+
+import cbcbeat
+
+from m3h3.ode import Tentusscher_panfilov_2006_M_cell
+from m3h3.benchmarks.common import (argument_parser, load_reference,
+                                    summarize, write_results, Stopwatch)
+
+
+def action_potential(times, v):
+    """Returns resting and peak potential and the APD90 of the action
+    potential in the trace v(times).
+    """
+    v_rest = v[0]
+    peak = int(np.argmax(v))
+    v_peak = v[peak]
+    v_90 = v_peak - 0.9*(v_peak - v_rest)
+
+    def crossing(i):
+        # Linear interpolation between samples i and i+1
+        s = (v_90 - v[i])/(v[i+1] - v[i])
+        return times[i] + s*(times[i+1] - times[i])
+
+    up = np.nonzero((v[:peak] < v_90) & (v[1:peak+1] >= v_90))[0]
+    down = np.nonzero((v[peak:-1] >= v_90) & (v[peak+1:] < v_90))[0]
+    apd90 = crossing(peak + down[0]) - crossing(up[0])\
+                                        if len(up) and len(down) else None
+    return OrderedDict([("v_rest", float(v_rest)), ("v_peak", float(v_peak)),
+                        ("apd90", apd90)])
+
+
+def run(dt=0.01, num_beats=5, cycle_length=1000.0, scheme="RL1",
+        amplitude=52.0, duration=1.0, reference=None):
+    """Runs the benchmark and returns a dict of results.
+
+    Parameters
+    ----------
+    dt : float
+        Time step size in ms.
+    num_beats : int
+        Number of paced beats.
+    cycle_length : float
+        Pacing cycle length in ms.
+    scheme : str
+        Name of the cbcbeat ODE scheme.
+    amplitude, duration : float
+        Stimulus current (pA/pF) and duration (ms).
+    reference : dict, optional
+        Results of a reference run to compute the APD90 error.
+    """
+    comm = df.MPI.comm_self
+    config = OrderedDict([("dt", dt), ("num_beats", num_beats),
+                          ("cycle_length", cycle_length), ("scheme", scheme),
+                          ("amplitude", amplitude), ("duration", duration)])
+
+    time = Constant(0.0)
+    model = Tentusscher_panfilov_2006_M_cell()
+    model.stimulus = Expression("fmod(t, period) < duration ? amplitude : 0.0",
+                                t=time, period=cycle_length, duration=duration,
+                                amplitude=amplitude, degree=0)
+    parameters = cbcbeat.SingleCellSolver.default_parameters()
+    parameters["scheme"] = scheme
+    solver = cbcbeat.SingleCellSolver(model, time, parameters)
+    vs_, vs = solver.solution_fields()
+    vs_.assign(model.initial_conditions())
+
+    end_time = num_beats*cycle_length
+    last_beat = end_time - cycle_length
+    times, v = [], []
+    with Stopwatch(comm) as stopwatch:
+        for ((t0, t1), fields) in solver.solve((0.0, end_time), dt):
+            if t1 >= last_beat:
+                times.append(t1)
+                v.append(fields[1].vector().get_local()[0])
+
+    metrics = OrderedDict([("action_potential",
+                        action_potential(np.array(times), np.array(v)))])
+    if reference is not None:
+        apd90 = metrics["action_potential"]["apd90"]
+        apd90_ref = reference["action_potential"]["apd90"]
+        metrics["apd90_error"] = abs(apd90 - apd90_ref)\
+                                if None not in (apd90, apd90_ref) else None
+
+    num_steps = int(round(end_time/dt))
+    return summarize("single_cell", config, comm, stopwatch.elapsed,
+                        end_time, model.num_states() + 1, num_steps,
+                        **metrics)
+
+
+def main():
+    parser = argument_parser(__doc__.split("\n\n")[0])
+    parser.add_argument("--num-beats", type=int, default=5)
+    parser.add_argument("--cycle-length", type=float, default=1000.0,
+                        help="pacing cycle length in ms")
+    parser.add_argument("--scheme", default="RL1", help="ODE scheme")
+    args = parser.parse_args()
+    results = run(dt=args.dt or 0.01, num_beats=args.num_beats,
+                  cycle_length=args.cycle_length, scheme=args.scheme,
+                  reference=load_reference(args.reference))
+    write_results(results, args.output, df.MPI.comm_self)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""Startup benchmark of ``import m3h3``.
+
+The import is timed in fresh interpreters, so that every repetition pays the
+full cost of loading the modules, as every rank of an MPI job does. The
+benchmark also reports which of the physics-specific dependencies were
+loaded, which should only happen on first use of the physics. If a maximum
+time is given, the benchmark fails if the median import time exceeds it,
+which can be used to catch startup regressions.
+
+Example of usage::
+
+    python -m m3h3.benchmarks.startup --repeats 5 --max-time 3.0
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+import dolfin as df
+
+from m3h3.benchmarks.common import write_results
+
+
+# Modules that an electrophysiology-only run must not load at import time
+LAZY_MODULES = ["pulse", "cbcbeat", "m3h3.material",
+                "m3h3.pde.solid_problem", "m3h3.pde.fluid_problem",
+                "m3h3.pde.porous_problem", "m3h3.pde.solver.solid_solver",
+                "m3h3.pde.solver.fluid_solver",
+                "m3h3.pde.solver.porous_solver",
+                "m3h3.pde.eikonal_problem", "m3h3.pde.solver.eikonal_solver",
+                "m3h3.ode.tentusscher_panfilov_2006_M_cell"]
+
+_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, sorted(sys.modules.keys())]))
+"""
+
+
+def import_time(module="m3h3", preload=None):
+    """Returns the time in s to import module in a fresh interpreter and the
+    names of all modules that are loaded afterwards.
+
+    Parameters
+    ----------
+    module : str
+        Module to import.
+    preload : str, optional
+        Module that is imported before the timer starts, e.g. ``"dolfin"``
+        to measure the cost of M3H3 alone.
+    """
+    script = _SCRIPT.format(module=module)
+    if preload is not None:
+        script = "import {}\n".format(preload) + script
+    output = subprocess.check_output([sys.executable, "-c", script])
+    elapsed, modules = json.loads(output.decode().strip().splitlines()[-1])
+    return elapsed, modules
+
+
+def run(module="m3h3", repeats=5, preload=None):
+    """Runs the benchmark and returns a dict of results.
+
+    Parameters
+    ----------
+    module : str
+        Module to import.
+    repeats : int
+        Number of fresh interpreters the import is timed in.
+    preload : str, optional
+        Module that is imported before the timer starts.
+    """
+    config = OrderedDict([("module", module), ("repeats", repeats),
+                          ("preload", preload)])
+    times = []
+    for _ in range(repeats):
+        elapsed, modules = import_time(module, preload)
+        times.append(elapsed)
+
+    results = OrderedDict()
+    results["benchmark"] = "startup"
+    results["config"] = config
+    results["import_time"] = OrderedDict([("min", float(np.min(times))),
+                                          ("median", float(np.median(times))),
+                                          ("max", float(np.max(times)))])
+    results["num_modules"] = len(modules)
+    results["eagerly_loaded"] = [m for m in LAZY_MODULES if m in modules]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--module", default="m3h3")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--preload", default=None,
+                        help="module imported before timing, e.g. dolfin")
+    parser.add_argument("--max-time", type=float, default=None,
+                        help="fail if the median import time in s exceeds "
+                             "this")
+    parser.add_argument("--output", default=None,
+                        help="write results as JSON to this file")
+    args = parser.parse_args()
+    results = run(module=args.module, repeats=args.repeats,
+                  preload=args.preload)
+    write_results(results, args.output, df.MPI.comm_self)
+    if args.max_time is not None\
+                    and results["import_time"]["median"] > args.max_time:
+        sys.exit("Median import time {:.2f} s exceeds {:.2f} s".format(
+                    results["import_time"]["median"], args.max_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""This module implements full-state checkpointing and restart of M3H3
+simulations using dolfin's parallel HDF5 interface.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+import dolfin as df
+from dolfin import HDF5File, LogLevel, Vector
+
+from m3h3.utils import log
+
+
+class Checkpoint(object):
+    """Writes and reads the state of an M3H3 simulation to and from a single
+    HDF5 file.
+
+    Every state field is stored as a time series under its own group, e.g.
+    ``/Electro/prev_current/vector_<n>``, together with the dof layout that
+    dolfin needs to redistribute the field. Reading a field therefore works
+    on any number of MPI ranks, as long as the mesh is the same. All reads
+    and writes are collective.
+
+    Checkpoints are incremental: a field is only appended to the file if it
+    has changed since it was last written. Changes are detected by comparing
+    a hash of the field's dof vector in global dof order.
+
+    Parameters
+    ----------
+    path : str
+        Path to the HDF5 checkpoint file.
+    comm : MPI communicator, optional
+        Communicator used for the collective I/O. Defaults to
+        ``dolfin.MPI.comm_world``.
+    """
+
+    META = "/checkpoint"
+
+    def __init__(self, path, comm=None):
+        self.path = path
+        self.comm = comm if comm is not None else df.MPI.comm_world
+
+
+    def exists(self):
+        """Returns True if the checkpoint file exists on rank 0.
+        """
+        exists = os.path.isfile(self.path) if df.MPI.rank(self.comm) == 0\
+                                                                    else False
+        return bool(df.MPI.max(self.comm, float(exists)))
+
+
+    def save(self, time, fields, incremental=True):
+        """Writes a checkpoint.
+
+        Parameters
+        ----------
+        time : float
+            Simulation time of the checkpoint.
+        fields : dict
+            Maps dataset names to the :py:class:`dolfin.Function` objects
+            that make up the simulation state.
+        incremental : bool
+            If True, fields that have not changed since they were last
+            written are skipped.
+
+        Returns
+        -------
+        list of str
+            Names of the datasets that were written.
+        """
+        mode = "a" if self.exists() else "w"
+        written = []
+        hdf = HDF5File(self.comm, self.path, mode)
+        try:
+            if not hdf.has_dataset(self.META):
+                hdf.write(Vector(self.comm, df.MPI.size(self.comm)),
+                                                                    self.META)
+                hdf.attributes(self.META)["count"] = 0
+
+            for name, field in fields.items():
+                fingerprint = _fingerprint(field)
+                if incremental and hdf.has_dataset(name):
+                    attrs = hdf.attributes(name)
+                    if "fingerprint" in attrs.list_attributes()\
+                                    and attrs["fingerprint"] == fingerprint:
+                        continue
+                hdf.write(field, name, time)
+                hdf.attributes(name)["fingerprint"] = fingerprint
+                written.append(name)
+
+            meta = hdf.attributes(self.META)
+            meta["time"] = float(time)
+            meta["count"] = int(meta["count"]) + 1
+        finally:
+            hdf.close()
+
+        log(LogLevel.PROGRESS, "Wrote checkpoint at t = {} to {} ({} of {} "\
+                "fields changed)".format(time, self.path, len(written),
+                                                                len(fields)))
+        return written
+
+
+    def load(self, fields):
+        """Reads the latest checkpointed values into the given fields.
+
+        Parameters
+        ----------
+        fields : dict
+            Maps dataset names to the :py:class:`dolfin.Function` objects
+            that should be restored. The functions may live on a mesh that
+            is distributed differently from the one that was checkpointed.
+
+        Returns
+        -------
+        float
+            Simulation time of the checkpoint.
+        """
+        if not self.exists():
+            msg = "Checkpoint file {} does not exist.".format(self.path)
+            raise IOError(msg)
+
+        hdf = HDF5File(self.comm, self.path, "r")
+        try:
+            time = hdf.attributes(self.META)["time"]
+            for name, field in fields.items():
+                if not hdf.has_dataset(name):
+                    msg = "Checkpoint {} has no dataset {}. Keeping the "\
+                            "current values.".format(self.path, name)
+                    log(LogLevel.WARNING, msg)
+                    continue
+                count = int(hdf.attributes(name)["count"])
+                hdf.read(field, "{}/vector_{}".format(name, count-1))
+        finally:
+            hdf.close()
+
+        log(LogLevel.PROGRESS, "Restored checkpoint at t = {} from "\
+                "{}".format(time, self.path))
+        return time
+
+
+def _fingerprint(field):
+    """Returns a string that identifies the values of a function in the
+    order of the global dofs. Every process hashes its contiguous range of
+    owned dofs, and the hashes are combined in the order of the ranges, so
+    any change of a value, including a permutation, changes the
+    fingerprint. A different dof layout, e.g. after a restart on another
+    number of processes, changes it as well, so the field is written again.
+    """
+    x = field.vector()
+    local = hashlib.sha1(np.ascontiguousarray(x.get_local(),
+                                    dtype=float).tobytes()).hexdigest()
+    comm = field.function_space().mesh().mpi_comm()
+    parts = sorted(comm.allgather((x.local_range(), local)))
+    digest = hashlib.sha1(repr((x.size(), parts)).encode())
+    return digest.hexdigest()
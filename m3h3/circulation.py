@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+"""This module implements lumped-parameter (0D) models of the circulation
+that are coupled to the cavity pressures of the solid mechanics.
+
+A :py:class:`LumpedModel` is a network of compartments connected by
+resistances, optionally with valves that only let blood flow forward. The
+volumes of all compartments are integrated together with a vectorized
+Runge-Kutta scheme. A compartment is either
+
+- a ``"compliance"`` with pressure :math:`p = (V - V_0)/C`,
+- a ``"reservoir"`` with a fixed pressure, e.g. the venous return of an
+  open-loop Windkessel model, or
+- a ``"cavity"``, whose pressure is the cavity pressure of the mechanics.
+
+:py:func:`windkessel` sets up a three-element Windkessel afterload of the
+left ventricle, :py:func:`closed_loop` a closed systemic and pulmonary
+circulation of both ventricles.
+
+:py:class:`Circulation` couples a lumped model to a
+:py:class:`m3h3.pde.SolidProblem`. The cavity volumes of the mechanics are
+boundary integrals over the endocardia whose forms are compiled once. In
+every coupling step, the circulation is integrated at the current cavity
+pressures, which gives the volumes that the cavities should have, and the
+cavity pressures are corrected by the volume mismatch times an estimate of
+the inverse cavity compliance. The mechanics is therefore solved once per
+coupling step, and not repeatedly in a nested pressure iteration. The
+compliance is estimated from the secant of the last two pressure-volume
+pairs.
+
+Units are mmHg, ml and ms. Pressures and volumes of the mechanics are
+converted with scaling factors.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+import dolfin as df
+from dolfin import (FacetNormal, Identity, SpatialCoordinate, det, grad, inner,
+                    inv, split)
+
+from m3h3.output import TimeSeries
+
+
+WINDKESSEL_PARAMETERS = OrderedDict([
+    ("venous_pressure", 8.0),       # mmHg
+    ("mitral_resistance", 5.0),     # mmHg ms/ml
+    ("aortic_resistance", 30.0),    # characteristic impedance, mmHg ms/ml
+    ("arterial_compliance", 1.5),   # ml/mmHg
+    ("arterial_volume", 700.0),     # unstressed volume, ml
+    ("peripheral_resistance", 1000.0),  # mmHg ms/ml
+    ("arterial_pressure", 80.0),    # initial pressure, mmHg
+])
+
+CLOSED_LOOP_PARAMETERS = OrderedDict([
+    ("systemic_arterial_compliance", 1.5),
+    ("systemic_arterial_volume", 700.0),
+    ("systemic_venous_compliance", 100.0),
+    ("systemic_venous_volume", 2800.0),
+    ("pulmonary_arterial_compliance", 4.0),
+    ("pulmonary_arterial_volume", 100.0),
+    ("pulmonary_venous_compliance", 10.0),
+    ("pulmonary_venous_volume", 300.0),
+    ("systemic_resistance", 1000.0),
+    ("pulmonary_resistance", 100.0),
+    ("mitral_resistance", 5.0),
+    ("aortic_resistance", 30.0),
+    ("tricuspid_resistance", 5.0),
+    ("pulmonary_valve_resistance", 10.0),
+    ("blood_volume", 5000.0),       # total volume, ml
+])
+
+
+class LumpedModel(object):
+    """A network of compartments connected by resistances.
+
+    Parameters
+    ----------
+    compartments : list of dict
+        Every compartment has a ``name`` and a ``kind``, which is
+        ``"compliance"`` (with ``compliance`` and unstressed ``volume``),
+        ``"reservoir"`` (with ``pressure``) or ``"cavity"``.
+    connections : list of tuple
+        ``(source, target, resistance, valve)`` of the compartment names,
+        the resistance, and whether the flow is restricted to the direction
+        from source to target.
+    volumes : dict
+        Initial volumes of the compliance and cavity compartments.
+    """
+
+    def __init__(self, compartments, connections, volumes):
+        self.names = [c["name"] for c in compartments]
+        index = {name: i for i, name in enumerate(self.names)}
+        kinds = np.array([c["kind"] for c in compartments])
+        self._compliance = kinds == "compliance"
+        self._reservoir = kinds == "reservoir"
+        self.cavities = [c["name"] for c in compartments
+                                                    if c["kind"] == "cavity"]
+        self._cavity_index = np.array([index[name] for name in self.cavities],
+                                                                    dtype=int)
+        self._C = np.array([c.get("compliance", 1.0) for c in compartments])
+        self._V0 = np.array([c.get("volume", 0.0) for c in compartments])
+        self._p_fixed = np.array([c.get("pressure", 0.0)
+                                                    for c in compartments])
+
+        self.connections = ["{}-{}".format(c[0], c[1]) for c in connections]
+        self._source = np.array([index[c[0]] for c in connections], dtype=int)
+        self._target = np.array([index[c[1]] for c in connections], dtype=int)
+        self._resistance = np.array([c[2] for c in connections], dtype=float)
+        self._valve = np.array([c[3] for c in connections], dtype=bool)
+
+        self.volumes = np.zeros(len(self.names))
+        for name, volume in volumes.items():
+            self.volumes[index[name]] = volume
+
+
+    def pressures(self, volumes, cavity_pressures):
+        """Returns the pressures of all compartments for the given volumes
+        and cavity pressures, in the order of :py:attr:`cavities`.
+        """
+        p = np.where(self._compliance, (volumes - self._V0)/self._C,
+                                                            self._p_fixed)
+        p[self._cavity_index] = cavity_pressures
+        return p
+
+
+    def flows(self, volumes, cavity_pressures):
+        """Returns the flows through all connections.
+        """
+        p = self.pressures(volumes, cavity_pressures)
+        q = (p[self._source] - p[self._target])/self._resistance
+        return np.where(self._valve, np.maximum(q, 0.0), q)
+
+
+    def rate(self, volumes, cavity_pressures):
+        """Returns the rate of change of the volumes.
+        """
+        q = self.flows(volumes, cavity_pressures)
+        n = len(self.names)
+        dV = np.bincount(self._target, weights=q, minlength=n)\
+                            - np.bincount(self._source, weights=q, minlength=n)
+        dV[self._reservoir] = 0.0
+        return dV
+
+
+    def step(self, dt, cavity_pressures, num_steps=1):
+        """Integrates the volumes over dt at fixed cavity pressures with
+        num_steps steps of the classical Runge-Kutta scheme, and returns the
+        new volumes.
+        """
+        h = dt/num_steps
+        V = self.volumes
+        for _ in range(num_steps):
+            k1 = self.rate(V, cavity_pressures)
+            k2 = self.rate(V + 0.5*h*k1, cavity_pressures)
+            k3 = self.rate(V + 0.5*h*k2, cavity_pressures)
+            k4 = self.rate(V + h*k3, cavity_pressures)
+            V = V + h/6.0*(k1 + 2*k2 + 2*k3 + k4)
+        self.volumes = V
+        return V
+
+
+    def cavity_volumes(self):
+        """Returns the volumes of the cavities.
+        """
+        return self.volumes[self._cavity_index]
+
+
+def windkessel(cavity_volume, parameters=None):
+    """Returns a three-element Windkessel model of the left ventricle, with
+    filling from a venous reservoir through the mitral valve.
+
+    Parameters
+    ----------
+    cavity_volume : float
+        Initial volume of the left ventricle in ml.
+    parameters : dict, optional
+        Updates of :py:data:`WINDKESSEL_PARAMETERS`.
+    """
+    p = OrderedDict(WINDKESSEL_PARAMETERS)
+    p.update(parameters or {})
+    compartments = [
+        {"name": "venous", "kind": "reservoir",
+                                            "pressure": p["venous_pressure"]},
+        {"name": "lv", "kind": "cavity"},
+        {"name": "arterial", "kind": "compliance",
+                "compliance": p["arterial_compliance"],
+                "volume": p["arterial_volume"]}]
+    connections = [
+        ("venous", "lv", p["mitral_resistance"], True),
+        ("lv", "arterial", p["aortic_resistance"], True),
+        ("arterial", "venous", p["peripheral_resistance"], False)]
+    arterial_volume = p["arterial_volume"]\
+                            + p["arterial_compliance"]*p["arterial_pressure"]
+    return LumpedModel(compartments, connections,
+                {"lv": cavity_volume, "arterial": arterial_volume})
+
+
+def closed_loop(cavity_volumes, parameters=None):
+    """Returns a closed-loop model of the systemic and pulmonary
+    circulation. The blood volume that is not in the ventricles is
+    distributed such that all compliance compartments have the same
+    pressure.
+
+    Parameters
+    ----------
+    cavity_volumes : dict
+        Initial volumes of ``"lv"`` and ``"rv"`` in ml.
+    parameters : dict, optional
+        Updates of :py:data:`CLOSED_LOOP_PARAMETERS`.
+    """
+    p = OrderedDict(CLOSED_LOOP_PARAMETERS)
+    p.update(parameters or {})
+    vessels = ["systemic_arterial", "systemic_venous", "pulmonary_arterial",
+               "pulmonary_venous"]
+    compartments = [{"name": "lv", "kind": "cavity"},
+                    {"name": "rv", "kind": "cavity"}]
+    compartments += [{"name": name, "kind": "compliance",
+                      "compliance": p[name + "_compliance"],
+                      "volume": p[name + "_volume"]} for name in vessels]
+    connections = [
+        ("pulmonary_venous", "lv", p["mitral_resistance"], True),
+        ("lv", "systemic_arterial", p["aortic_resistance"], True),
+        ("systemic_arterial", "systemic_venous", p["systemic_resistance"],
+                                                                        False),
+        ("systemic_venous", "rv", p["tricuspid_resistance"], True),
+        ("rv", "pulmonary_arterial", p["pulmonary_valve_resistance"], True),
+        ("pulmonary_arterial", "pulmonary_venous", p["pulmonary_resistance"],
+                                                                        False)]
+
+    # Equal pressure in all vessels
+    C = np.array([p[name + "_compliance"] for name in vessels])
+    V0 = np.array([p[name + "_volume"] for name in vessels])
+    stressed = p["blood_volume"] - sum(cavity_volumes.values()) - V0.sum()
+    volumes = dict(zip(vessels, V0 + C*stressed/C.sum()))
+    volumes.update(cavity_volumes)
+    return LumpedModel(compartments, connections, volumes)
+
+
+def cavity_volume_form(problem, marker):
+    """Returns the form of the current volume of the cavity enclosed by the
+    surface with the given marker,
+
+    .. math::
+
+        V = -\\frac{1}{3} \\int_{\\Gamma} (X + u) \\cdot J F^{-T} N \\, dS,
+
+    which assumes that the base of the cavity lies in a plane through the
+    origin that is orthogonal to a coordinate axis, as for the ellipsoid
+    geometries.
+    """
+    mesh = problem.geometry.mesh
+    W = problem.state_space
+    u = split(problem.state)[0] if W.sub(0).num_sub_spaces() > 0\
+                                                        else problem.state
+    X = SpatialCoordinate(mesh)
+    N = FacetNormal(mesh)
+    F = Identity(mesh.geometry().dim()) + grad(u)
+    return -1.0/3.0*inner(X + u, det(F)*inv(F).T*N)\
+                                            *problem.geometry.ds(marker)
+
+
+class Circulation(object):
+    """Couples a :py:class:`LumpedModel` to the cavity pressures of a
+    :py:class:`m3h3.pde.SolidProblem`.
+
+    Parameters
+    ----------
+    model : :py:class:`LumpedModel`
+        The circulation model. Its cavities are ``"lv"`` and possibly
+        ``"rv"``.
+    problem : :py:class:`m3h3.pde.SolidProblem`
+        The mechanics problem.
+    time : float
+        The current time.
+    compliance : float
+        Initial estimate of the cavity compliance dV/dp in ml/mmHg.
+    volume_scale : float
+        Volume in ml of a unit volume of the mesh.
+    pressure_scale : float
+        Pressure of the mechanics per mmHg, e.g. 0.133322 for kPa.
+    num_steps : int
+        Runge-Kutta steps of the circulation per coupling step.
+    filename : str, optional
+        HDF5 file to which the pressures and volumes of all compartments
+        and the flows of all connections are written.
+    buffer_size : int
+        Number of samples that are buffered before they are written.
+    """
+
+    def __init__(self, model, problem, time=0.0, compliance=1.0,
+                    volume_scale=1.0, pressure_scale=1.0, num_steps=10,
+                    filename=None, buffer_size=1000):
+        self.model = model
+        self.problem = problem
+        self.volume_scale = volume_scale
+        self.pressure_scale = pressure_scale
+        self.num_steps = num_steps
+        self._time = float(time)
+
+        handles = {"lv": problem.lv_pressure, "rv": problem.rv_pressure}
+        markers = {"lv": problem.geometry.get_lv_marker}
+        if problem.rv_pressure is not None:
+            markers["rv"] = problem.geometry.get_rv_marker
+        self._pressures = []
+        self._volume_forms = []
+        for cavity in model.cavities:
+            if handles.get(cavity) is None:
+                msg = "The solid problem has no cavity {}.".format(cavity)
+                raise ValueError(msg)
+            self._pressures.append(handles[cavity])
+            # Compiled once and assembled in every coupling step
+            self._volume_forms.append(df.Form(
+                            cavity_volume_form(problem, markers[cavity]())))
+
+        self._compliance = np.full(len(model.cavities), float(compliance))
+        self._previous = None
+        self.comm = problem.geometry.mesh.mpi_comm()
+        names = ["{}_pressure".format(n) for n in model.names]\
+                    + ["{}_volume".format(n) for n in model.names]\
+                    + ["{}_flow".format(c) for c in model.connections]\
+                    + ["{}_mechanics_volume".format(c) for c in model.cavities]
+        self.series = TimeSeries(filename, self.comm, names=names,
+                                 buffer_size=buffer_size)
+
+
+    def cavity_pressures(self):
+        """Returns the current cavity pressures in mmHg.
+        """
+        return np.array([float(p) for p in self._pressures])\
+                                                        /self.pressure_scale
+
+
+    def cavity_volumes(self):
+        """Returns the current cavity volumes of the mechanics in ml. This
+        is a collective call.
+        """
+        return np.array([df.assemble(form) for form in self._volume_forms])\
+                                                            *self.volume_scale
+
+
+    def __call__(self, time, solution_fields=None):
+        """Advances the circulation to time and corrects the cavity
+        pressures for the next mechanics solve. Can be registered as a
+        callback with :py:meth:`m3h3.M3H3.register_callback`.
+        """
+        self.step(float(time) - self._time)
+        self._time = float(time)
+
+
+    def step(self, dt):
+        """Advances the circulation by dt at the current cavity pressures and
+        updates the cavity pressures such that the mechanics approaches the
+        cavity volumes of the circulation.
+        """
+        p = self.cavity_pressures()
+        V = self.cavity_volumes()
+
+        # Secant estimate of the compliance of every cavity, which changes
+        # with the stiffness and the activation of the tissue
+        if self._previous is not None:
+            dp = p - self._previous[0]
+            dV = V - self._previous[1]
+            update = (np.abs(dp) > 1e-3) & (dV*dp > 0)
+            self._compliance[update] = dV[update]/dp[update]
+        self._previous = (p, V)
+
+        self.model.step(dt, p, self.num_steps)
+        target = self.model.cavity_volumes()
+        p_new = p + (target - V)/self._compliance
+        for handle, value in zip(self._pressures, p_new):
+            handle.assign(value*self.pressure_scale)
+
+        volumes = self.model.volumes
+        self.series.append(self._time + dt, np.concatenate([
+                    self.model.pressures(volumes, p), volumes,
+                    self.model.flows(volumes, p), V]))
+
+
+    def values(self):
+        """Returns the times and samples that are held in memory on rank 0.
+        """
+        return self.series.values()
+
+
+    def close(self):
+        """Writes all remaining samples.
+        """
+        self.series.close()
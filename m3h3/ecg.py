@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""This module implements the computation of ECG leads during a simulation.
+
+The pseudo-ECG potential at an electrode :math:`x_e` outside the heart is
+
+.. math::
+
+    \\phi_e(x_e) = \\frac{1}{4 \\pi \\sigma_b} \\int_\\Omega M_i \\nabla v
+                    \\cdot \\nabla \\frac{1}{|x - x_e|} \\, dx,
+
+which is linear in the transmembrane potential v. The weights of all dofs
+of v are therefore assembled once per electrode, and every lead value is a
+dot product of a precomputed weight vector with the owned part of v,
+followed by one reduction. With the bidomain model, the leads can instead be
+taken from the extracellular potential at the electrodes, which are then
+evaluated with :py:class:`m3h3.probes.Probes`.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+from mpi4py import MPI
+
+import dolfin as df
+from dolfin import (Constant, SpatialCoordinate, TestFunction, assemble,
+                    dx, grad, inner, sqrt)
+
+from m3h3.output import TimeSeries
+from m3h3.probes import Probes
+
+
+PRECORDIAL = ["V{}".format(i) for i in range(1, 7)]
+
+# Standard 12-lead ECG as linear combinations of electrode potentials. The
+# precordial leads are measured against Wilson's central terminal.
+STANDARD_LEADS = OrderedDict([
+    ("I", {"LA": 1.0, "RA": -1.0}),
+    ("II", {"LL": 1.0, "RA": -1.0}),
+    ("III", {"LL": 1.0, "LA": -1.0}),
+    ("aVR", {"RA": 1.0, "LA": -0.5, "LL": -0.5}),
+    ("aVL", {"LA": 1.0, "RA": -0.5, "LL": -0.5}),
+    ("aVF", {"LL": 1.0, "RA": -0.5, "LA": -0.5})]
+    + [(v, {v: 1.0, "RA": -1.0/3, "LA": -1.0/3, "LL": -1.0/3})
+                                                        for v in PRECORDIAL])
+
+
+def lead_field_form(V, x_e, conductivity):
+    """Returns the linear form of the pseudo-ECG weights of the dofs of V for
+    an electrode at x_e, without the factor 1/(4 pi sigma_b). The
+    conductivity is a scalar or a tensor valued coefficient.
+    """
+    mesh = V.mesh()
+    x = SpatialCoordinate(mesh)
+    r = sqrt(inner(x - x_e, x - x_e))
+    w = TestFunction(V)
+    return inner(conductivity*grad(w), grad(1/r))*dx(mesh)
+
+
+class ECG(object):
+    """Computes ECG leads from electrode potentials.
+
+    Parameters
+    ----------
+    function : :py:class:`dolfin.Function`
+        The transmembrane potential for the pseudo-ECG, or the extracellular
+        potential for the extracellular method.
+    electrodes : dict
+        Maps electrode names to coordinates.
+    leads : dict, optional
+        Maps lead names to dicts of electrode names and coefficients. If
+        None, the standard 12 leads are used if the electrodes RA, LA, LL
+        and V1-V6 are given, and otherwise every electrode is a unipolar
+        lead.
+    conductivity : float or :py:class:`dolfin.Function`
+        Intracellular conductivity M_i of the pseudo-ECG, or the
+        intracellular conductivity tensor for anisotropic tissue, see
+        :py:class:`m3h3.pde.electro_problem.ConductivityTensor`.
+    bath_conductivity : float
+        Conductivity of the surrounding bath of the pseudo-ECG.
+    method : str
+        ``"pseudo"`` or ``"extracellular"``.
+    filename : str, optional
+        HDF5 file the lead time series is written to.
+    buffer_size : int
+        Number of samples that are buffered before they are written.
+    """
+
+    def __init__(self, function, electrodes, leads=None, conductivity=1.0,
+                    bath_conductivity=1.0, method="pseudo", filename=None,
+                    buffer_size=1000):
+        self.function = function
+        self.comm = function.function_space().mesh().mpi_comm()
+        self.rank = df.MPI.rank(self.comm)
+        self.method = method
+
+        electrodes = OrderedDict(electrodes)
+        if leads is None:
+            if set(["RA", "LA", "LL"] + PRECORDIAL) <= set(electrodes.keys()):
+                leads = STANDARD_LEADS
+            else:
+                leads = OrderedDict((name, {name: 1.0})
+                                                for name in electrodes.keys())
+        self.leads = list(leads.keys())
+        names = list(electrodes.keys())
+        self._combination = np.zeros((len(leads), len(names)))
+        for i, lead in enumerate(leads.values()):
+            for electrode, coefficient in lead.items():
+                self._combination[i, names.index(electrode)] = coefficient
+
+        points = np.array(list(electrodes.values()), dtype=float)
+        if method == "pseudo":
+            weights = self._electrode_weights(points, conductivity,
+                                                            bath_conductivity)
+            self._weights = self._combination.dot(weights)
+        elif method == "extracellular":
+            self._probes = Probes(function, points)
+        else:
+            msg = "Unknown ECG method {}. Use 'pseudo' or "\
+                    "'extracellular'.".format(method)
+            raise ValueError(msg)
+
+        self.series = TimeSeries(filename, self.comm, names=self.leads,
+                                 metadata={"electrodes": points},
+                                 buffer_size=buffer_size)
+
+
+    def __call__(self, time, solution_fields=None):
+        """Computes the leads and appends them to the time series. Can be
+        registered as a callback with :py:meth:`m3h3.M3H3.register_callback`.
+        """
+        self.series.append(time, self.evaluate())
+
+
+    def evaluate(self):
+        """Returns the values of all leads on rank 0 and None on all other
+        ranks. This is a collective call.
+        """
+        if self.method == "extracellular":
+            potentials = self._probes.evaluate()
+            if self.rank != 0:
+                return None
+            return self._combination.dot(potentials)
+
+        partial = self._weights.dot(self.function.vector().get_local())
+        total = np.empty_like(partial) if self.rank == 0 else None
+        self.comm.Reduce(partial, total, op=MPI.SUM, root=0)
+        return total
+
+
+    def values(self):
+        """Returns the times and lead values that are held in memory on rank
+        0, i.e. all samples if there is no file.
+        """
+        return self.series.values()
+
+
+    def close(self):
+        """Writes all remaining samples.
+        """
+        self.series.close()
+
+
+    def _electrode_weights(self, points, conductivity, bath_conductivity):
+        # One form for all electrodes, so that it is compiled only once
+        x_e = Constant(points[0])
+        if isinstance(conductivity, (int, float)):
+            conductivity = Constant(conductivity)
+        form = lead_field_form(self.function.function_space(), x_e,
+                                                                conductivity)
+
+        scale = 1.0/(4*np.pi*bath_conductivity)
+        weights = []
+        for point in points:
+            x_e.assign(Constant(point))
+            weights.append(scale*assemble(form).get_local())
+        return np.array(weights)
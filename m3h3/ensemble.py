@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""This module implements an ensemble driver for parameter sweeps.
+
+Setting up an :py:class:`m3h3.M3H3` simulation builds function spaces, forms
+and solvers and just-in-time compiles the forms. The :py:class:`Ensemble`
+sets up one simulation per group of processes and reruns it for every
+member of the ensemble. Before each run, the state is reset to the initial
+state, the parameters are reset to those of the simulation when it was set
+up, and the member's parameters are applied with
+:py:meth:`m3h3.M3H3.update_parameters`, which changes the constants of the
+forms in place instead of building new forms.
+
+The processes of the communicator are split into groups, each of which runs
+a share of the members on its own sub-communicator. One-process groups run
+independent serial simulations, like a process pool. Results of members
+whose parameters have been run before are read from a cache instead.
+"""
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+import dolfin as df
+from dolfin import LogLevel
+
+from m3h3.setup_parameters import Physics
+from m3h3.utils import log
+
+
+class Ensemble(object):
+    """Runs a simulation for every member of a parameter sweep.
+
+    Parameters
+    ----------
+    setup : callable
+        Called as ``setup(comm)`` once per group, returns the
+        :py:class:`m3h3.M3H3` simulation on the group communicator comm.
+        The state of the simulation when it is returned is the initial
+        state of every member.
+    outputs : callable
+        Called as ``outputs(model)`` after every member on all processes of
+        the group. Returns a dict of arrays to collect, which is taken from
+        the first process of the group.
+    num_groups : int, optional
+        Number of process groups. Defaults to one group per process.
+    cache_dir : str, optional
+        Directory where the outputs of every member are stored under the
+        hash of all its parameters, the interval and the outputs function,
+        and read from if they exist.
+    comm : MPI communicator, optional
+        Defaults to ``dolfin.MPI.comm_world``.
+
+    Example of usage::
+
+        def setup(comm):
+            geometry = ...  # on comm
+            return M3H3(geometry, parameters)
+
+        def outputs(model):
+            return {"v": model.electro_problem.prev_current.vector().get_local()}
+
+        members = [{"Electro": {"M_i": m}} for m in np.linspace(0.5, 2, 20)]
+        results = Ensemble(setup, outputs).run(members, "sweep.h5")
+    """
+
+    def __init__(self, setup, outputs, num_groups=None, cache_dir=None,
+                                                                comm=None):
+        self.comm = comm if comm is not None else df.MPI.comm_world
+        size = df.MPI.size(self.comm)
+        self.num_groups = num_groups if num_groups is not None else size
+        if size % self.num_groups != 0:
+            msg = "The number of processes ({}) has to be a multiple of the "\
+                    "number of groups ({}).".format(size, self.num_groups)
+            raise ValueError(msg)
+        self.group = df.MPI.rank(self.comm) % self.num_groups
+        self.group_comm = self.comm.Split(self.group, df.MPI.rank(self.comm))
+        self.cache_dir = cache_dir
+        self.outputs = outputs
+
+        self.model = setup(self.group_comm)
+        self._initial_state = self.model.get_state()
+        self._initial_time = float(self.model.time)
+        self._base_parameters = OrderedDict(
+                    (str(physics), self.model.parameters[str(physics)].copy())
+                    for physics in self.model.physics)
+        cell_model = self._cell_model()
+        self._base_cell_parameters = OrderedDict(cell_model.parameters())\
+                                        if cell_model is not None else None
+
+
+    def run(self, members, filename=None, interval=None):
+        """Runs all members and returns their outputs on rank 0. This is a
+        collective call.
+
+        Parameters
+        ----------
+        members : list of dict
+            Parameters of every member, as dicts that map physics labels to
+            parameter dicts, e.g. ``{"Electro": {"M_i": 1.5}}``. The key
+            ``"cell_model"`` holds parameters of the cell model.
+        filename : str, optional
+            HDF5 file to which rank 0 writes every output as one dataset
+            with the members along the first axis, together with the member
+            parameters as JSON in the ``members`` attribute.
+        interval : tuple, optional
+            Time interval of every run. Defaults to the interval from the
+            start to the end time in the parameters.
+
+        Returns
+        -------
+        list of dict
+            The outputs of every member on rank 0, None on other ranks.
+        """
+        results = {}
+        for index in range(self.group, len(members), self.num_groups):
+            results[index] = self._run_member(members[index], interval)
+
+        # The first process of every group sends its results to rank 0
+        local = results if df.MPI.rank(self.group_comm) == 0 else {}
+        gathered = self.comm.gather(local)
+        if df.MPI.rank(self.comm) != 0:
+            return None
+        outputs = [None]*len(members)
+        for group_results in gathered:
+            for index, result in group_results.items():
+                outputs[index] = result
+        if filename is not None:
+            _write_results(filename, members, outputs)
+        return outputs
+
+
+    def _run_member(self, member, interval):
+        self._apply_parameters(member)
+        path = self._cache_path(interval)
+        cached = self.group_comm.bcast(path is not None and
+                        os.path.isfile(path)
+                        if df.MPI.rank(self.group_comm) == 0 else None)
+        if cached:
+            log(LogLevel.PROGRESS, "Using cached results {}".format(path))
+            if df.MPI.rank(self.group_comm) != 0:
+                return None
+            with np.load(path) as data:
+                return OrderedDict((key, data[key]) for key in data.files)
+
+        self.model.set_state(self._initial_state, self._initial_time)
+        for _ in self.model.solve(interval):
+            pass
+        result = OrderedDict(self.outputs(self.model))
+
+        if df.MPI.rank(self.group_comm) != 0:
+            return None
+        if path is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            np.savez(path, **result)
+        return result
+
+
+    def _cell_model(self):
+        problem = getattr(self.model, "electro_problem", None)
+        return getattr(problem, "cell_model", None)
+
+
+    def _apply_parameters(self, member):
+        # Members only differ from the base parameters in their own keys
+        for label, parameters in self._base_parameters.items():
+            self.model.update_parameters(Physics(label), parameters)
+        if self._base_cell_parameters is not None:
+            self._cell_model().set_parameters(**self._base_cell_parameters)
+        for label, values in member.items():
+            if label == "cell_model":
+                self._cell_model().set_parameters(**values)
+            else:
+                self.model.update_parameters(Physics(label), values)
+
+
+    def _cache_path(self, interval):
+        # Hash of the effective parameters after the member is applied
+        if self.cache_dir is None:
+            return None
+        cell_model = self._cell_model()
+        code = getattr(self.outputs, "__code__", None)
+        key = json.dumps({"parameters": self.model.parameters.to_dict(),
+                "cell_model": dict(cell_model.parameters())
+                                        if cell_model is not None else None,
+                "interval": list(interval) if interval is not None else None,
+                "outputs": [getattr(self.outputs, "__module__", None),
+                        getattr(self.outputs, "__qualname__", None),
+                        code.co_code.hex() if code is not None else None]},
+                sort_keys=True, default=_json_value)
+        name = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.cache_dir, "{}.npz".format(name))
+
+
+def _json_value(value):
+    # Constants of the cell model are hashed by their values
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def _write_results(filename, members, outputs):
+    import h5py
+
+    with h5py.File(filename, "w") as f:
+        f.attrs["members"] = json.dumps(members, sort_keys=True)
+        for key in outputs[0].keys():
+            f.create_dataset(key, data=np.array([output[key]
+                                                    for output in outputs]))
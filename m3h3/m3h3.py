@@ -1,12 +1,23 @@
 import numpy as np
 
-from dolfin import (Constant, Parameters)
+import dolfin as df
+from dolfin import (Constant, LogLevel, Parameters)
 
 from geometry import HeartGeometry, MultiGeometry
 
 from m3h3.setup_parameters import Parameters, Physics
-from m3h3.pde import *
-from m3h3.pde.solver import *
+from m3h3.activation import ActivationRecorder
+from m3h3.checkpoint import Checkpoint
+from m3h3.ecg import ECG
+from m3h3.ode import MultiCellModel
+from m3h3.output import OutputManager
+from m3h3.partitioning import cell_costs, partition_geometry
+from m3h3.probes import Probes
+from m3h3.reordering import reorder_geometry
+from m3h3.profiling import profiler, timer
+from m3h3.pde import ElectroProblem
+from m3h3.pde.solver import BasicBidomainSolver
+from m3h3.utils import log
 
 
 class M3H3(object):
@@ -25,38 +36,451 @@ class M3H3(object):
         else:
             self.time = Constant(self.parameters['start_time'])
 
-        self._setup_geometries(geometry, self.physics)
-        self._setup_problems(**kwargs)
-        self._setup_solvers(**kwargs)
+        self.output = None
+        self._callbacks = []
+
+        # The dof ordering only applies to the function spaces of the setup
+        dof_ordering = df.parameters["dof_ordering_library"]
+        try:
+            if self.parameters.has_parameter_set("Partitioning"):
+                partitioning = self.parameters["Partitioning"]
+                if partitioning["dof_ordering"]:
+                    df.parameters["dof_ordering_library"] = \
+                                                partitioning["dof_ordering"]
+                # The weighted partitioning orders the cells itself
+                if partitioning["weighted"]:
+                    geometry = self._partition_geometry(geometry, **kwargs)
+                else:
+                    geometry = self._reorder_geometry(geometry, **kwargs)
+            self._setup_geometries(geometry, self.physics)
+            self._setup_problems(**kwargs)
+            self._setup_solvers(**kwargs)
+        finally:
+            df.parameters["dof_ordering_library"] = dof_ordering
+
+
+    @classmethod
+    def from_checkpoint(cls, path, geometry, parameters, *args, **kwargs):
+        """Sets up a simulation and restores its state from a checkpoint
+        written by :py:meth:`save_checkpoint`. The geometry may be distributed
+        across a different number of processes than the checkpointed one.
+        """
+        m3h3 = cls(geometry, parameters, *args, **kwargs)
+        m3h3.load_checkpoint(path)
+        return m3h3
+
+
+    def save_checkpoint(self, path, incremental=True):
+        """Writes the state of all physics and the current time to the HDF5
+        file at path. If incremental is True, only fields that have changed
+        since the last checkpoint to the same file are written.
+        """
+        checkpoint = Checkpoint(path, self._get_comm())
+        return checkpoint.save(float(self.time), self._get_state_fields(),
+                                                    incremental=incremental)
+
+
+    def load_checkpoint(self, path):
+        """Restores the state of all physics and the current time from the
+        HDF5 file at path.
+        """
+        checkpoint = Checkpoint(path, self._get_comm())
+        time = checkpoint.load(self._get_state_fields())
+        self.time.assign(time)
+        self.num_steps, self.max_dt = self._get_num_steps()
+
+
+    def get_state(self):
+        """Returns a copy of the state of all physics, which can be restored
+        with :py:meth:`set_state`.
+        """
+        return {name: field.vector().get_local()
+                    for name, field in self._get_state_fields().items()}
+
+
+    def set_state(self, state, time=None):
+        """Restores a state returned by :py:meth:`get_state` and sets the
+        time, which defaults to the start time. This allows to rerun a
+        simulation without setting it up again.
+        """
+        for name, field in self._get_state_fields().items():
+            field.vector().set_local(state[name])
+            field.vector().apply("insert")
+        time = time if time is not None else self.parameters['start_time']
+        self.time.assign(time)
+        self.num_steps, self.max_dt = self._get_num_steps()
 
 
     def step(self):
         # Setup time stepping if running step function for the first time.
-        if self.time.values()[0] == self.parameters['start_time']:
+        if self.time.values()[0] == self.parameters['start_time']\
+                                            or not hasattr(self, 'num_steps'):
             self.num_steps, self.max_dt = self._get_num_steps()
 
         time = float(self.time)
         solution_fields = self.get_solution_fields()
+        self._step_physics(solution_fields)
+        self.time.assign(time + self.max_dt)
+
+        if self.output is not None:
+            with timer("Output"):
+                self.output.write(float(self.time))
+        return time, solution_fields
+
+
+    def solve(self, interval=None, yield_every=None):
+        """Advances the simulation over a time interval and returns a generator
+        that yields the time and the solution fields at requested output
+        times only.
+
+        Time is counted in integer steps of the largest physics time step, so
+        output and callback times do not drift with floating point
+        round-off. Registered callbacks (see :py:meth:`register_callback`)
+        are run on their own schedule between the yields.
+
+        Parameters
+        ----------
+        interval : tuple, optional
+            The time interval (t0, t1). Defaults to the interval from the
+            current time to the end time in the parameters.
+        yield_every : float, optional
+            Simulation time between two yields. Has to be a multiple of the
+            largest physics time step. Defaults to yielding only at t1.
+
+        Returns
+        -------
+        (time, solution_fields) via (:py:class:`genexpr`)
+
+        Example of usage::
+
+            for time, solution_fields in m3h3.solve(yield_every=10.0):
+                # do something with the solutions
+        """
+        if interval is None:
+            interval = (float(self.time), self.parameters['end_time'])
+        (t0, t1) = interval
+        self.time.assign(t0)
+        self.num_steps, self.max_dt = self._get_num_steps()
+
+        num_steps = self._get_num_time_steps(t1 - t0)
+        if yield_every is None:
+            yield_steps = num_steps
+        else:
+            yield_steps = self._get_num_time_steps(yield_every)
+        callbacks = [(callback, self._get_num_time_steps(every))
+                        for (callback, every) in self._callbacks]
 
+        solution_fields = self.get_solution_fields()
+        for n in range(1, num_steps + 1):
+            self._step_physics(solution_fields)
+            time = t0 + n*self.max_dt
+            self.time.assign(time)
+
+            if self.output is not None:
+                with timer("Output"):
+                    self.output.write(time)
+
+            stop = False
+            for (callback, every) in callbacks:
+                if n % every == 0:
+                    with timer("Callbacks"):
+                        stop = bool(callback(time, solution_fields)) or stop
+
+            if n % yield_steps == 0 or n == num_steps or stop:
+                yield time, solution_fields
+            if stop:
+                break
+
+
+    def register_callback(self, callback, every=None):
+        """Registers a callback that is run by :py:meth:`solve`.
+
+        Parameters
+        ----------
+        callback : callable
+            Called as ``callback(time, solution_fields)``. If it returns
+            True, :py:meth:`solve` yields the current state and stops, which
+            can be used to implement stop conditions.
+        every : float, optional
+            Simulation time between two calls. Has to be a multiple of the
+            largest physics time step. Defaults to every step.
+        """
+        self._callbacks.append((callback, every))
+
+
+    def add_probes(self, function, points, filename=None, every=None,
+                                                            buffer_size=1000):
+        """Samples a field at a set of points, e.g. virtual electrodes, during
+        :py:meth:`solve`. The probe cells and weights are located once, so
+        sampling costs a sparse matrix-vector product per call.
+
+        Parameters
+        ----------
+        function : :py:class:`dolfin.Function`
+            The sampled field, e.g. the transmembrane potential.
+        points : array_like or dict
+            Probe coordinates, optionally mapped from probe names.
+        filename : str, optional
+            HDF5 file for the time series. Has to be closed with
+            ``probes.close()`` after the simulation.
+        every : float, optional
+            Simulation time between two samples. Defaults to every step.
+        buffer_size : int
+            Number of samples buffered in memory before they are written.
+
+        Returns
+        -------
+        :py:class:`m3h3.probes.Probes`
+        """
+        probes = Probes(function, points, filename=filename,
+                                                    buffer_size=buffer_size)
+        self.register_callback(probes, every=every)
+        return probes
+
+
+    def add_ecg(self, electrodes, leads=None, method="pseudo",
+                    bath_conductivity=1.0, filename=None, every=None,
+                    buffer_size=1000):
+        """Computes ECG leads during :py:meth:`solve`. The lead weights are
+        precomputed, so that every evaluation costs one dot product per
+        lead. See :py:class:`m3h3.ecg.ECG`.
+
+        Parameters
+        ----------
+        electrodes : dict
+            Maps electrode names to coordinates, e.g. RA, LA, LL and V1-V6
+            for the standard 12-lead ECG.
+        leads : dict, optional
+            Lead definitions. Defaults to the standard 12 leads.
+        method : str
+            ``"pseudo"`` integrates the transmembrane potential, with the
+            intracellular conductivity tensor if the geometry has fibers,
+            ``"extracellular"`` samples the extracellular potential of the
+            bidomain solution at the electrodes.
+        bath_conductivity : float
+            Conductivity of the surrounding bath of the pseudo-ECG.
+        filename : str, optional
+            HDF5 file for the lead time series. Has to be closed with
+            ``ecg.close()`` after the simulation.
+        every : float, optional
+            Simulation time between two evaluations. Defaults to every step.
+
+        Returns
+        -------
+        :py:class:`m3h3.ecg.ECG`
+        """
+        assert hasattr(self, 'electro_problem'), \
+            "Cannot compute an ECG if electrophysiology has not been set up."
+        assert not self._is_eikonal(), \
+            "Cannot compute an ECG from the eikonal model."
+        if method == "extracellular":
+            function = self.electro_problem.solution.sub(1)
+        else:
+            function = self.electro_problem.prev_current
+        # The lead field of anisotropic tissue follows the fibers
+        tensors = self.electro_problem.conductivity_tensors
+        if tensors is not None:
+            conductivity = tensors[0].function
+        else:
+            conductivity = self.parameters[str(Physics.ELECTRO)]['M_i']
+        ecg = ECG(function, electrodes, leads=leads,
+                    conductivity=conductivity,
+                    bath_conductivity=bath_conductivity, method=method,
+                    filename=filename, buffer_size=buffer_size)
+        self.register_callback(ecg, every=every)
+        return ecg
+
+
+    def add_activation_recorder(self, threshold=0.0,
+                            repolarization_threshold=None, mode="first",
+                            filename=None, every=None):
+        """Records activation and repolarization time maps of the
+        transmembrane potential in-situ, after every electro step.
+
+        Parameters
+        ----------
+        threshold, repolarization_threshold : float
+            Thresholds of the upstroke and the repolarization, see
+            :py:class:`m3h3.activation.ActivationRecorder`.
+        mode : str
+            ``"first"`` records the first activation, ``"latest"`` the
+            latest beat.
+        filename : str, optional
+            XDMF file the maps are written to, every ``every`` ms, e.g. at
+            the end of every beat, or when ``recorder.write(filename)`` is
+            called.
+        every : float, optional
+            Simulation time between two writes of the maps.
+
+        Returns
+        -------
+        :py:class:`m3h3.activation.ActivationRecorder`
+        """
+        assert hasattr(self, 'electro_solver'), \
+            "Cannot record activation if electrophysiology has not been set up."
+        assert not self._is_eikonal(), \
+            "The eikonal model computes activation times, see "\
+            "electro_problem.activation_time."
+        recorder = ActivationRecorder(self.electro_problem.prev_current,
+                            threshold=threshold,
+                            repolarization_threshold=repolarization_threshold,
+                            mode=mode, start_time=float(self.time))
+        self.electro_solver.register_observer(recorder)
+        if filename is not None and every is not None:
+            writes = []
+            def write(time, solution_fields):
+                recorder.write(filename, time, append=len(writes) > 0)
+                writes.append(time)
+            self.register_callback(write, every=every)
+        return recorder
+
+
+    def add_circulation(self, model, compliance=1.0, volume_scale=1.0,
+                            pressure_scale=1.0, num_steps=10, filename=None,
+                            every=None, buffer_size=1000):
+        """Couples a lumped-parameter circulation model to the cavity
+        pressures of the solid mechanics. The circulation is advanced and
+        the cavity pressures are corrected after every step of
+        :py:meth:`solve`.
+
+        Parameters
+        ----------
+        model : :py:class:`m3h3.circulation.LumpedModel`
+            E.g. :py:func:`m3h3.circulation.windkessel` or
+            :py:func:`m3h3.circulation.closed_loop`.
+        compliance, volume_scale, pressure_scale, num_steps :
+            See :py:class:`m3h3.circulation.Circulation`.
+        filename : str, optional
+            HDF5 file for the pressures, volumes and flows.
+        every : float, optional
+            Simulation time between two coupling steps. Defaults to every
+            step.
+        buffer_size : int
+            Number of samples buffered in memory before they are written.
+
+        Returns
+        -------
+        :py:class:`m3h3.circulation.Circulation`
+        """
+        assert hasattr(self, 'solid_problem'), \
+            "Cannot couple a circulation if mechanics has not been set up."
+        from m3h3.circulation import Circulation
+        circulation = Circulation(model, self.solid_problem,
+                            time=float(self.time), compliance=compliance,
+                            volume_scale=volume_scale,
+                            pressure_scale=pressure_scale,
+                            num_steps=num_steps, filename=filename,
+                            buffer_size=buffer_size)
+        self.register_callback(circulation, every=every)
+        return circulation
+
+
+    def use_reduced_solid(self, basis, cells=None, weights=None,
+                                            tolerance=1e-2, check_every=1):
+        """Replaces the solid solver by a reduced-order solver in the
+        coordinates of a POD basis, which falls back to the full solver when
+        its error estimate exceeds tolerance.
+
+        Parameters
+        ----------
+        basis : array
+            See :py:func:`m3h3.reduced.pod_basis`.
+        cells, weights : array, optional
+            See :py:func:`m3h3.reduced.ecsw_weights`.
+        tolerance, check_every :
+            See :py:class:`m3h3.reduced.ReducedSolidSolver`.
+
+        Returns
+        -------
+        :py:class:`m3h3.reduced.ReducedSolidSolver`
+        """
+        assert hasattr(self, 'solid_solver'), \
+            "Cannot reduce the mechanics if it has not been set up."
+        from m3h3.reduced import ReducedSolidSolver
+        solver = self.solid_solver
+        if isinstance(solver, ReducedSolidSolver):
+            solver = solver.solver
+        self.solid_solver = ReducedSolidSolver(solver, basis, cells=cells,
+                                    weights=weights, tolerance=tolerance,
+                                    check_every=check_every)
+        return self.solid_solver
+
+
+    def timing_report(self, dolfin_timings=True):
+        """Returns the wall times and counters of all simulation phases,
+        aggregated across processes as minimum, mean and maximum. See
+        :py:meth:`m3h3.profiling.Profiler.report`. This is a collective call.
+        """
+        return profiler.report(self._get_comm(),
+                                            dolfin_timings=dolfin_timings)
+
+
+    def dump_timings(self, filename):
+        """Writes :py:meth:`timing_report` as JSON to filename. This is a
+        collective call.
+        """
+        return profiler.dump(filename, self._get_comm())
+
+
+    def _step_physics(self, solution_fields):
         if Physics.ELECTRO in self.physics:
-            for _ in range(self.num_steps[Physics.ELECTRO]):
-                electro_fields = solution_fields[str(Physics.ELECTRO)]
-                self.electro_solver.step(electro_fields[1])
+            electro_fields = solution_fields[str(Physics.ELECTRO)]
+            t0 = float(self.time)
+            dt = self.parameters[str(Physics.ELECTRO)]['dt']
+            with timer(str(Physics.ELECTRO)):
+                for n in range(self.num_steps[Physics.ELECTRO]):
+                    self.electro_solver.step(electro_fields[1],
+                                                    time=t0 + (n + 1)*dt)
 
         if Physics.SOLID in self.physics:
-            for _ in range(self.num_steps[Physics.SOLID]):
-                self.solid_solver.step()
+            t0 = float(self.time)
+            dt = self.parameters[str(Physics.SOLID)]['dt']
+            # The eikonal model prescribes the active tension at any time
+            activation = None
+            if self._is_eikonal():
+                activation = getattr(self.solid_problem.material,
+                                                        "activation", None)
+            with timer(str(Physics.SOLID)):
+                for n in range(self.num_steps[Physics.SOLID]):
+                    if activation is not None:
+                        self.electro_solver.drive(activation, t0 + (n + 1)*dt)
+                    self.solid_solver.step(time=t0 + (n + 1)*dt)
 
         if Physics.FLUID in self.physics:
-            for _ in range(self.num_steps[Physics.FLUID]):
-                self.fluid_solver.step()
+            with timer(str(Physics.FLUID)):
+                for _ in range(self.num_steps[Physics.FLUID]):
+                    self.fluid_solver.step()
 
         if Physics.POROUS in self.physics:
-            for _ in range(self.num_steps[Physics.POROUS]):
-                self.porous_solver.step()
-                
-        self.time.assign(time + self.max_dt)
-        return time, solution_fields
+            with timer(str(Physics.POROUS)):
+                for _ in range(self.num_steps[Physics.POROUS]):
+                    self.porous_solver.step()
+
+
+    def _get_num_time_steps(self, duration):
+        if duration is None:
+            return 1
+        num_steps = duration/self.max_dt
+        if abs(num_steps - round(num_steps)) > 1e-8*max(1.0, num_steps):
+            msg = "Time intervals have to be multiples of the time step "\
+                    "size. {} is not a multiple of {}".format(duration,
+                                                                self.max_dt)
+            raise ValueError(msg)
+        return max(int(round(num_steps)), 1)
+
+
+    def setup_output(self, filename, physics=None, queue_size=8,
+                                                            backend="thread"):
+        """Attaches an :py:class:`m3h3.output.OutputManager` to the simulation
+        that writes fields on the mesh of the given physics after every
+        step. Fields are registered with ``self.output.add_field``, and the
+        output has to be closed with ``self.output.close()``.
+        """
+        physics = physics if physics is not None else self.physics[0]
+        mesh = self.geometries[physics].mesh
+        self.output = OutputManager(filename, mesh, queue_size=queue_size,
+                                                            backend=backend)
+        return self.output
 
 
     def get_solution_fields(self):
@@ -73,6 +497,45 @@ class M3H3(object):
         return solution_fields
 
 
+    def _get_state_fields(self):
+        state_fields = {}
+        for physics, problem in self._get_problems().items():
+            for name, field in problem._get_state_fields().items():
+                state_fields["/{}/{}".format(physics, name)] = field
+        return state_fields
+
+
+    def _get_problems(self):
+        problems = {}
+        if Physics.ELECTRO in self.physics:
+            problems[Physics.ELECTRO] = self.electro_problem
+        if Physics.SOLID in self.physics:
+            problems[Physics.SOLID] = self.solid_problem
+        if Physics.FLUID in self.physics:
+            problems[Physics.FLUID] = self.fluid_problem
+        if Physics.POROUS in self.physics:
+            problems[Physics.POROUS] = self.porous_problem
+        return problems
+
+
+    def _get_solvers(self):
+        solvers = {}
+        if Physics.ELECTRO in self.physics:
+            solvers[Physics.ELECTRO] = self.electro_solver
+        if Physics.SOLID in self.physics:
+            solvers[Physics.SOLID] = self.solid_solver
+        if Physics.FLUID in self.physics:
+            solvers[Physics.FLUID] = self.fluid_solver
+        if Physics.POROUS in self.physics:
+            solvers[Physics.POROUS] = self.porous_solver
+        return solvers
+
+
+    def _get_comm(self):
+        geometry = list(self.geometries.values())[0]
+        return geometry.mesh.mpi_comm()
+
+
     def add_stimulus(self, stimulus):
         assert hasattr(self, 'electro_problem'), \
             "Cannot add stimulus if electrophysiology has not been set up."
@@ -127,13 +590,14 @@ class M3H3(object):
 
     def _setup_problems(self, **kwargs):
         if Physics.ELECTRO in self.physics:
-            self.electro_problem = ElectroProblem(
+            self.electro_problem = self._electro_problem_type()(
                                         self.geometries[Physics.ELECTRO],
                                         self.time,
                                         self.parameters[str(Physics.ELECTRO)],
                                         **kwargs)
             
         if Physics.SOLID in self.physics:
+            from m3h3.pde import SolidProblem
             self.solid_problem = SolidProblem(
                                         self.geometries[Physics.SOLID], 
                                         self.time,
@@ -141,6 +605,7 @@ class M3H3(object):
                                         **kwargs)
 
         if Physics.FLUID in self.physics:
+            from m3h3.pde import FluidProblem
             self.fluid_problem = FluidProblem(
                                         self.geometries[Physics.FLUID],
                                         self.time,
@@ -148,6 +613,7 @@ class M3H3(object):
                                         **kwargs)
 
         if Physics.POROUS in self.physics:
+            from m3h3.pde import PorousProblem
             self.porous_problem = PorousProblem(
                                         self.geometries[Physics.POROUS],
                                         self.time,
@@ -162,31 +628,85 @@ class M3H3(object):
         if Physics.ELECTRO in self.physics:
             elabel = str(Physics.ELECTRO)
             electro_fields = solution_fields[elabel]
-            parameters = self.parameters[elabel]['linear_variational_solver']
-            self.electro_solver = BasicBidomainSolver(self.time,
-                                    self.electro_problem._form, electro_fields,
-                                    parameters, **kwargs)
+            if self._is_eikonal():
+                from m3h3.pde.solver import EikonalSolver
+                self.electro_solver = EikonalSolver(self.time,
+                                    self.electro_problem,
+                                    self.parameters[elabel], **kwargs)
+            else:
+                parameters = self.parameters[elabel]\
+                                                ['linear_variational_solver']
+                self.electro_solver = BasicBidomainSolver(self.time,
+                                    self.electro_problem._form,
+                                    electro_fields, parameters, **kwargs)
 
         if Physics.SOLID in self.physics:
+            from m3h3.pde.solver import SolidSolver
             parameters = self.parameters[str(Physics.SOLID)]
             self.solid_solver = SolidSolver(
                                     self.solid_problem._form, self.time,
                                     interval, parameters['dt'], parameters,
-                                    **kwargs)
+                                    problem=self.solid_problem, **kwargs)
 
         if Physics.FLUID in self.physics:
+            from m3h3.pde.solver import FluidSolver
             parameters = self.parameters[str(Physics.FLUID)]
             self.fluid_solver = FluidSolver(
                                     self.fluid_problem._form, self.time,
                                     interval, parameters['dt'], parameters,
-                                    **kwargs)
+                                    problem=self.fluid_problem, **kwargs)
 
         if Physics.POROUS in self.physics:
+            from m3h3.pde.solver import PorousSolver
             parameters = self.parameters[str(Physics.POROUS)]
             self.porous_solver = PorousSolver(
                                     self.porous_problem._form, self.time,
                                     interval, parameters['dt'], parameters,
-                                    **kwargs)
+                                    problem=self.porous_problem, **kwargs)
+
+
+    def _partition_geometry(self, geometry, **kwargs):
+        # Redistribute the mesh such that every process owns the same
+        # estimated ODE and assembly workload.
+        if isinstance(geometry, MultiGeometry):
+            msg = "Weighted partitioning is not supported for MultiGeometry."
+            raise NotImplementedError(msg)
+        parameters = self.parameters["Partitioning"]
+        cell_model = kwargs.get('cell_model')
+        markers = cell_model.markers()\
+                        if isinstance(cell_model, MultiCellModel) else None
+        costs, default = cell_costs(cell_model, parameters["assembly_cost"])
+        geometry, markers = partition_geometry(geometry, costs, default,
+                                    markers=markers,
+                                    cache_dir=parameters["cache_dir"] or None,
+                                    reorder=parameters["reordering"] != "none")
+        if isinstance(cell_model, MultiCellModel):
+            # The regions of the cell models have to live on the new mesh
+            cell_model.set_markers(markers)
+        return geometry
+
+
+    def _reorder_geometry(self, geometry, **kwargs):
+        # Number the mesh entities and dofs for locality of memory access.
+        # Distributed meshes are only ordered by the weighted partitioning.
+        parameters = self.parameters["Partitioning"]
+        if parameters["reordering"] == "none":
+            return geometry
+        if isinstance(geometry, MultiGeometry):
+            msg = "Reordering is not supported for MultiGeometry."
+            raise NotImplementedError(msg)
+        if df.MPI.size(geometry.mesh.mpi_comm()) > 1:
+            log(LogLevel.WARNING, "Distributed meshes are only reordered "\
+                                            "with weighted partitioning.")
+            return geometry
+        cell_model = kwargs.get('cell_model')
+        markers = cell_model.markers()\
+                        if isinstance(cell_model, MultiCellModel) else None
+        geometry, markers = reorder_geometry(geometry,
+                                    parameters["reordering"], markers=markers)
+        if isinstance(cell_model, MultiCellModel):
+            cell_model.set_markers(markers)
+        return geometry
 
 
     def _setup_geometries(self, geometry, physics):
@@ -234,26 +754,51 @@ class M3H3(object):
 
 
     def _setup_electro_problem(self, parameters):
-        self.electro_problem = ElectroProblem(self.geometries[Physics.ELECTRO],
-                                                self.time, parameters)
+        self.electro_problem = self._electro_problem_type()(
+                                        self.geometries[Physics.ELECTRO],
+                                        self.time, parameters)
+
+
+    def _electro_problem_type(self):
+        model = self.parameters[str(Physics.ELECTRO)]['pde_model']
+        if model == "bidomain":
+            return ElectroProblem
+        elif model == "eikonal":
+            from m3h3.pde import EikonalProblem
+            return EikonalProblem
+        msg = "Unknown pde_model {}. Use 'bidomain' or 'eikonal'.".format(
+                                                                        model)
+        raise ValueError(msg)
+
+
+    def _is_eikonal(self):
+        return Physics.ELECTRO in self.physics\
+            and self.parameters[str(Physics.ELECTRO)]['pde_model'] == "eikonal"
 
 
     def _setup_solid_problem(self, parameters):
+        from m3h3.pde import SolidProblem
         self.solid_problem = SolidProblem(self.geometries[Physics.SOLID],
                                                 self.time, parameters)
 
 
     def _setup_fluid_problem(self, parameters):
+        from m3h3.pde import FluidProblem
         self.fluid_problem = FluidProblem(self.geometries[Physics.FLUID],
                                                 self.time, parameters)
 
 
     def _setup_porous_problem(self, parameters):
+        from m3h3.pde import PorousProblem
         self.porous_problem = PorousProblem(self.geometries[Physics.POROUS],
                                                 self.time, parameters)
 
 
     def update_parameters(self, physics, parameters):
+        """Updates the parameters of a physics. Numeric parameters of the
+        problems are held in constants that are changed in place, so the
+        forms are not recompiled.
+        """
         if physics == Physics.ELECTRO:
             self.parameters.set_electro_parameters(parameters)
         elif physics == Physics.SOLID:
@@ -262,3 +807,13 @@ class M3H3(object):
             self.parameters.set_fluid_parameters(parameters)
         elif physics == Physics.POROUS:
             self.parameters.set_porous_parameters(parameters)
+        # Constants of the forms are changed in place, so only the cached
+        # operators that depend on them have to be reassembled
+        physics = Physics(str(physics))
+        problem = self._get_problems().get(physics)
+        if problem is not None and problem.update_parameters(
+                                            self.parameters[str(physics)]):
+            solver = self._get_solvers()[physics]
+            if hasattr(solver, "invalidate"):
+                solver.invalidate()
+        self.num_steps, self.max_dt = self._get_num_steps()
@@ -1,7 +1,23 @@
+import importlib
+
 from m3h3.ode.cardiac_cell_model import CardiacCellModel, MultiCellModel
-from m3h3.ode.no_cell_model import NoCellModel
-from m3h3.ode.tentusscher_panfilov_2006_M_cell import (
-                                            Tentusscher_panfilov_2006_M_cell)
+
+# Cell models depend on cbcbeat or are large generated modules, and are only
+# imported on first use
+_lazy = {'NoCellModel': 'm3h3.ode.no_cell_model',
+         'Tentusscher_panfilov_2006_M_cell':
+                                    'm3h3.ode.tentusscher_panfilov_2006_M_cell'}
 
 __all__ = ['CardiacCellModel', 'MultiCellModel', 'NoCellModel',
-            'Tentusscher_panfilov_2006_M_cell']
\ No newline at end of file
+            'Tentusscher_panfilov_2006_M_cell']
+
+
+def __getattr__(name):
+    if name in _lazy:
+        return getattr(importlib.import_module(_lazy[name]), name)
+    msg = "module {!r} has no attribute {!r}".format(__name__, name)
+    raise AttributeError(msg)
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_lazy.keys()))
@@ -144,6 +144,16 @@ class CardiacCellModel:
         membrane potential)."""
         error("Must overload num_states")
 
+    def estimated_cost(self):
+        """Return the estimated cost of one time step of the model in a
+        single cell. Returns the attribute 'cost' if it has been set, e.g.
+        to a measured cost, and the number of states plus the membrane
+        potential otherwise."""
+        cost = getattr(self, "cost", None)
+        if cost is not None:
+            return cost
+        return self.num_states() + 1
+
     def __str__(self):
         "Return string representation of class."
         return "Some cardiac cell model"
@@ -176,6 +186,16 @@ class MultiCellModel(CardiacCellModel):
     def markers(self):
         return self._markers
 
+    def set_markers(self, markers):
+        """Set the markers of the cell models, e.g. after the mesh has been
+        redistributed or reordered.
+
+        *Arguments*
+        markers (:py:class:`dolfin.MeshFunction`)
+          MeshFunction with the keys of the cell models on the new mesh
+        """
+        self._markers = markers
+
     def keys(self):
         return self._keys
 
@@ -190,6 +210,11 @@ class MultiCellModel(CardiacCellModel):
         membrane potential)."""
         return self._num_states
 
+    def estimated_cost(self):
+        "Return the largest estimated cost of the cell models."
+        return max(c.estimated_cost() if hasattr(c, "estimated_cost")
+                   else c.num_states() + 1 for c in self._cell_models)
+
     def F(self, v, s, time=None, index=None):
         if index is None:
             error("(Domain) index must be specified for multi cell models")
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""This module implements an asynchronous, decimated output pipeline for
+solution fields.
+
+Each process writes its part of the mesh once and then only appends vertex
+values of the requested fields to its own HDF5 file. The actual disk I/O is
+done by a background writer, so the time loop only pays for taking a
+snapshot of the field values. Rank 0 writes one XDMF index file per field
+when the output is closed.
+"""
+
+import os
+import queue
+import threading
+import multiprocessing
+import traceback
+from collections import OrderedDict
+
+import numpy as np
+
+import dolfin as df
+from dolfin import LogLevel
+
+from m3h3.utils import log
+
+
+_TOPOLOGY_TYPES = {"interval": "Polyline", "triangle": "Triangle",
+                    "tetrahedron": "Tetrahedron"}
+
+
+class OutputManager(object):
+    """Writes snapshots of solution fields at per-field output intervals.
+
+    Parameters
+    ----------
+    filename : str
+        Base name of the output. Every process writes to
+        ``<basename>_p<rank>.h5``, and the XDMF index for field ``name`` is
+        written to ``<basename>_<name>.xdmf``.
+    mesh : :py:class:`dolfin.Mesh`
+        The mesh that all fields live on.
+    queue_size : int
+        Maximum number of snapshots waiting to be written. If the writer
+        falls behind, :py:meth:`write` blocks until there is room in the
+        queue. If the writer fails, its error is raised by the next call to
+        :py:meth:`write` or :py:meth:`close`.
+    backend : str
+        Either ``"thread"`` or ``"process"``. The process backend forks a
+        writer process per rank and overlaps I/O with computation even if the
+        GIL is held by the solver. It must only be used if the MPI library
+        tolerates fork().
+    """
+
+    def __init__(self, filename, mesh, queue_size=8, backend="thread"):
+        self.mesh = mesh
+        self.comm = mesh.mpi_comm()
+        self.rank = df.MPI.rank(self.comm)
+        self.basename = os.path.splitext(filename)[0]
+        self.filename = "{}_p{}.h5".format(self.basename, self.rank)
+
+        self._fields = OrderedDict()
+        self._intervals = {}
+        self._start_times = {}
+        self._next_output = {}
+        self._times = {}
+        self._value_shapes = {}
+
+        local_sizes = (mesh.num_vertices(), mesh.num_cells())
+        self._local_sizes = self.comm.allgather(local_sizes)
+
+        if backend == "thread":
+            self._queue = queue.Queue(maxsize=queue_size)
+            self._errors = queue.Queue()
+            self._writer = threading.Thread(target=_write_snapshots,
+                            args=(self.filename, self._queue, self._errors))
+        elif backend == "process":
+            ctx = multiprocessing.get_context("fork")
+            self._queue = ctx.Queue(maxsize=queue_size)
+            self._errors = ctx.Queue()
+            self._writer = ctx.Process(target=_write_snapshots,
+                            args=(self.filename, self._queue, self._errors))
+        else:
+            msg = "Unknown output backend {}. Use 'thread' or "\
+                    "'process'.".format(backend)
+            raise ValueError(msg)
+        self._writer.daemon = True
+        self._writer.start()
+        self._error = None
+        self._closed = False
+
+        coordinates = np.zeros((mesh.num_vertices(), 3))
+        coordinates[:, :mesh.geometry().dim()] = mesh.coordinates()
+        self._put(("mesh", coordinates, mesh.cells().copy()))
+
+
+    def add_field(self, name, function, interval=None, start_time=0.0):
+        """Registers a field for output.
+
+        Parameters
+        ----------
+        name : str
+            Name of the field in the output files.
+        function : :py:class:`dolfin.Function`
+            The field. Its values are sampled at the vertices of the mesh.
+        interval : float, optional
+            Simulation time between two outputs of the field. If None, the
+            field is written at every call to :py:meth:`write`.
+        start_time : float
+            Start of the output times ``start_time + k*interval``. A field
+            is written at the first call to :py:meth:`write` at or after each
+            of them, except those that have passed before the first call.
+        """
+        if function.function_space().mesh().id() != self.mesh.id():
+            msg = "Field {} does not live on the mesh of the output "\
+                    "manager.".format(name)
+            raise ValueError(msg)
+        self._fields[name] = function
+        self._intervals[name] = interval
+        self._start_times[name] = start_time
+        self._next_output[name] = None
+        self._times[name] = []
+        self._value_shapes[name] = (function.value_rank(),
+                                        function.value_size())
+
+
+    def write(self, time):
+        """Takes snapshots of all fields that are due for output at the given
+        time and queues them for writing.
+        """
+        for name, function in self._fields.items():
+            interval = self._intervals[name]
+            if interval is not None:
+                start = self._start_times[name]
+                tol = 1e-12*max(1.0, abs(time))
+                if time < start - tol:
+                    continue
+                # Index of the last output time at or before time
+                k = int(np.floor((time - start + tol)/interval))
+                if self._next_output[name] is None:
+                    on_grid = abs(time - start - k*interval) <= tol
+                    self._next_output[name] = k if on_grid else k + 1
+                if k < self._next_output[name]:
+                    continue
+                self._next_output[name] = k + 1
+
+            values = function.compute_vertex_values(self.mesh)
+            values = values.reshape(function.value_size(), -1).T
+            index = len(self._times[name])
+            self._times[name].append(float(time))
+            self._put(("field", "/{}/{}".format(name, index),
+                                                np.ascontiguousarray(values)))
+
+
+    def close(self):
+        """Waits for all queued snapshots to be written and writes the XDMF
+        index files.
+        """
+        if self._closed:
+            return
+        self._put(None)
+        self._writer.join()
+        self._closed = True
+        self._check_writer()
+        if self.rank == 0:
+            for name in self._fields.keys():
+                self._write_xdmf(name)
+        self.comm.barrier()
+        log(LogLevel.PROGRESS, "Closed output {}".format(self.basename))
+
+
+    def _put(self, item):
+        # Queues an item without blocking forever on a failed writer
+        while True:
+            self._check_writer()
+            try:
+                self._queue.put(item, timeout=1.0)
+                return
+            except queue.Full:
+                pass
+
+
+    def _check_writer(self):
+        if self._error is None:
+            try:
+                self._error = self._errors.get_nowait()
+            except queue.Empty:
+                pass
+        if self._error is not None:
+            msg = "The output writer of {} failed:\n{}".format(
+                                                self.filename, self._error)
+            raise RuntimeError(msg)
+        if not self._writer.is_alive() and not self._closed:
+            msg = "The output writer of {} has stopped.".format(
+                                                                self.filename)
+            raise RuntimeError(msg)
+
+
+    def _write_xdmf(self, name):
+        cell = self.mesh.ufl_cell().cellname()
+        topology_type = _TOPOLOGY_TYPES[cell]
+        nodes_per_cell = self.mesh.ufl_cell().num_vertices()
+        value_rank, value_size = self._value_shapes[name]
+        if value_rank == 0:
+            attribute_type, num_components = "Scalar", 1
+        elif value_rank == 1 and value_size in (2, 3):
+            # 2D vectors are padded with a zero z-component by the writer
+            attribute_type, num_components = "Vector", 3
+        else:
+            attribute_type, num_components = "Matrix", value_size
+
+        lines = ['<?xml version="1.0"?>', '<Xdmf Version="3.0">',
+                 '  <Domain>',
+                 '    <Grid Name="{}" GridType="Collection" '
+                 'CollectionType="Temporal">'.format(name)]
+        for index, time in enumerate(self._times[name]):
+            lines += ['      <Grid Name="{}_{}" GridType="Collection" '
+                      'CollectionType="Spatial">'.format(name, index),
+                      '        <Time Value="{!r}" />'.format(time)]
+            for rank, (num_vertices, num_cells) in\
+                                            enumerate(self._local_sizes):
+                h5 = os.path.basename("{}_p{}.h5".format(self.basename, rank))
+                lines += [
+                    '        <Grid Name="p{}" GridType="Uniform">'.format(rank),
+                    '          <Topology TopologyType="{}" '
+                    'NumberOfElements="{}" NodesPerElement="{}">'.format(
+                                    topology_type, num_cells, nodes_per_cell),
+                    '            <DataItem Dimensions="{} {}" NumberType='
+                    '"UInt" Format="HDF">{}:/mesh/topology</DataItem>'.format(
+                                                num_cells, nodes_per_cell, h5),
+                    '          </Topology>',
+                    '          <Geometry GeometryType="XYZ">',
+                    '            <DataItem Dimensions="{} 3" Format="HDF">'
+                    '{}:/mesh/geometry</DataItem>'.format(num_vertices, h5),
+                    '          </Geometry>',
+                    '          <Attribute Name="{}" AttributeType="{}" '
+                    'Center="Node">'.format(name, attribute_type),
+                    '            <DataItem Dimensions="{} {}" Format="HDF">'
+                    '{}:/{}/{}</DataItem>'.format(num_vertices,
+                                            num_components, h5, name, index),
+                    '          </Attribute>',
+                    '        </Grid>']
+            lines += ['      </Grid>']
+        lines += ['    </Grid>', '  </Domain>', '</Xdmf>']
+
+        with open("{}_{}.xdmf".format(self.basename, name), "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+class TimeSeries(object):
+    """Buffers samples of in-situ diagnostics, e.g. probes or ECG leads, on
+    rank 0 and appends them in blocks to an HDF5 file.
+
+    The file contains the datasets ``time`` (T,) and ``values`` (T, ...),
+    the given metadata datasets and the sample names in the ``names``
+    attribute of ``values``.
+
+    Parameters
+    ----------
+    filename : str, optional
+        HDF5 file the samples are written to. If None, all samples are kept
+        in memory.
+    comm : MPI communicator
+        Only rank 0 of comm buffers and writes samples.
+    names : list of str, optional
+        Names of the sampled quantities.
+    metadata : dict, optional
+        Arrays that are written once as datasets, e.g. probe coordinates.
+    buffer_size : int
+        Number of samples that are buffered before they are written.
+    """
+
+    def __init__(self, filename, comm, names=None, metadata=None,
+                                                            buffer_size=1000):
+        self.filename = filename
+        self.rank = df.MPI.rank(comm)
+        self.names = names
+        self.metadata = metadata if metadata is not None else {}
+        self.buffer_size = buffer_size
+        self.times = []
+        self._samples = []
+
+
+    def append(self, time, values):
+        """Appends a sample on rank 0, and writes the buffer when it is full.
+        Does nothing on other ranks.
+        """
+        if self.rank != 0:
+            return
+        self.times.append(float(time))
+        self._samples.append(values)
+        if self.filename is not None\
+                                and len(self._samples) >= self.buffer_size:
+            self.flush()
+
+
+    def values(self):
+        """Returns the times and values of the samples that are held in
+        memory on rank 0, i.e. all samples if there is no file.
+        """
+        return np.array(self.times), np.array(self._samples)
+
+
+    def flush(self):
+        """Appends the buffered samples to the HDF5 file and clears the
+        buffer. Only does something on rank 0.
+        """
+        if self.rank != 0 or self.filename is None or len(self._samples) == 0:
+            return
+        import h5py
+
+        samples = np.array(self._samples)
+        shape = samples.shape[1:]
+        with h5py.File(self.filename, "a") as f:
+            if "values" not in f:
+                for name, data in self.metadata.items():
+                    f.create_dataset(name, data=data)
+                f.create_dataset("time", shape=(0,), maxshape=(None,),
+                                                                dtype=float)
+                f.create_dataset("values", shape=(0,) + shape,
+                                 maxshape=(None,) + shape,
+                                 chunks=(self.buffer_size,) + shape,
+                                 dtype=float)
+                if self.names is not None:
+                    f["values"].attrs["names"] = np.array(self.names,
+                                                                    dtype="S")
+            offset = f["time"].shape[0]
+            f["time"].resize((offset + len(samples),))
+            f["time"][offset:] = self.times
+            f["values"].resize((offset + len(samples),) + shape)
+            f["values"][offset:] = samples
+        self.times = []
+        self._samples = []
+
+
+    def close(self):
+        """Writes all remaining samples.
+        """
+        self.flush()
+
+
+def _write_snapshots(filename, snapshots, errors):
+    """Writes queued snapshots to a process-local HDF5 file until None is
+    received. The traceback of an error is put into errors.
+    """
+    try:
+        _write_queued(filename, snapshots)
+    except Exception:
+        errors.put(traceback.format_exc())
+
+
+def _write_queued(filename, snapshots):
+    import h5py
+
+    with h5py.File(filename, "w") as f:
+        while True:
+            item = snapshots.get()
+            if item is None:
+                break
+            if item[0] == "mesh":
+                _, coordinates, cells = item
+                f.create_dataset("mesh/geometry", data=coordinates)
+                f.create_dataset("mesh/topology", data=cells)
+            else:
+                _, dataset, values = item
+                if values.shape[1] == 2:
+                    values = np.hstack((values, np.zeros((len(values), 1))))
+                f.create_dataset(dataset, data=values)
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""This module implements workload-weighted mesh partitioning.
+
+The default partitioner balances the number of cells per process. With a
+:py:class:`m3h3.ode.MultiCellModel`, the cost of a cell depends on the cell
+model of its region, so processes that own expensive regions fall behind.
+:py:func:`partition_geometry` computes a weighted recursive coordinate
+bisection of the cell midpoints, where each cell is weighted by the cost of
+its cell model plus an assembly cost, and redistributes the mesh, its marker
+functions and microstructure accordingly.
+
+The partition is stored in an HDF5 file in dolfin's mesh format, with the
+cells of each process stored contiguously and their offsets in the
+``partition`` attribute of the topology, and is read back with
+``use_partition_from_file``. If a cache directory is given, the file is kept
+and reused by later runs with the same mesh, costs and number of processes.
+The cells of each process may be ordered along a space-filling curve for
+locality of memory access, see :py:mod:`m3h3.reordering`.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import dolfin as df
+from dolfin import (Function, FunctionSpace, HDF5File, LogLevel, Mesh,
+                    MeshFunction)
+
+from m3h3.ode import MultiCellModel
+from m3h3.utils import log
+
+
+MARKER_FUNCTIONS = ("vfun", "efun", "ffun", "cfun")
+MICROSTRUCTURE = ("f0", "s0", "n0")
+
+_VALUE_TYPES = {"MeshFunctionSizet": "size_t", "MeshFunctionInt": "int",
+                "MeshFunctionDouble": "double", "MeshFunctionBool": "bool"}
+
+
+def model_cost(model):
+    """Returns the estimated cost of one ODE step of a cell model. Uses
+    :py:meth:`m3h3.ode.CardiacCellModel.estimated_cost` if available and the
+    number of states plus the membrane potential otherwise.
+    """
+    if hasattr(model, "estimated_cost"):
+        return float(model.estimated_cost())
+    return float(model.num_states() + 1)
+
+
+def cell_costs(cell_model, assembly_cost=1.0):
+    """Returns a dict that maps cell marker values to the estimated cost of a
+    cell with that marker, and the cost of cells with other markers.
+
+    Parameters
+    ----------
+    cell_model : :py:class:`m3h3.ode.CardiacCellModel`
+        Cell model of the electro problem. For a
+        :py:class:`m3h3.ode.MultiCellModel`, the cost of every region is
+        given by the cost of its model.
+    assembly_cost : float
+        Cost of assembling and solving the PDEs on one cell, relative to the
+        cell model costs.
+
+    Returns
+    -------
+    (dict, float)
+    """
+    if isinstance(cell_model, MultiCellModel):
+        costs = {int(key): model_cost(model) + assembly_cost
+                    for key, model in zip(cell_model.keys(),
+                                                        cell_model.models())}
+        default = max(costs.values())
+    elif cell_model is not None:
+        costs = {}
+        default = model_cost(cell_model) + assembly_cost
+    else:
+        costs = {}
+        default = assembly_cost
+    return costs, default
+
+
+def weighted_rcb(points, weights, num_parts):
+    """Partitions points into num_parts parts of equal total weight by
+    recursive coordinate bisection along the longest axis.
+
+    Returns
+    -------
+    :py:class:`numpy.ndarray`
+        The part of every point.
+    """
+    parts = np.zeros(len(points), dtype=np.intc)
+
+    def bisect(indices, first, n):
+        if n == 1 or len(indices) == 0:
+            parts[indices] = first
+            return
+        n_left = n//2
+        x = points[indices]
+        axis = np.argmax(x.max(axis=0) - x.min(axis=0))
+        order = indices[np.argsort(x[:, axis], kind="stable")]
+        cumulative = np.cumsum(weights[order])
+        split = np.searchsorted(cumulative, cumulative[-1]*n_left/n)
+        bisect(order[:split], first, n_left)
+        bisect(order[split:], first + n_left, n - n_left)
+
+    bisect(np.arange(len(points)), 0, num_parts)
+    return parts
+
+
+def partition_geometry(geometry, costs, default_cost=1.0, markers=None,
+                                            cache_dir=None, reorder=False):
+    """Redistributes a geometry across the processes of its mesh such that
+    every process owns the same estimated workload. This is a collective
+    call.
+
+    Parameters
+    ----------
+    geometry : :py:class:`geometry.HeartGeometry`
+        Geometry to redistribute. Marker functions and microstructure are
+        transferred to the new mesh.
+    costs : dict
+        Maps values of markers to the cost of a cell with that value.
+    default_cost : float
+        Cost of cells whose marker is not in costs.
+    markers : :py:class:`dolfin.MeshFunction`, optional
+        Cell function that defines the regions of costs. Defaults to the cell
+        function of the geometry.
+    cache_dir : str, optional
+        If given, the partitioned geometry is stored in this directory and
+        reused by later calls with the same mesh, costs and number of
+        processes.
+    reorder : bool, optional
+        If True, the cells of every process are ordered along a Morton
+        space-filling curve through their midpoints.
+
+    Returns
+    -------
+    (geometry, markers)
+        The redistributed geometry and cell function.
+    """
+    mesh = geometry.mesh
+    comm = mesh.mpi_comm()
+    rank = df.MPI.rank(comm)
+    markers = markers if markers is not None else geometry.cfun
+    tdim = mesh.topology().dim()
+    num_owned = mesh.topology().ghost_offset(tdim)
+
+    midpoints = mesh.coordinates()[mesh.cells()[:num_owned]].mean(axis=1)
+    weights = np.full(num_owned, float(default_cost))
+    if markers is not None:
+        values, inverse = np.unique(markers.array()[:num_owned],
+                                                        return_inverse=True)
+        region_costs = np.array([costs.get(int(v), default_cost)
+                                                            for v in values])
+        weights = region_costs[inverse]
+    global_indices = np.asarray(mesh.topology().global_indices(tdim))\
+                                                                [:num_owned]
+
+    key = _partition_key(comm, mesh, midpoints, weights, costs, default_cost,
+                                                                    reorder)
+    if cache_dir:
+        directory = cache_dir
+        if rank == 0:
+            os.makedirs(directory, exist_ok=True)
+    else:
+        directory = comm.bcast(tempfile.mkdtemp() if rank == 0 else None)
+    path = os.path.join(directory, "partition_{}.h5".format(key))
+
+    cached = comm.bcast(os.path.isfile(path) if rank == 0 else None)
+    if cached:
+        log(LogLevel.PROGRESS, "Reusing mesh partition {}".format(path))
+    else:
+        _write_partition(path, geometry, markers, midpoints, weights,
+                                                global_indices, reorder)
+    try:
+        new_geometry, new_markers = _read_partition(path, geometry, markers)
+    finally:
+        comm.barrier()
+        if not cache_dir and rank == 0:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    after = _local_weight(new_geometry.mesh, new_markers, costs, default_cost)
+    log(LogLevel.PROGRESS, "Repartitioned mesh by estimated workload: "\
+            "load imbalance {:.3f} (before {:.3f})".format(
+                _imbalance(comm, after), _imbalance(comm, np.sum(weights))))
+    return new_geometry, new_markers
+
+
+def _partition_key(comm, mesh, midpoints, weights, costs, default_cost,
+                                                                    reorder):
+    # Partition independent fingerprint of the mesh and its workload
+    tdim = mesh.topology().dim()
+    key = (df.MPI.size(comm), mesh.num_entities_global(0),
+           mesh.num_entities_global(tdim),
+           "{:.8e}".format(df.MPI.sum(comm, float(np.sum(midpoints)))),
+           "{:.8e}".format(df.MPI.sum(comm, float(np.sum(weights)))),
+           sorted(costs.items()), default_cost, reorder)
+    return hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+
+
+def _write_partition(path, geometry, markers, midpoints, weights,
+                                                    global_indices, reorder):
+    mesh = geometry.mesh
+    comm = mesh.mpi_comm()
+    size = df.MPI.size(comm)
+
+    all_midpoints = comm.gather(midpoints)
+    all_weights = comm.gather(weights)
+    all_indices = comm.gather(global_indices)
+
+    hdf = HDF5File(comm, path, "w")
+    try:
+        hdf.write(mesh, "/mesh")
+        for name in MARKER_FUNCTIONS:
+            mf = getattr(geometry, name, None)
+            if mf is not None:
+                hdf.write(mf, "/{}".format(name))
+        if markers is not None and markers is not geometry.cfun:
+            hdf.write(markers, "/markers")
+        for name in MICROSTRUCTURE:
+            f = getattr(geometry, name, None)
+            if f is not None:
+                hdf.write(f, "/{}".format(name))
+    finally:
+        hdf.close()
+
+    if df.MPI.rank(comm) == 0:
+        import h5py
+        from m3h3.reordering import morton_order
+
+        indices = np.concatenate(all_indices)
+        all_midpoints = np.concatenate(all_midpoints)
+        parts = weighted_rcb(all_midpoints, np.concatenate(all_weights), size)
+        part_of_cell = np.empty(indices.max() + 1, dtype=np.intc)
+        part_of_cell[indices] = parts
+
+        with h5py.File(path, "r+") as f:
+            topology = f["mesh/topology"]
+            cell_indices = f["mesh/cell_indices"][...]
+            cell_parts = part_of_cell[cell_indices]
+            if reorder:
+                # Cells of each process along the curve through all cells
+                curve = np.empty(indices.max() + 1, dtype=np.intp)
+                curve[indices[morton_order(all_midpoints)]] = \
+                                                    np.arange(len(indices))
+                order = np.lexsort((curve[cell_indices], cell_parts))
+            else:
+                order = np.argsort(cell_parts, kind="stable")
+            topology[...] = topology[...][order]
+            f["mesh/cell_indices"][...] = cell_indices[order]
+            offsets = np.searchsorted(cell_parts[order], np.arange(size))
+            topology.attrs["partition"] = offsets.astype(np.uint64)
+    comm.barrier()
+
+
+def _read_partition(path, geometry, markers):
+    comm = geometry.mesh.mpi_comm()
+    mesh = Mesh(comm)
+    hdf = HDF5File(comm, path, "r")
+    try:
+        hdf.read(mesh, "/mesh", True)
+
+        markerfunctions = {}
+        for name in MARKER_FUNCTIONS:
+            mf = getattr(geometry, name, None)
+            if mf is not None:
+                markerfunctions[name] = MeshFunction(
+                                    _VALUE_TYPES[type(mf).__name__], mesh,
+                                    mf.dim())
+                hdf.read(markerfunctions[name], "/{}".format(name))
+
+        new_markers = None
+        if markers is not None and markers is geometry.cfun:
+            new_markers = markerfunctions["cfun"]
+        elif markers is not None:
+            new_markers = MeshFunction(_VALUE_TYPES[type(markers).__name__],
+                                                        mesh, markers.dim())
+            hdf.read(new_markers, "/markers")
+
+        microstructure = {}
+        for name in MICROSTRUCTURE:
+            f = getattr(geometry, name, None)
+            if f is not None:
+                V = FunctionSpace(mesh, f.function_space().ufl_element())
+                microstructure[name] = Function(V)
+                hdf.read(microstructure[name], "/{}".format(name))
+    finally:
+        hdf.close()
+
+    kwargs = {"markers": geometry.markers}
+    if markerfunctions:
+        kwargs["markerfunctions"] = type(geometry.markerfunctions)(
+                                                            **markerfunctions)
+    if microstructure:
+        kwargs["microstructure"] = type(geometry.microstructure)(
+                                                            **microstructure)
+    return type(geometry)(mesh, **kwargs), new_markers
+
+
+def _local_weight(mesh, markers, costs, default_cost):
+    num_owned = mesh.topology().ghost_offset(mesh.topology().dim())
+    if markers is None:
+        return float(num_owned*default_cost)
+    return float(sum(costs.get(int(v), default_cost)
+                                    for v in markers.array()[:num_owned]))
+
+
+def _imbalance(comm, local):
+    local = float(local)
+    mean = df.MPI.sum(comm, local)/df.MPI.size(comm)
+    return df.MPI.max(comm, local)/mean if mean > 0 else 1.0
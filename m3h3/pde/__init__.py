@@ -1,5 +1,25 @@
+import importlib
+
 from m3h3.pde.problem import Problem
 from m3h3.pde.electro_problem import ElectroProblem, Stimulus
-from m3h3.pde.solid_problem import SolidProblem
-from m3h3.pde.fluid_problem import FluidProblem
-from m3h3.pde.porous_problem import PorousProblem
+
+# Problems of the other physics pull in heavy dependencies, e.g. pulse for
+# solid mechanics, and are only imported on first use
+_lazy = {'SolidProblem': 'm3h3.pde.solid_problem',
+         'FluidProblem': 'm3h3.pde.fluid_problem',
+         'PorousProblem': 'm3h3.pde.porous_problem',
+         'EikonalProblem': 'm3h3.pde.eikonal_problem'}
+
+__all__ = ['Problem', 'ElectroProblem', 'Stimulus', 'SolidProblem',
+            'FluidProblem', 'PorousProblem', 'EikonalProblem']
+
+
+def __getattr__(name):
+    if name in _lazy:
+        return getattr(importlib.import_module(_lazy[name]), name)
+    msg = "module {!r} has no attribute {!r}".format(__name__, name)
+    raise AttributeError(msg)
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_lazy.keys()))
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""This module implements the anisotropic eikonal model of the activation
+sequence, a fast alternative to the bidomain equations when only the
+activation times are needed, e.g. to drive the active tension of the
+mechanics.
+"""
+
+import numpy as np
+
+from dolfin import Function, FunctionSpace
+
+from m3h3.pde import Problem
+from m3h3.pde.electro_problem import (bulk_conductivities,
+                                     cell_directions, marker_value)
+from m3h3.pde.problem import marker_names
+
+
+class EikonalProblem(Problem):
+    """The activation times t of the heart are the solution of the
+    anisotropic eikonal equation
+
+        sqrt(grad t . D grad t) = 1,
+
+    with t prescribed at the stimulus sites. The velocity tensor
+    D = c_f^2 f0 f0 + c_s^2 s0 s0 + c_n^2 n0 n0 is aligned with the
+    microstructure of the geometry. The velocity along the fibers is the
+    ``conduction_velocity`` parameter of the ``Eikonal`` set, and the
+    velocities along the sheets and normals scale with the square root of
+    the bulk conductivities of the electro parameters, see
+    :py:func:`m3h3.pde.electro_problem.bulk_conductivities`.
+
+    The stimulus sites are the cells of the markers in the
+    ``stimulus_markers`` parameter, which are activated at the
+    ``stimulus_times``, both comma separated. One time applies to all
+    markers.
+
+    The :py:attr:`active_tension` follows a prescribed profile of the time
+    since activation, see :py:func:`tension_profile`, which repeats with
+    the period of the stimulus if it is positive.
+    """
+
+    def __init__(self, geometry, time, parameters, **kwargs):
+        super().__init__(geometry, time, parameters, **kwargs)
+        self.function_space = FunctionSpace(geometry.mesh, "P", 1)
+        self.activation_time = Function(self.function_space,
+                                                    name="activation_time")
+        self.active_tension = Function(self.function_space,
+                                                    name="active_tension")
+        self._activation_key = self._activation_parameters()
+
+
+    def update_parameters(self, parameters=None):
+        """Updates the parameters. The tension profile is evaluated from
+        the parameters in every step.
+
+        Returns
+        -------
+        bool
+            True if the activation times have to be recomputed.
+        """
+        if parameters is not None:
+            self.parameters = parameters
+        key = self._activation_parameters()
+        changed, self._activation_key = key != self._activation_key, key
+        return changed
+
+
+    def velocities(self):
+        """Returns the conduction velocities along the fiber, sheet and
+        normal directions.
+        """
+        velocity = self.parameters["Eikonal"]["conduction_velocity"]
+        bulk = bulk_conductivities(self.parameters)
+        return tuple(velocity*np.sqrt(b/bulk[0]) for b in bulk)
+
+
+    def metrics(self):
+        """Returns the inverse velocity tensors of the owned cells, whose
+        norms of a distance vector are the travel times along it.
+        """
+        mesh = self.geometry.mesh
+        dim = mesh.geometry().dim()
+        num_cells = mesh.topology().ghost_offset(mesh.topology().dim())
+        c_f, c_s, c_n = self.velocities()
+        D = np.tile(c_s**2*np.eye(dim), (num_cells, 1, 1))
+        f0 = cell_directions(self.geometry, "f0")
+        if f0 is not None:
+            D += (c_f**2 - c_s**2)*np.einsum("ci,cj->cij", f0, f0)
+        else:
+            D += (c_f**2 - c_s**2)*np.eye(dim)
+        n0 = cell_directions(self.geometry, "n0") if dim == 3 else None
+        if n0 is not None:
+            D += (c_n**2 - c_s**2)*np.einsum("ci,cj->cij", n0, n0)
+        return np.linalg.inv(D)
+
+
+    def sources(self):
+        """Returns the local indices of the stimulated vertices and their
+        activation times.
+        """
+        parameters = self.parameters["Eikonal"]
+        names = marker_names(parameters["stimulus_markers"])
+        times = [float(t) for t in parameters["stimulus_times"].split(",")
+                                                                if t.strip()]
+        if len(times) == 1:
+            times = times*len(names)
+        if len(times) != len(names):
+            msg = "Got {} stimulus times for {} stimulus markers.".format(
+                                                    len(times), len(names))
+            raise ValueError(msg)
+
+        cells = self.geometry.mesh.cells()
+        cfun = self.geometry.cfun.array()
+        vertices, vertex_times = [], []
+        for name, time in zip(names, times):
+            if name not in self.geometry.markers:
+                continue
+            stimulated = np.unique(cells[cfun[:len(cells)]
+                                == marker_value(self.geometry.markers, name)])
+            vertices.append(stimulated)
+            vertex_times.append(np.full(len(stimulated), time))
+        if not vertices:
+            return np.zeros(0, dtype=int), np.zeros(0)
+        return np.concatenate(vertices), np.concatenate(vertex_times)
+
+
+    def _activation_parameters(self):
+        # Parameters that determine the activation times
+        parameters = self.parameters["Eikonal"]
+        return (self.velocities(), parameters["stimulus_markers"],
+                parameters["stimulus_times"], parameters["tolerance"])
+
+
+    def _get_solution_fields(self):
+        return (self.activation_time, self.active_tension)
+
+
+    def _get_state_fields(self):
+        return {"activation_time": self.activation_time}
+
+
+def tension_profile(elapsed, peak, rise_time, decay_time, duration):
+    """Returns the active tension at the times elapsed since activation,
+
+        T(s) = peak tanh(s/rise_time)^2 tanh((duration - s)/decay_time)^2
+
+    for 0 < s < duration and zero otherwise.
+    """
+    elapsed = np.asarray(elapsed, dtype=float)
+    tension = np.zeros(elapsed.shape)
+    active = (elapsed > 0) & (elapsed < duration)
+    s = elapsed[active]
+    tension[active] = peak*np.tanh(s/rise_time)**2\
+                                    *np.tanh((duration - s)/decay_time)**2
+    return tension
@@ -2,13 +2,121 @@
 """This module implements the variational form for electrophysiology problems
 """
 
+import numpy as np
+
+import dolfin as df
 from dolfin import (grad, inner, Constant, FiniteElement, Function,
                     FunctionAssigner, FunctionSpace, Measure, MixedElement,
-                    TestFunctions, TrialFunctions, UserExpression)
-import cbcbeat
+                    TensorFunctionSpace, TestFunctions, TrialFunctions,
+                    UserExpression, VectorFunctionSpace)
 
 from m3h3.pde import Problem
-from m3h3.ode import *
+
+
+def marker_value(markers, name):
+    """Returns the integer value of a geometry marker, which may be given
+    either as the value itself or as a (value, dimension) tuple.
+    """
+    value = markers[name]
+    if isinstance(value, (tuple, list)):
+        return value[0]
+    return value
+
+
+def conductivities(parameters, domain):
+    """Returns the conductivities of a domain, ``"i"`` or ``"e"``, along the
+    fiber, sheet and normal directions from the electro parameters, i.e.
+    ``M_i``, ``M_i_t`` and ``M_i_n`` for the intracellular domain.
+    """
+    name = "M_" + domain
+    return (parameters[name], parameters[name + "_t"],
+                                                    parameters[name + "_n"])
+
+
+def bulk_conductivities(parameters):
+    """Returns the bulk conductivities along the fiber, sheet and normal
+    directions, i.e. the harmonic means M_i*M_e/(M_i + M_e) of the
+    intracellular and extracellular conductivities in the electro
+    parameters, which determine the conduction velocities of the monodomain
+    reduction.
+    """
+    return tuple(M_i*M_e/(M_i + M_e) for M_i, M_e in zip(
+                                        conductivities(parameters, "i"),
+                                        conductivities(parameters, "e")))
+
+
+def cell_directions(geometry, name):
+    """Returns the normalized directions of a microstructure field of the
+    geometry, ``"f0"``, ``"s0"`` or ``"n0"``, in the owned cells, or None if
+    the geometry does not have it.
+    """
+    f = getattr(geometry, name, None)
+    if f is None:
+        return None
+    mesh = geometry.mesh
+    V = VectorFunctionSpace(mesh, "DG", 0)
+    f = df.interpolate(f, V)
+    values = f.vector().get_local()[_cell_dofs(V)]
+    norms = np.linalg.norm(values, axis=1)
+    norms[norms == 0] = 1.0
+    return values/norms[:, None]
+
+
+class ConductivityTensor(object):
+    """A cellwise constant conductivity tensor
+
+        M = M_l f0 f0 + M_t s0 s0 + M_n n0 n0
+
+    aligned with the microstructure of a geometry. The projections onto the
+    fiber, sheet and normal directions are computed once, so the tensor is
+    a plain coefficient of the forms and updating the conductivities is a
+    linear combination of three vectors. The sheet direction defaults to
+    the complement of the fiber and normal directions.
+
+    Parameters
+    ----------
+    geometry : :py:class:`geometry.Geometry`
+        A geometry with fiber directions f0.
+    """
+
+    def __init__(self, geometry):
+        mesh = geometry.mesh
+        dim = mesh.geometry().dim()
+        T = TensorFunctionSpace(mesh, "DG", 0)
+        self.function = Function(T, name="conductivity")
+
+        f = cell_directions(geometry, "f0")
+        n = cell_directions(geometry, "n0") if dim == 3 else None
+        s = cell_directions(geometry, "s0")
+        F = np.einsum("ci,cj->cij", f, f)
+        N = np.einsum("ci,cj->cij", n, n) if n is not None\
+                                                    else np.zeros_like(F)
+        S = np.einsum("ci,cj->cij", s, s) if s is not None\
+                                                    else np.eye(dim) - F - N
+        dofs = _cell_dofs(T)
+        self._projections = []
+        for P in (F, S, N):
+            values = np.zeros(self.function.vector().local_size())
+            values[dofs] = P.reshape(len(P), -1)
+            self._projections.append(values)
+
+
+    def assign(self, longitudinal, transverse, normal):
+        """Sets the conductivities along the fiber, sheet and normal
+        directions.
+        """
+        values = sum(c*P for c, P in zip((longitudinal, transverse, normal),
+                                                        self._projections))
+        self.function.vector().set_local(values)
+        self.function.vector().apply("insert")
+
+
+def _cell_dofs(V):
+    # Local dofs of the owned cells of a DG0 space, one row per cell
+    mesh = V.mesh()
+    dofmap = V.dofmap()
+    num_cells = mesh.topology().ghost_offset(mesh.topology().dim())
+    return np.array([dofmap.cell_dofs(c) for c in range(num_cells)])
 
 
 class Stimulus(UserExpression):
@@ -23,7 +131,8 @@ class Stimulus(UserExpression):
         self.t = kwargs['t']
 
     def eval_cell(self, values, x, cell):
-        periodic_t = float(self.t) % self.period
+        periodic_t = float(self.t) % self.period if self.period > 0\
+                                                            else float(self.t)
         if self.markers[cell.index] == self.stimulus_marker\
                                             and periodic_t < self.duration:
             values[0] = self.amplitude
@@ -46,14 +155,19 @@ class ElectroProblem(Problem):
         self._init_fields()
         self._init_form(**kwargs)
         # self._set_initial_conditions()
-        self.cell_model = self.get_cell_model()
+        self.cell_model = self.get_cell_model(**kwargs)
 
 
-    def get_cell_model(self):
-        """Returns the cell model specified in the parameters.
+    def get_cell_model(self, **kwargs):
+        """Returns the cell model given as keyword argument cell_model, e.g.
+        a :py:class:`m3h3.ode.MultiCellModel`, or the cell model specified in
+        the parameters.
         """
+        if kwargs.get('cell_model') is not None:
+            return kwargs['cell_model']
         model = self.parameters['cell_model']
         if model == "Tentusscher_panfilov_2006_M_cell":
+            from m3h3.ode import Tentusscher_panfilov_2006_M_cell
             return Tentusscher_panfilov_2006_M_cell()
 
 
@@ -88,12 +202,52 @@ class ElectroProblem(Problem):
         self.solution = Function(self.solution_space, name="solution")
 
 
+    def update_parameters(self, parameters=None):
+        """Updates the constants of the form from the parameters in place,
+        so that the form does not have to be recompiled.
+
+        Returns
+        -------
+        bool
+            True if constants of the left hand side have changed, i.e. the
+            system matrix has to be reassembled.
+        """
+        if parameters is not None:
+            self.parameters = parameters
+        lhs_constants = (self.dt, self.theta, self.M_i, self.M_e)
+        before = [float(c) for c in lhs_constants] + [self._conductivities]
+        for name, constant in (('dt', self.dt), ('theta', self.theta),
+                               ('M_i', self.M_i), ('M_e', self.M_e),
+                               ('I_a', self.I_a)):
+            constant.assign(self.parameters[name])
+        self._conductivities = self._assign_conductivities()
+        if self.I_s is not None:
+            for name in ('amplitude', 'period', 'duration'):
+                setattr(self.I_s, name, self.parameters["I_s"][name])
+        return before != [float(c) for c in lhs_constants]\
+                                                    + [self._conductivities]
+
+
     def _init_form(self, **kwargs):
-        M_i = self.parameters['M_i']
-        M_e = self.parameters['M_e']
-        I_a = self.parameters['I_a'] # externally applied current
-        dt = self.parameters['dt']
-        theta = self.parameters['theta']
+        # All numeric parameters are constants, so that they can be changed
+        # without recompiling the form, e.g. for adaptive time steps or in
+        # parameter sweeps
+        self.dt = Constant(self.parameters['dt'], name="dt")
+        self.theta = Constant(self.parameters['theta'], name="theta")
+        self.M_i = Constant(self.parameters['M_i'], name="M_i")
+        self.M_e = Constant(self.parameters['M_e'], name="M_e")
+        self.I_a = Constant(self.parameters['I_a'], name="I_a")
+        M_i, M_e, I_a = self.M_i, self.M_e, self.I_a
+        # With fibers, the conductivities are tensors that are built once
+        # and updated in place
+        self.conductivity_tensors = None
+        if getattr(self.geometry, "f0", None) is not None:
+            self.conductivity_tensors = (ConductivityTensor(self.geometry),
+                                            ConductivityTensor(self.geometry))
+            M_i, M_e = [tensor.function
+                                for tensor in self.conductivity_tensors]
+        self._conductivities = self._assign_conductivities()
+        theta = self.theta
 
         use_constraint = self.parameters['use_average_u_constraint']
         if use_constraint:
@@ -105,8 +259,6 @@ class ElectroProblem(Problem):
 
         dx = self.geometry.dx
         v_ = self.prev_current
-        k = Constant(1/dt)
-        t = float(self.time)
 
         # bidomain equation
         Vmid = theta*v + (1-theta)*v_
@@ -114,24 +266,40 @@ class ElectroProblem(Problem):
                                             + inner(M_i*grad(u), grad(w))*dx)
         theta_elliptic = (inner(M_i*grad(Vmid), grad(q))*dx\
                                     + inner((M_i + M_e)*grad(u), grad(q))*dx)
-        self._form = k*(v-v_)*w*dx + theta_parabolic + theta_elliptic
+        self._form = (v-v_)/self.dt*w*dx + theta_parabolic + theta_elliptic
 
         if use_constraint:
             self._form += (lbd*u + l*q)*dx
 
         # external current
-        self._form += I_a*q*dx
+        self._form -= I_a*q*dx
 
         # stimulus
+        self.I_s = None
         if 'STIMULUS' in self.geometry.markers.keys():
-            stim_marker = self.geometry.markers['STIMULUS']
-            I_s = Stimulus(self.geometry.markers, stim_marker,
+            stim_marker = marker_value(self.geometry.markers, 'STIMULUS')
+            self.I_s = Stimulus(self.geometry.cfun, stim_marker,
                             amplitude=self.parameters["I_s"]['amplitude'],
-                            period=self.parameters["I_s"]['amplitude'],
+                            period=self.parameters["I_s"]['period'],
                             duration=self.parameters["I_s"]['duration'],
                             t=self.time, degree=1)
-            self._form += I_s*w*dx
+            self._form -= self.I_s*w*dx
+
+
+    def _assign_conductivities(self):
+        # Sets the conductivity tensors and returns the conductivities
+        values = (conductivities(self.parameters, "i"),
+                                        conductivities(self.parameters, "e"))
+        if self.conductivity_tensors is not None:
+            for tensor, value in zip(self.conductivity_tensors, values):
+                tensor.assign(*value)
+        return values
 
 
     def _get_solution_fields(self):
         return (self.prev_current, self.solution)
+
+
+    def _get_state_fields(self):
+        return {"prev_current": self.prev_current, "solution": self.solution}
+
@@ -1,14 +1,143 @@
+from collections import OrderedDict
+
 import dolfin as df
+from dolfin import (Constant, DirichletBC, FacetNormal, Function,
+                    FunctionSpace, TestFunction, TrialFunction,
+                    VectorFunctionSpace, div, dot, grad, inner,
+                    nabla_grad, sym)
 
 from m3h3.pde import Problem
+from m3h3.pde.electro_problem import marker_value
+from m3h3.pde.problem import PrecomputedDirichletBC, marker_names
 
 
 class FluidProblem(Problem):
+    """This class implements the incompressible Navier-Stokes equations of
+    blood flow for the incremental pressure correction scheme (IPCS) of
+    :py:class:`m3h3.pde.solver.FluidSolver`.
+
+    The terms of the scheme are given as separate forms in
+    :py:attr:`forms`. All but the convection term are bilinear forms with
+    constant coefficients, whose matrices the solver assembles once.
+
+    Walls with the markers in the ``no_slip`` parameter of the
+    ``BoundaryConditions`` set have zero velocity. The pressure is
+    prescribed on the ``inflow`` and ``outflow`` boundaries, whose pressures
+    are the Constants :py:attr:`inflow_pressure` and
+    :py:attr:`outflow_pressure`. Markers are given as comma separated
+    names.
+    """
 
     def __init__(self, geometry, time, parameters, **kwargs):
         super().__init__(geometry, time, parameters, **kwargs)
+        self._init_fields()
         self._form = self._init_form()
+        self._init_bcs()
+
+
+    def update_parameters(self, parameters=None):
+        """Updates the constants of the forms and the boundary pressures
+        from the parameters in place.
+
+        Returns
+        -------
+        bool
+            True if the time step or a material constant has changed, i.e.
+            the matrices of the scheme have to be reassembled.
+        """
+        if parameters is not None:
+            self.parameters = parameters
+        constants = (self.dt, self.density, self.viscosity)
+        before = [float(c) for c in constants]
+        for name, constant in (('dt', self.dt), ('density', self.density),
+                               ('viscosity', self.viscosity)):
+            constant.assign(self.parameters[name])
+        bcs_parameters = self.parameters["BoundaryConditions"]
+        self.inflow_pressure.assign(bcs_parameters["inflow_pressure"])
+        self.outflow_pressure.assign(bcs_parameters["outflow_pressure"])
+        return before != [float(c) for c in constants]
+
+
+    def _init_fields(self):
+        mesh = self.geometry.mesh
+        self.velocity_space = VectorFunctionSpace(mesh, "P",
+                                        self.parameters["velocity_degree"])
+        self.pressure_space = FunctionSpace(mesh, "P",
+                                        self.parameters["pressure_degree"])
+        self.velocity = Function(self.velocity_space, name="velocity")
+        self.pressure = Function(self.pressure_space, name="pressure")
+        self.tentative_velocity = Function(self.velocity_space,
+                                                name="tentative_velocity")
 
 
     def _init_form(self):
-        return 0
+        self.dt = Constant(self.parameters['dt'], name="dt")
+        self.density = Constant(self.parameters['density'], name="density")
+        self.viscosity = Constant(self.parameters['viscosity'],
+                                                            name="viscosity")
+        rho, mu, k = self.density, self.viscosity, self.dt
+
+        u, v = TrialFunction(self.velocity_space),\
+                                        TestFunction(self.velocity_space)
+        p, q = TrialFunction(self.pressure_space),\
+                                        TestFunction(self.pressure_space)
+        u_ = self.velocity
+        n = FacetNormal(self.geometry.mesh)
+        dx = df.dx(self.geometry.mesh)
+        ds = df.ds(self.geometry.mesh)
+
+        self.forms = OrderedDict()
+        self.forms["mass"] = dot(u, v)*dx
+        # Viscous stress, including the boundary term of the outflow
+        # boundaries
+        self.forms["viscous"] = inner(2*mu*sym(nabla_grad(u)),
+                                        sym(nabla_grad(v)))*dx\
+                                    - dot(mu*nabla_grad(u)*n, v)*ds
+        self.forms["pressure_stress"] = -p*div(v)*dx + dot(p*n, v)*ds
+        self.forms["laplacian"] = dot(grad(p), grad(q))*dx
+        self.forms["divergence"] = div(u)*q*dx
+        self.forms["gradient"] = dot(grad(p), v)*dx
+        self.forms["convection"] = rho*dot(dot(u_, nabla_grad(u_)), v)*dx
+        self.forms["convection_matrix"] = rho*dot(dot(u_, nabla_grad(u)),
+                                                                        v)*dx
+
+        # Residual of the tentative velocity step
+        U = 0.5*(u + u_)
+        return rho*dot((u - u_)/k, v)*dx\
+                + rho*dot(dot(u_, nabla_grad(u_)), v)*dx\
+                + inner(2*mu*sym(nabla_grad(U)), sym(nabla_grad(v)))*dx\
+                - dot(mu*nabla_grad(U)*n, v)*ds\
+                + inner(-self.pressure, div(v))*dx\
+                + dot(self.pressure*n, v)*ds
+
+
+    def _init_bcs(self):
+        # The dofs of all boundary conditions are found once
+        bcs_parameters = self.parameters["BoundaryConditions"]
+        markers = self.geometry.markers
+        ffun = self.geometry.ffun
+        dim = self.geometry.mesh.geometry().dim()
+
+        self.velocity_bcs = []
+        for name in marker_names(bcs_parameters["no_slip"]):
+            bc = DirichletBC(self.velocity_space, Constant((0.0,)*dim), ffun,
+                                                marker_value(markers, name))
+            self.velocity_bcs.append(PrecomputedDirichletBC(bc,
+                                                        self.velocity_space))
+
+        self.inflow_pressure = Constant(bcs_parameters["inflow_pressure"],
+                                                    name="inflow_pressure")
+        self.outflow_pressure = Constant(bcs_parameters["outflow_pressure"],
+                                                    name="outflow_pressure")
+        self.pressure_bcs = []
+        for label, pressure in (("inflow", self.inflow_pressure),
+                                ("outflow", self.outflow_pressure)):
+            for name in marker_names(bcs_parameters[label]):
+                bc = DirichletBC(self.pressure_space, Constant(0.0), ffun,
+                                                marker_value(markers, name))
+                self.pressure_bcs.append((PrecomputedDirichletBC(bc,
+                                            self.pressure_space), pressure))
+
+
+    def _get_state_fields(self):
+        return {"velocity": self.velocity, "pressure": self.pressure}
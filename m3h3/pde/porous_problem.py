@@ -1,14 +1,184 @@
+from collections import OrderedDict
+
 import dolfin as df
+from dolfin import (Constant, FiniteElement, Function, FunctionSpace,
+                    MixedElement, TestFunctions, TrialFunctions, dot, grad)
 
 from m3h3.pde import Problem
+from m3h3.pde.electro_problem import marker_value
+from m3h3.pde.problem import marker_names
 
 
 class PorousProblem(Problem):
+    """This class implements a multi-compartment Darcy model of myocardial
+    perfusion, for the pressures p_i of N compartments, e.g. arterial,
+    arteriole and capillary blood,
+
+        c_i dp_i/dt - div(K_i grad p_i) + sum_j beta_ij (p_i - p_j) = s_i,
+
+    with compliances c_i, permeabilities K_i and symmetric transfer
+    coefficients beta_ij between the compartments. Blood enters the first
+    compartment with the flux :py:attr:`inflow_flux` through the ``inflow``
+    boundaries and drains from the last compartment with the coefficient
+    ``drainage`` to the :py:attr:`venous_pressure`.
+
+    The coefficients are given as comma separated values in the parameters:
+    ``compliances`` and ``permeabilities`` with one value per compartment,
+    and ``transfer_coefficients`` with the N(N-1)/2 values beta_12,
+    beta_13, ..., beta_1N, beta_23, ... of the upper triangle.
+
+    The implicit Euler step is split into :py:attr:`forms`, such that the
+    operator and the storage matrices do not depend on the solution, and the
+    boundary terms are vectors that are scaled by the inflow flux and the
+    venous pressure.
+    """
 
     def __init__(self, geometry, time, parameters, **kwargs):
         super().__init__(geometry, time, parameters, **kwargs)
+        self.num_compartments = self.parameters["num_compartments"]
+        self._init_fields()
         self._form = self._init_form()
 
 
+    def update_parameters(self, parameters=None):
+        """Updates the coefficients and boundary data from the parameters in
+        place.
+
+        Returns
+        -------
+        bool
+            True if the time step or a coefficient has changed, i.e. the
+            matrices have to be reassembled.
+        """
+        if parameters is not None:
+            self.parameters = parameters
+        constants = self._coefficients()
+        before = [float(c) for c, _ in constants]
+        for constant, value in constants:
+            constant.assign(value)
+        self.inflow_flux.assign(
+                        self.parameters["BoundaryConditions"]["inflow_flux"])
+        self.venous_pressure.assign(
+                    self.parameters["BoundaryConditions"]["venous_pressure"])
+        return before != [float(c) for c, _ in constants]
+
+
+    def compartment(self, i):
+        """Returns the pressure of compartment i as a function on its own
+        space, e.g. for output.
+        """
+        if self.num_compartments == 1:
+            return self.pressure.copy(deepcopy=True)
+        return self.pressure.split(deepcopy=True)[i]
+
+
+    def _init_fields(self):
+        mesh = self.geometry.mesh
+        element = FiniteElement("P", mesh.ufl_cell(),
+                                self.parameters["polynomial_degree"])
+        if self.num_compartments == 1:
+            self.state_space = FunctionSpace(mesh, element)
+        else:
+            self.state_space = FunctionSpace(mesh,
+                            MixedElement([element]*self.num_compartments))
+        self.pressure = Function(self.state_space, name="pressure")
+        self.previous_pressure = Function(self.state_space,
+                                                    name="previous_pressure")
+
+
     def _init_form(self):
-        return 0
\ No newline at end of file
+        N = self.num_compartments
+        self.dt = Constant(self.parameters["dt"], name="dt")
+        self.compliances = [Constant(c) for c in _values(
+                            self.parameters["compliances"], N, "compliances")]
+        self.permeabilities = [Constant(K) for K in _values(
+                    self.parameters["permeabilities"], N, "permeabilities")]
+        pairs = [(i, j) for i in range(N) for j in range(i + 1, N)]
+        self.transfer_coefficients = OrderedDict(zip(pairs, [Constant(beta)
+                        for beta in _values(
+                            self.parameters["transfer_coefficients"],
+                            len(pairs), "transfer_coefficients")]))
+        bcs_parameters = self.parameters["BoundaryConditions"]
+        self.drainage = Constant(bcs_parameters["drainage"], name="drainage")
+        self.inflow_flux = Constant(bcs_parameters["inflow_flux"],
+                                                        name="inflow_flux")
+        self.venous_pressure = Constant(bcs_parameters["venous_pressure"],
+                                                    name="venous_pressure")
+
+        p, q = _split(TrialFunctions(self.state_space), N),\
+                                    _split(TestFunctions(self.state_space), N)
+        mesh = self.geometry.mesh
+        dx = df.dx(mesh)
+        ds = df.ds(mesh, subdomain_data=self.geometry.ffun)
+        inflow = [marker_value(self.geometry.markers, name)
+                for name in marker_names(bcs_parameters["inflow"])]
+
+        storage = sum(c/self.dt*p_i*q_i*dx
+                        for c, p_i, q_i in zip(self.compliances, p, q))
+        operator = storage\
+                + sum(dot(K*grad(p_i), grad(q_i))*dx
+                        for K, p_i, q_i in zip(self.permeabilities, p, q))\
+                + self.drainage*p[-1]*q[-1]*dx
+        for (i, j), beta in self.transfer_coefficients.items():
+            operator += beta*(p[i] - p[j])*(q[i] - q[j])*dx
+
+        self.forms = OrderedDict()
+        self.forms["operator"] = operator
+        self.forms["storage"] = storage
+        # Boundary data per unit flux and venous pressure
+        if inflow:
+            self.forms["inflow"] = sum(q[0]*ds(marker) for marker in inflow)
+        else:
+            self.forms["inflow"] = Constant(0.0)*q[0]*dx
+        self.forms["drainage"] = self.drainage*q[-1]*dx
+
+        # Residual of the implicit Euler step
+        p_ = _split(df.split(self.pressure), N)
+        p_n = _split(df.split(self.previous_pressure), N)
+        F = sum(c*(p_i - p_n_i)/self.dt*q_i*dx for c, p_i, p_n_i, q_i
+                                    in zip(self.compliances, p_, p_n, q))\
+            + sum(dot(K*grad(p_i), grad(q_i))*dx
+                        for K, p_i, q_i in zip(self.permeabilities, p_, q))\
+            + self.drainage*(p_[-1] - self.venous_pressure)*q[-1]*dx
+        for (i, j), beta in self.transfer_coefficients.items():
+            F += beta*(p_[i] - p_[j])*q[i]*dx + beta*(p_[j] - p_[i])*q[j]*dx
+        for marker in inflow:
+            F -= self.inflow_flux*q[0]*ds(marker)
+        return F
+
+
+    def _coefficients(self):
+        # Pairs of constants of the matrices and their parameter values
+        N = self.num_compartments
+        values = [self.parameters["dt"]]\
+                + _values(self.parameters["compliances"], N, "compliances")\
+                + _values(self.parameters["permeabilities"], N,
+                                                        "permeabilities")\
+                + _values(self.parameters["transfer_coefficients"],
+                    len(self.transfer_coefficients), "transfer_coefficients")\
+                + [self.parameters["BoundaryConditions"]["drainage"]]
+        constants = [self.dt] + self.compliances + self.permeabilities\
+                + list(self.transfer_coefficients.values()) + [self.drainage]
+        return list(zip(constants, values))
+
+
+    def _get_state_fields(self):
+        return {"pressure": self.pressure}
+
+
+def _values(values, length, name):
+    # Comma separated floats of a parameter
+    values = [float(value) for value in str(values).split(",")
+                                                        if value.strip()]
+    if len(values) != length:
+        msg = "Parameter {} needs {} values, got {}.".format(name, length,
+                                                                len(values))
+        raise ValueError(msg)
+    return values
+
+
+def _split(functions, length):
+    # Functions of one compartment may not be given as a sequence
+    if not isinstance(functions, (tuple, list)):
+        return [functions]
+    return list(functions)
@@ -1,8 +1,89 @@
+import numpy as np
+
 import dolfin as df
+from dolfin import Function, la_index_dtype
+
+
+class PrecomputedDirichletBC(object):
+    """A Dirichlet boundary condition whose constrained dofs and values are
+    computed once, so that applying it does not search the boundary again.
+
+    Parameters
+    ----------
+    bc : :py:class:`dolfin.DirichletBC`
+        The boundary condition. Its values must not change afterwards.
+    function_space : :py:class:`dolfin.FunctionSpace`
+        The space of the tensors the condition is applied to.
+    """
+
+    def __init__(self, bc, function_space):
+        # Owned dofs that bc changes, and their values. Applying bc to two
+        # different vectors finds all of them, whatever the values of bc,
+        # including dofs on facets of other processes.
+        applied = []
+        for fill in (1.0, 2.0):
+            x = Function(function_space).vector()
+            x[:] = fill
+            bc.apply(x)
+            applied.append(x.get_local())
+        constrained = (applied[0] != 1.0) | (applied[1] != 2.0)
+        self.dofs = np.flatnonzero(constrained).astype(la_index_dtype())
+        self.values = applied[1][constrained]
+
+
+    def homogenize(self):
+        """Sets the values of the condition to zero, e.g. for Newton
+        increments.
+        """
+        self.values = np.zeros_like(self.values)
+
+
+    def assign(self, values):
+        """Sets the values of the condition, either to one value for all
+        dofs, e.g. a time dependent pressure, or to an array of values.
+        """
+        self.values = np.broadcast_to(np.asarray(values, dtype=float),
+                                                    self.dofs.shape).copy()
+
+
+    def apply(self, *tensors):
+        """Applies the condition to matrices, by replacing the constrained
+        rows with rows of the identity, and to vectors, by setting the
+        constrained entries to the values.
+        """
+        for tensor in tensors:
+            if hasattr(tensor, "ident_local"):
+                tensor.ident_local(self.dofs)
+            else:
+                tensor[self.dofs] = self.values
+
+
+def marker_names(names):
+    """Returns the list of marker names in a comma separated string, as
+    boundary markers are given in the parameters.
+    """
+    return [name.strip() for name in names.split(",") if name.strip()]
+
 
 class Problem(object):
 
     def __init__(self, geometry, time, parameters, **kwargs):
         self.geometry = geometry
         self.time = time
-        self.parameters = parameters
\ No newline at end of file
+        self.parameters = parameters
+
+
+    def update_parameters(self, parameters=None):
+        """Updates the constants of the problem after its parameters have
+        changed. Returns True if cached operators have to be reassembled.
+        """
+        if parameters is not None:
+            self.parameters = parameters
+        return False
+
+
+    def _get_state_fields(self):
+        """Returns a dict of all functions that make up the state of the
+        problem and that have to be stored to restart a simulation.
+        """
+        return {}
@@ -1,11 +1,13 @@
 from functools import partial
 
-from dolfin import Constant, DirichletBC
+from dolfin import (Constant, DirichletBC, TestFunction, TrialFunction,
+                    assemble, inner, split)
 
 import pulse
 from pulse.utils import get_lv_marker
 
 from m3h3.pde import Problem
+from m3h3.pde.problem import PrecomputedDirichletBC
 
 
 def dirichlet_fix_base(W, ffun, marker):
@@ -34,14 +36,16 @@ def boundary_conditions(geometry, **bcs_parameters):
         raise KeyError(msg)
     # Neumann BCs
     lv_pressure = pulse.NeumannBC(
-                        traction=Constant(0.0, name="lv_pressure"),
+                        traction=Constant(bcs_parameters['lv_pressure'],
+                                                        name="lv_pressure"),
                         marker=geometry.get_lv_marker(), name="lv"
                     )
     neumann_bc = [lv_pressure]
 
     if geometry.has_rv():
         rv_pressure = pulse.NeumannBC(
-                            traction=Constant(0.0, name="rv_pressure"),
+                            traction=Constant(bcs_parameters['rv_pressure'],
+                                                        name="rv_pressure"),
                             marker=geometry.get_rv_marker(), name="rv"
                         )
         neumann_bc += [rv_pressure]
@@ -50,13 +54,14 @@ def boundary_conditions(geometry, **bcs_parameters):
     robin_bc = []
     if pericardium_spring > 0.0:
         robin_bc += [pulse.RobinBC(
-                        value=Constant(pericardium_spring),
+                        value=Constant(pericardium_spring,
+                                                name="pericardium_spring"),
                         marker=geometry.get_epi_marker()
                     )]
 
     if base_spring > 0.0:
         robin_bc += [pulse.RobinBC(
-                        value=Constant(base_spring),
+                        value=Constant(base_spring, name="base_spring"),
                         marker=geometry.get_base_marker()
                     )]
 
@@ -80,10 +85,92 @@ def boundary_conditions(geometry, **bcs_parameters):
 
 
 class SolidProblem(pulse.MechanicsProblem):
+    """The balance of momentum of the heart wall.
+
+    Boundary data is prepared once: the dofs of the Dirichlet conditions are
+    found when the problem is set up (:py:attr:`dirichlet_bcs`), and the
+    Robin springs are linear in the displacement, so they are not part of
+    the virtual work form but are added from preassembled matrices of unit
+    springs by the solver (:py:meth:`robin_matrices`). The cavity pressures
+    are Constants that can be changed in place, e.g. by a circulation model,
+    through :py:attr:`lv_pressure` and :py:attr:`rv_pressure`.
+    """
 
     def __init__(self, geometry, time, parameters, **kwargs):
         bcs_parameters = parameters["BoundaryConditions"]
         bcs = boundary_conditions(geometry, **bcs_parameters)
+        self.robin_bcs = list(bcs.robin)
+        bcs = pulse.BoundaryConditions(dirichlet=bcs.dirichlet,
+                                        neumann=bcs.neumann)
         super().__init__(geometry, kwargs['material'], bcs=bcs)
+        self.time = time
+        self.solid_parameters = parameters
         self._form = self._virtual_work
-        self._jacobian = 0
\ No newline at end of file
+
+        dirichlet_bc = self._dirichlet_bc
+        if not isinstance(dirichlet_bc, (list, tuple)):
+            dirichlet_bc = [dirichlet_bc]
+        self.dirichlet_bcs = [PrecomputedDirichletBC(bc, self.state_space)
+                                                    for bc in dirichlet_bc]
+        pressures = {bc.name: bc.traction for bc in self.bcs.neumann}
+        self.lv_pressure = pressures["lv"]
+        self.rv_pressure = pressures.get("rv")
+        self._applied = {c.name(): float(c) for c in self._constants()}
+
+
+    def robin_matrices(self):
+        """Returns a list of the spring constants of the Robin boundary
+        conditions and the matrices of their terms with unit springs. The
+        Robin terms of the residual and the Jacobian are the sums of the
+        spring constants times the matrices times the state and times the
+        matrices, respectively.
+        """
+        W = self.state_space
+        du, v = TrialFunction(W), TestFunction(W)
+        if W.sub(0).num_sub_spaces() > 0:
+            du, v = split(du)[0], split(v)[0]
+        matrices = []
+        for bc in self.robin_bcs:
+            form = inner(du, v)*self.geometry.ds(bc.marker)
+            matrices.append((bc.value, assemble(form)))
+        return matrices
+
+
+    def update_parameters(self, parameters=None):
+        """Updates the pressures and spring constants of the boundary
+        conditions from the parameters in place. Only constants whose
+        parameters have changed since they were last applied are set, so
+        pressures that are set in place, e.g. by a circulation model, are
+        kept otherwise. Springs that were zero when the problem was set up
+        are not part of the form and stay zero.
+
+        Returns
+        -------
+        bool
+            True if a constant has changed, i.e. a reused Jacobian is
+            outdated.
+        """
+        if parameters is not None:
+            self.solid_parameters = parameters
+        bcs_parameters = self.solid_parameters["BoundaryConditions"]
+        changed = False
+        for constant in self._constants():
+            name = constant.name()
+            value = float(bcs_parameters[name])
+            if value != self._applied[name]:
+                changed = changed or value != float(constant)
+                constant.assign(value)
+                self._applied[name] = value
+        return changed
+
+
+    def _constants(self):
+        return [bc.traction for bc in self.bcs.neumann]\
+                                    + [bc.value for bc in self.robin_bcs]
+
+
+    def _get_state_fields(self):
+        """Returns a dict of all functions that make up the state of the
+        problem and that have to be stored to restart a simulation.
+        """
+        return {"state": self.state}
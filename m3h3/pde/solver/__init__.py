@@ -1,8 +1,25 @@
+import importlib
+
 from m3h3.pde.solver.solver import Solver
 from m3h3.pde.solver.electro_solver import BasicBidomainSolver
-from m3h3.pde.solver.solid_solver import SolidSolver
-from m3h3.pde.solver.fluid_solver import FluidSolver
-from m3h3.pde.solver.porous_solver import PorousSolver
+
+# Solvers of the other physics are only imported on first use, see
+# m3h3.pde
+_lazy = {'SolidSolver': 'm3h3.pde.solver.solid_solver',
+         'FluidSolver': 'm3h3.pde.solver.fluid_solver',
+         'PorousSolver': 'm3h3.pde.solver.porous_solver',
+         'EikonalSolver': 'm3h3.pde.solver.eikonal_solver'}
 
 __all__ = ['BasicBidomainSolver', 'SolidSolver', 'FluidSolver',
-            'PorousSolver']
\ No newline at end of file
+            'PorousSolver', 'EikonalSolver']
+
+
+def __getattr__(name):
+    if name in _lazy:
+        return getattr(importlib.import_module(_lazy[name]), name)
+    msg = "module {!r} has no attribute {!r}".format(__name__, name)
+    raise AttributeError(msg)
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_lazy.keys()))
@@ -0,0 +1,296 @@
+import numpy as np
+
+import dolfin as df
+from dolfin import Function, LagrangeInterpolator
+
+from m3h3.pde.eikonal_problem import tension_profile
+from m3h3.profiling import count, timer
+
+
+def fast_iterative_method(points, triangles, metrics, sources, source_times,
+                            tolerance=1e-6, max_sweeps=None, tetrahedra=None,
+                            tetrahedron_metrics=None):
+    """Solves the anisotropic eikonal equation for the arrival times at the
+    vertices of a mesh with the fast iterative method.
+
+    Every sweep updates the times of all vertices of the triangles whose
+    other vertices have changed in the previous sweep, by the minimum
+    arrival time of a front that travels through the triangle. If
+    tetrahedra are given, their vertices are also updated from fronts
+    through the interior of the opposite face, which the triangle updates
+    of the faces that contain the vertex miss. The sweeps are vectorized
+    over the triangles and tetrahedra and end when no time decreases by
+    more than tolerance.
+
+    Parameters
+    ----------
+    points : array
+        Coordinates of the vertices.
+    triangles : array
+        Vertex indices of the triangles, e.g. the faces of tetrahedra.
+    metrics : array
+        Inverse velocity tensors of the triangles, whose norms of a distance
+        vector are the travel times along it.
+    sources : array
+        Indices of the vertices with given times.
+    source_times : array
+        Times of the sources.
+    tolerance : float
+        Change of time below which a vertex is converged.
+    max_sweeps : int, optional
+        Defaults to the number of vertices.
+    tetrahedra : array, optional
+        Vertex indices of the tetrahedra, whose faces are among the
+        triangles.
+    tetrahedron_metrics : array, optional
+        Inverse velocity tensors of the tetrahedra.
+
+    Returns
+    -------
+    array
+        The arrival times, which are infinite at vertices that the front
+        does not reach.
+    """
+    times = np.full(len(points), np.inf)
+    np.minimum.at(times, sources, source_times)
+    max_sweeps = len(points) if max_sweeps is None else max_sweeps
+
+    # Every triangle updates each of its vertices from the two others. The
+    # quadratic forms of the edge vectors are computed once.
+    target = triangles[:, [2, 0, 1]].ravel()
+    first = triangles[:, [0, 1, 2]].ravel()
+    second = triangles[:, [1, 2, 0]].ravel()
+    M = np.repeat(metrics, 3, axis=0)
+    a = points[target] - points[first]
+    b = points[second] - points[first]
+    p = np.einsum("ni,nij,nj->n", a, M, a)
+    q = np.einsum("ni,nij,nj->n", a, M, b)
+    r = np.einsum("ni,nij,nj->n", b, M, b)
+
+    # Every tetrahedron updates each of its vertices from the opposite face
+    if tetrahedra is not None:
+        tetrahedra = np.asarray(tetrahedra)
+        faces = tetrahedra[:, [[1, 2, 3], [2, 3, 0], [3, 0, 1], [0, 1, 2]]]
+        face = faces.reshape(-1, 3)
+        apex = tetrahedra.ravel()
+        M = np.repeat(tetrahedron_metrics, 4, axis=0)
+        a = points[apex] - points[face[:, 0]]
+        E = np.stack([points[face[:, 1]] - points[face[:, 0]],
+                      points[face[:, 2]] - points[face[:, 0]]], axis=2)
+        G_inv = np.linalg.inv(np.einsum("nki,nkl,nlj->nij", E, M, E))
+        g = np.einsum("nki,nkl,nl->ni", E, M, a)
+        w0 = np.einsum("nij,nj->ni", G_inv, g)
+        # Squared distance of the apex from the plane of the face
+        s = np.maximum(np.einsum("ni,nij,nj->n", a, M, a)
+                                    - np.einsum("ni,ni->n", g, w0), 0.0)
+
+    changed = np.zeros(len(points), dtype=bool)
+    changed[sources] = True
+    for _ in range(max_sweeps):
+        active = np.flatnonzero(changed[first] | changed[second])
+        if tetrahedra is not None:
+            active_faces = np.flatnonzero(changed[face].any(axis=1))
+        else:
+            active_faces = ()
+        if len(active) == 0 and len(active_faces) == 0:
+            break
+        count("eikonal_updates", len(active) + len(active_faces))
+        candidates = _local_update(times[first[active]],
+                        times[second[active]], p[active], q[active], r[active])
+        updated = times.copy()
+        np.minimum.at(updated, target[active], candidates)
+        if len(active_faces) > 0:
+            i = active_faces
+            candidates = _face_update(times[face[i]], G_inv[i], w0[i], s[i])
+            np.minimum.at(updated, apex[i], candidates)
+        with np.errstate(invalid="ignore"):
+            changed = times - updated > tolerance
+        times = updated
+    return times
+
+
+def _local_update(t1, t2, p, q, r):
+    # Arrival time at x3 from the segment between x1 and x2 with times t1
+    # and t2, minimizing t1 + w (t2 - t1) + |x3 - x1 - w (x2 - x1)|_M over
+    # w in [0, 1], with p = a.Ma, q = a.Mb, r = b.Mb for a = x3 - x1 and
+    # b = x2 - x1
+    with np.errstate(invalid="ignore", divide="ignore"):
+        best = np.minimum(t1 + np.sqrt(p), t2 + np.sqrt(p - 2*q + r))
+        delta = t2 - t1
+        valid = np.isfinite(delta) & (delta**2 < r)
+        w = (q - delta*np.sqrt(np.maximum(r*p - q**2, 0.0)/(r - delta**2)))/r
+        valid &= (w > 0) & (w < 1)
+        face = t1 + w*delta + np.sqrt(np.maximum(p - 2*w*q + w**2*r, 0.0))
+    return np.where(valid, np.minimum(best, face), best)
+
+
+def _face_update(t, G_inv, w0, s):
+    # Arrival time at x4 through the interior of the triangle x1 x2 x3 with
+    # times t, minimizing t1 + w.delta + |a - E w|_M over the barycentric
+    # coordinates w, with a = x4 - x1, E = [x2 - x1, x3 - x1] and
+    # delta = (t2 - t1, t3 - t1). The minimizer satisfies
+    # G w = g - d delta for G = E^T M E, g = E^T M a and the distance d, so
+    # w = w0 - d h with w0 = G^-1 g, h = G^-1 delta and
+    # d^2 = s/(1 - delta.h), where s is the squared distance of x4 from the
+    # plane of the triangle. Minimizers on the boundary are found by the
+    # triangle updates.
+    with np.errstate(invalid="ignore", divide="ignore"):
+        delta = t[:, 1:] - t[:, :1]
+        h = np.einsum("nij,nj->ni", G_inv, delta)
+        dh = np.einsum("ni,ni->n", delta, h)
+        d = np.sqrt(s/(1 - dh))
+        w = w0 - d[:, None]*h
+        valid = np.isfinite(d) & (dh < 1) & (w > 0).all(axis=1)\
+                                                    & (w.sum(axis=1) < 1)
+        time = t[:, 0] + np.einsum("ni,ni->n", delta, w) + d
+    return np.where(valid, time, np.inf)
+
+
+class EikonalSolver(object):
+    """Computes the activation times of an
+    :py:class:`m3h3.pde.EikonalProblem` with the
+    :py:func:`fast_iterative_method`, and the active tension from them in
+    every step.
+
+    The activation times are computed on the first step, and again after
+    their parameters have changed, see :py:meth:`invalidate`. The eikonal
+    equation is solved on the whole mesh on every process, which takes
+    seconds even for large meshes and avoids communication between the
+    sweeps.
+    """
+
+    def __init__(self, time, problem, parameters, **kwargs):
+        self._time = time
+        self.problem = problem
+        self.parameters = parameters
+        self._observers = []
+        self._activation_times = None
+
+
+    @property
+    def time(self):
+        "The internal time of the solver."
+        return self._time
+
+
+    def invalidate(self):
+        """Marks the activation times as outdated, e.g. after the velocities
+        or the stimulus have changed. They are recomputed in the next step.
+        """
+        self._activation_times = None
+
+
+    def register_observer(self, observer):
+        """Registers a callable that is called as ``observer(time,
+        active_tension)`` after every step.
+        """
+        self._observers.append(observer)
+
+
+    def step(self, solution_fields, time=None):
+        """Sets the active tension at the given time.
+
+        Parameters
+        ----------
+        solution_fields : :py:class:`dolfin.Function`
+            The active tension of the problem.
+        time : float, optional
+            Defaults to the internal time of the solver.
+        """
+        time = float(self._time) if time is None else time
+        with timer("active_tension"):
+            solution_fields.vector().set_local(self.tension(time))
+            solution_fields.vector().apply("insert")
+        if self._observers:
+            with timer("observers"):
+                for observer in self._observers:
+                    observer(time, solution_fields)
+
+
+    def tension(self, time):
+        """Returns the active tension at the owned dofs at the given time.
+        """
+        if self._activation_times is None:
+            self._solve_activation_times()
+        elapsed = time - self._activation_times
+        period = self.problem.parameters["I_s"]["period"]
+        if period > 0:
+            with np.errstate(invalid="ignore"):
+                elapsed = np.where(elapsed >= 0, elapsed % period, elapsed)
+        parameters = self.problem.parameters["Eikonal"]
+        return tension_profile(elapsed, parameters["peak_tension"],
+                            parameters["rise_time"], parameters["decay_time"],
+                            parameters["duration"])
+
+
+    def drive(self, activation, time):
+        """Sets the activation of a material to the active tension at the
+        given time. A function is interpolated from the active tension, and
+        a constant or a function in a real space is set to its mean.
+        """
+        tension = self.tension(time)
+        if isinstance(activation, Function)\
+                and activation.ufl_element().family() != "Real":
+            self.problem.active_tension.vector().set_local(tension)
+            self.problem.active_tension.vector().apply("insert")
+            LagrangeInterpolator.interpolate(activation,
+                                                self.problem.active_tension)
+        else:
+            comm = self.problem.geometry.mesh.mpi_comm()
+            mean = df.MPI.sum(comm, float(tension.sum()))\
+                                        /df.MPI.sum(comm, float(len(tension)))
+            activation.assign(df.Constant(mean))
+
+
+    def _solve_activation_times(self):
+        problem = self.problem
+        mesh = problem.geometry.mesh
+        comm = mesh.mpi_comm()
+        num_cells = mesh.topology().ghost_offset(mesh.topology().dim())
+        global_vertices = np.asarray(mesh.topology().global_indices(0))
+        sources, source_times = problem.sources()
+
+        with timer("eikonal"):
+            # The mesh is gathered on every process
+            points = np.zeros((mesh.num_entities_global(0),
+                                                    mesh.geometry().dim()))
+            for indices, coordinates in comm.allgather((global_vertices,
+                                                    mesh.coordinates())):
+                points[indices] = coordinates
+            cells = np.concatenate(comm.allgather(
+                                    global_vertices[mesh.cells()[:num_cells]]))
+            metrics = np.concatenate(comm.allgather(problem.metrics()))
+            sources = np.concatenate(comm.allgather(
+                                                    global_vertices[sources]))
+            source_times = np.concatenate(comm.allgather(source_times))
+            if len(sources) == 0:
+                msg = "The eikonal problem has no stimulus sites."
+                raise ValueError(msg)
+
+            tetrahedra = cells if cells.shape[1] == 4 else None
+            tetrahedron_metrics = metrics
+            triangles, metrics = _triangles(cells, metrics)
+            times = fast_iterative_method(points, triangles, metrics,
+                        sources, source_times,
+                        tolerance=problem.parameters["Eikonal"]["tolerance"],
+                        tetrahedra=tetrahedra,
+                        tetrahedron_metrics=tetrahedron_metrics)
+
+        vector = problem.activation_time.vector()
+        vertices = df.dof_to_vertex_map(problem.function_space)
+        self._activation_times = times[global_vertices[
+                                    vertices[:vector.local_size()]]]
+        vector.set_local(self._activation_times)
+        vector.apply("insert")
+
+
+def _triangles(cells, metrics):
+    # Triangles of the cells and their metrics. Intervals are degenerate
+    # triangles, which only have edge updates.
+    num_vertices = cells.shape[1]
+    if num_vertices == 2:
+        return cells[:, [0, 1, 1]], metrics
+    if num_vertices == 3:
+        return cells, metrics
+    faces = cells[:, [[0, 1, 2], [0, 1, 3], [0, 2, 3], [1, 2, 3]]]
+    return faces.reshape(-1, 3), np.repeat(metrics, 4, axis=0)
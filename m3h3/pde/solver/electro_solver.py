@@ -1,6 +1,8 @@
-from dolfin import (system, LinearVariationalProblem, LinearVariationalSolver)
+from dolfin import (assemble, lhs, rhs, FunctionAssigner, LUSolver,
+                    PETScKrylovSolver, has_lu_solver_method)
 
 from m3h3 import Physics
+from m3h3.profiling import count, timer
 
 
 __all__ = ['BasicBidomainSolver',
@@ -37,8 +39,34 @@ class BasicBidomainSolver(object):
         self._time = time
         self._form = form
         self._prev_current, self._solution = solution_fields
+        self._merger = FunctionAssigner(self._prev_current.function_space(),
+                                        self._solution.function_space().sub(0))
 
         self.parameters = parameters
+        self._observers = []
+
+        # The system matrix only depends on constants, so it is assembled
+        # once and reassembled only when these change
+        self._a = lhs(self._form)
+        self._L = rhs(self._form)
+        self._A = None
+        self._b = None
+        self._linear_solver = None
+
+
+    def invalidate(self):
+        """Marks the system matrix as outdated, e.g. after the time step or
+        the conductivities have changed. It is reassembled in the next step.
+        """
+        self._A = None
+
+
+    def register_observer(self, observer):
+        """Registers a callable that is called as ``observer(time,
+        prev_current)`` after every step, e.g. an
+        :py:class:`m3h3.activation.ActivationRecorder`.
+        """
+        self._observers.append(observer)
 
 
     @property
@@ -118,24 +146,59 @@ class BasicBidomainSolver(object):
             t1 = t0 + dt
 
 
-    def step(self, solution_fields):
+    def step(self, solution_fields, time=None):
         """
         Solve on the given time interval (t0, t1).
 
         *Arguments*
           interval (:py:class:`tuple`)
             The time interval (t0, t1) for the step
+          time (float, optional)
+            The time at the end of the step that is passed to observers.
+            Defaults to the internal time of the solver.
 
         *Invariants*
           Assuming that v\_ is in the correct state for t0, gives
           self.vur in correct state at t1.
         """
 
-        # Define variational problem
-        a, L = system(self._form)
-        problem = LinearVariationalProblem(a, L, solution_fields)
-
-        # Set-up solver
-        solver = LinearVariationalSolver(problem)
-        solver.parameters.update(self.parameters)
-        solver.solve()
\ No newline at end of file
+        if self._A is None:
+            with timer("assemble_lhs"):
+                self._A = assemble(self._a)
+                self._init_linear_solver()
+
+        # The stimulus is evaluated during assembly of the right hand side
+        with timer("assemble_rhs"):
+            self._b = assemble(self._L, tensor=self._b)
+
+        with timer("solve"):
+            iterations = self._linear_solver.solve(solution_fields.vector(),
+                                                                    self._b)
+            if isinstance(self._linear_solver, PETScKrylovSolver):
+                count("krylov_iterations", iterations)
+
+        # Update previous transmembrane potential for the next step
+        self._merger.assign(self._prev_current, solution_fields.sub(0))
+
+        if self._observers:
+            time = float(self._time) if time is None else time
+            with timer("observers"):
+                for observer in self._observers:
+                    observer(time, self._prev_current)
+
+
+    def _init_linear_solver(self):
+        # Same choice of solver as dolfin's LinearVariationalSolver, but the
+        # solver and its factorization or preconditioner are kept
+        method = self.parameters["linear_solver"]
+        if method in ("default", "direct", "lu") or has_lu_solver_method(method):
+            method = "default" if method in ("direct", "lu") else method
+            self._linear_solver = LUSolver(self._A, method)
+            self._linear_solver.parameters.update(
+                                                self.parameters["lu_solver"])
+        else:
+            self._linear_solver = PETScKrylovSolver(method,
+                                            self.parameters["preconditioner"])
+            self._linear_solver.parameters.update(
+                                            self.parameters["krylov_solver"])
+            self._linear_solver.set_operator(self._A)
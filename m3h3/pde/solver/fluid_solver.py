@@ -1,10 +1,186 @@
-from dolfin import (Constant)
+from dolfin import (as_backend_type, assemble, Function, PETScKrylovSolver,
+                    VectorSpaceBasis)
 
 from m3h3 import Physics
 from m3h3.pde.solver import Solver
+from m3h3.profiling import count, timer
 
 
 class FluidSolver(Solver):
+    """Incremental pressure correction scheme (IPCS) for the Navier-Stokes
+    equations of a :py:class:`m3h3.pde.FluidProblem`.
 
-    def __init__(self, form, time, interval, dt, parameters, **kwargs):
+    Every step consists of three linear solves: a tentative velocity with
+    Crank-Nicolson viscous stress and the previous pressure, a pressure
+    Poisson equation for the pressure update, and a velocity correction.
+    The mass, viscous, pressure Poisson, divergence and gradient matrices
+    are assembled once, and the right hand sides are matrix-vector products
+    with them. Only the convection term is assembled in every step, either
+    as a vector (``"explicit"``) or as a matrix that is added to the
+    tentative velocity operator (``"semi_implicit"``), depending on the
+    ``convection`` parameter of the ``Solver`` set. The matrices are
+    reassembled after the time step or the material constants change, see
+    :py:meth:`invalidate`.
+
+    The Krylov methods and preconditioners of the three solves are the
+    ``velocity_solver``, ``pressure_solver`` and ``correction_solver``
+    parameters and their ``_preconditioner`` counterparts of the ``Solver``
+    set. Tolerances are taken from the ``krylov_solver`` set. The boundary
+    conditions replace rows of the operators, which makes them
+    non-symmetric, so the default methods are GMRES and BiCGStab.
+    """
+
+    def __init__(self, form, time, interval, dt, parameters, problem=None,
+                                                                    **kwargs):
+        if problem is None:
+            msg = "The fluid solver requires the FluidProblem."
+            raise ValueError(msg)
+        self.problem = problem
         super().__init__(form, time, interval, dt, parameters, **kwargs)
+
+
+    def _init_solver(self):
+        V = self.problem.velocity_space
+        Q = self.problem.pressure_space
+        self._b1 = Function(V).vector()
+        self._b2 = Function(Q).vector()
+        self._b3 = Function(V).vector()
+        self._work_V = Function(V).vector()
+        self._work_Q = Function(Q).vector()
+        self._pressure_increment = Function(Q).vector()
+        self._convection = None
+        self._matrices = None
+
+
+    def invalidate(self):
+        """Marks the matrices as outdated, e.g. after the time step or the
+        viscosity have changed. They are reassembled in the next step.
+        """
+        self._matrices = None
+
+
+    def step(self):
+        """Advances velocity and pressure by one time step.
+        """
+        if self._matrices is None:
+            self._assemble_matrices()
+        problem = self.problem
+        m = self._matrices
+        rho, k = float(problem.density), float(problem.dt)
+        u, p = problem.velocity.vector(), problem.pressure.vector()
+        u_star = problem.tentative_velocity.vector()
+        semi_implicit = self.parameters["Solver"]["convection"]\
+                                                            == "semi_implicit"
+
+        # Tentative velocity
+        with timer("assemble_convection"):
+            if semi_implicit:
+                assemble(problem.forms["convection_matrix"],
+                                                    tensor=self._convection)
+                self._A1.zero()
+                self._A1.axpy(1.0, m["tentative"], True)
+                self._A1.axpy(0.5, self._convection, True)
+                for bc in problem.velocity_bcs:
+                    bc.apply(self._A1)
+                self._solvers[0].set_operator(self._A1)
+            else:
+                self._convection = assemble(problem.forms["convection"],
+                                                    tensor=self._convection)
+        m["explicit"].mult(u, self._b1)
+        if semi_implicit:
+            self._convection.mult(u, self._work_V)
+            self._b1.axpy(-0.5, self._work_V)
+        else:
+            self._b1.axpy(-1.0, self._convection)
+        m["pressure_stress"].mult(p, self._work_V)
+        self._b1.axpy(-1.0, self._work_V)
+        for bc in problem.velocity_bcs:
+            bc.apply(self._b1, u_star)
+        self._solve(0, u_star, self._b1)
+
+        # Pressure update
+        m["laplacian"].mult(p, self._b2)
+        m["divergence"].mult(u_star, self._work_Q)
+        self._b2.axpy(-rho/k, self._work_Q)
+        for bc, pressure in problem.pressure_bcs:
+            bc.assign(float(pressure))
+            bc.apply(self._b2)
+        if self._nullspace is not None:
+            self._nullspace.orthogonalize(self._b2)
+        self._pressure_increment.zero()
+        self._pressure_increment.axpy(-1.0, p)
+        self._solve(1, p, self._b2)
+        self._pressure_increment.axpy(1.0, p)
+
+        # Velocity correction
+        m["mass"].mult(u_star, self._b3)
+        m["gradient"].mult(self._pressure_increment, self._work_V)
+        self._b3.axpy(-k/rho, self._work_V)
+        # The initial guess satisfies the conditions, so that the Krylov
+        # iterates keep them exactly
+        for bc in problem.velocity_bcs:
+            bc.apply(self._b3, u)
+        self._solve(2, u, self._b3)
+
+
+    def _solve(self, index, x, b):
+        with timer("solve"):
+            iterations = self._solvers[index].solve(x, b)
+            count("krylov_iterations", iterations)
+
+
+    def _assemble_matrices(self):
+        problem = self.problem
+        forms = problem.forms
+        rho, k = float(problem.density), float(problem.dt)
+        with timer("assemble_matrices"):
+            m = {name: assemble(forms[name]) for name in ("mass", "viscous",
+                            "pressure_stress", "laplacian", "divergence",
+                            "gradient")}
+        # Constant parts of the tentative velocity operator and of its
+        # right hand side
+        m["tentative"] = m["mass"].copy()
+        m["tentative"] *= rho/k
+        m["tentative"].axpy(0.5, m["viscous"], False)
+        m["explicit"] = m["mass"].copy()
+        m["explicit"] *= rho/k
+        m["explicit"].axpy(-0.5, m["viscous"], False)
+        self._matrices = m
+
+        self._A1 = m["tentative"].copy()
+        if self.parameters["Solver"]["convection"] == "semi_implicit":
+            # Assembled into the pattern of the tentative operator, so that
+            # it can be added in every step
+            self._convection = m["tentative"].copy()
+            self._convection.zero()
+        else:
+            self._convection = None
+        for bc in problem.velocity_bcs:
+            bc.apply(self._A1)
+        A2 = m["laplacian"].copy()
+        for bc, _ in problem.pressure_bcs:
+            bc.apply(A2)
+        A3 = m["mass"].copy()
+        for bc in problem.velocity_bcs:
+            bc.apply(A3)
+
+        # Without pressure boundary conditions, the pressure is determined up
+        # to a constant
+        self._nullspace = None
+        if len(problem.pressure_bcs) == 0:
+            constant = Function(problem.pressure_space).vector()
+            constant[:] = 1.0
+            constant *= 1.0/constant.norm("l2")
+            self._nullspace = VectorSpaceBasis([constant])
+            as_backend_type(A2).set_nullspace(self._nullspace)
+
+        parameters = self.parameters["Solver"]
+        self._solvers = []
+        for name, A in (("velocity", self._A1), ("pressure", A2),
+                        ("correction", A3)):
+            solver = PETScKrylovSolver(parameters[name + "_solver"],
+                                    parameters[name + "_preconditioner"])
+            solver.parameters.update(self.parameters["krylov_solver"])
+            solver.parameters["nonzero_initial_guess"] = True
+            solver.set_operator(A)
+            self._solvers.append(solver)
@@ -1,10 +1,126 @@
-from dolfin import (Constant)
+from dolfin import assemble, Function, LUSolver, PETScKrylovSolver
 
 from m3h3 import Physics
 from m3h3.pde.solver import Solver
+from m3h3.profiling import count, timer
 
 
 class PorousSolver(Solver):
+    """Implicit Euler solver of the multi-compartment perfusion model of a
+    :py:class:`m3h3.pde.PorousProblem`.
 
-    def __init__(self, form, time, interval, dt, parameters, **kwargs):
+    The operator, the storage matrix and the boundary vectors do not depend
+    on the solution, so they are assembled once, and a step consists of a
+    matrix-vector product and two vector updates for the right hand side,
+    and one linear solve. They are reassembled after the time step or a
+    coefficient has changed, see :py:meth:`invalidate`.
+
+    With the ``linear_solver`` parameter of the ``Solver`` set
+    ``"iterative"``, the block system is solved with the Krylov method
+    ``krylov_method``, preconditioned by an additive field split with one
+    AMG V-cycle (``amg``) per compartment, i.e. a block diagonal
+    preconditioner whose cost grows linearly with the number of unknowns.
+    ``"direct"`` uses an LU solver, for small problems. Tolerances are
+    taken from the ``krylov_solver`` set.
+    """
+
+    def __init__(self, form, time, interval, dt, parameters, problem=None,
+                                                                    **kwargs):
+        if problem is None:
+            msg = "The porous solver requires the PorousProblem."
+            raise ValueError(msg)
+        self.problem = problem
         super().__init__(form, time, interval, dt, parameters, **kwargs)
+
+
+    def _init_solver(self):
+        self._b = Function(self.problem.state_space).vector()
+        self._A = None
+        self._linear_solver = None
+
+
+    def invalidate(self):
+        """Marks the matrices as outdated, e.g. after the time step or a
+        coefficient has changed. They are reassembled in the next step.
+        """
+        self._A = None
+
+
+    def step(self):
+        """Advances the compartment pressures by one time step.
+        """
+        if self._A is None:
+            self._assemble_matrices()
+        problem = self.problem
+        p, p_n = problem.pressure.vector(), problem.previous_pressure.vector()
+        p_n.zero()
+        p_n.axpy(1.0, p)
+
+        self._storage.mult(p_n, self._b)
+        self._b.axpy(float(problem.inflow_flux), self._inflow)
+        self._b.axpy(float(problem.venous_pressure), self._drainage)
+        with timer("solve"):
+            iterations = self._linear_solver.solve(p, self._b)
+        if isinstance(self._linear_solver, PETScKrylovSolver):
+            count("krylov_iterations", iterations)
+
+
+    def _assemble_matrices(self):
+        forms = self.problem.forms
+        with timer("assemble_matrices"):
+            self._A = assemble(forms["operator"])
+            self._storage = assemble(forms["storage"])
+            self._inflow = assemble(forms["inflow"])
+            self._drainage = assemble(forms["drainage"])
+        self._init_linear_solver()
+
+
+    def _init_linear_solver(self):
+        if self.parameters["Solver"]["linear_solver"] == "iterative":
+            self._init_iterative_solver()
+        else:
+            self._linear_solver = LUSolver(self._A, "default")
+            self._linear_solver.parameters.update(
+                                                self.parameters["lu_solver"])
+
+
+    def _init_iterative_solver(self):
+        from petsc4py import PETSc
+
+        parameters = self.parameters["Solver"]
+        krylov = self.parameters["krylov_solver"]
+        W = self.problem.state_space
+        comm = W.mesh().mpi_comm()
+
+        self._linear_solver = PETScKrylovSolver()
+        ksp = self._linear_solver.ksp()
+        prefix = "m3h3_porous_{}_".format(id(self))
+        ksp.setOptionsPrefix(prefix)
+        ksp.setType(parameters["krylov_method"])
+        ksp.setTolerances(rtol=krylov["relative_tolerance"],
+                          atol=krylov["absolute_tolerance"],
+                          max_it=krylov["maximum_iterations"])
+        # The previous pressure is a good initial guess
+        ksp.setInitialGuessNonzero(True)
+
+        options = PETSc.Options(prefix)
+        pc = ksp.getPC()
+        if W.num_sub_spaces() == 0:
+            pc.setType(parameters["amg"])
+        else:
+            # One AMG per compartment on the diagonal blocks, which contain
+            # the transfer terms of the compartment
+            splits = []
+            for i in range(W.num_sub_spaces()):
+                name = "c{}".format(i)
+                dofs = W.sub(i).dofmap().dofs()
+                splits.append((name, PETSc.IS().createGeneral(dofs,
+                                                                comm=comm)))
+                options["fieldsplit_{}_ksp_type".format(name)] = "preonly"
+                options["fieldsplit_{}_pc_type".format(name)] = \
+                                                            parameters["amg"]
+            pc.setType("fieldsplit")
+            pc.setFieldSplitIS(*splits)
+            pc.setFieldSplitType(PETSc.PC.CompositeType.ADDITIVE)
+        ksp.setFromOptions()
+        self._linear_solver.set_operator(self._A)
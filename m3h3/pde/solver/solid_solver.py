@@ -1,12 +1,412 @@
-from dolfin import (Constant)
+import copy
 
-import pulse
+import numpy as np
+
+from dolfin import (as_backend_type, assemble, Function,
+                    LogLevel, LUSolver, PETScKrylovSolver, VectorSpaceBasis,
+                    has_lu_solver_method)
 
 from m3h3 import Physics
 from m3h3.pde.solver import Solver
+from m3h3.profiling import count, timer
+from m3h3.utils import log
+
+
+def rigid_body_modes(W):
+    """Returns the rigid body modes of the displacement of W as an
+    orthonormal :py:class:`dolfin.VectorSpaceBasis`. W is either a vector
+    function space or a mixed space whose first subspace is the
+    displacement, in which case the modes vanish on all other subspaces.
+    """
+    V = W if W.sub(0).num_sub_spaces() == 0 else W.sub(0)
+    dim = V.num_sub_spaces()
+    x = Function(W).vector()
+    # Translations, then rotations in the (i, j) planes
+    rotations = [(0, 1)] if dim == 2 else [(0, 1), (1, 2), (2, 0)]
+    modes = [x.copy() for _ in range(dim + len(rotations))]
+    for i in range(dim):
+        modes[i].zero()
+        V.sub(i).dofmap().set(modes[i], 1.0)
+    for mode, (i, j) in zip(modes[dim:], rotations):
+        mode.zero()
+        V.sub(i).set_x(mode, -1.0, j)
+        V.sub(j).set_x(mode, 1.0, i)
+    for mode in modes:
+        mode.apply("insert")
+    basis = VectorSpaceBasis(modes)
+    basis.orthonormalize()
+    return basis
 
 
 class SolidSolver(Solver):
+    """Newton solver for the quasi-static balance of momentum of a
+    :py:class:`m3h3.pde.SolidProblem`.
+
+    Assembling and factorizing the Jacobian dominates the cost of the solid
+    mechanics, so the solver can reuse the Jacobian, and with it the
+    factorization or preconditioner of the linear solver, across Newton
+    iterations and time steps (modified Newton). It is only rebuilt when the
+    residual norm decreases by less than a given ratio in one iteration.
+
+    The solver is configured by the ``nonlinear_variational_solver`` set of
+    the solid parameters. Of its ``newton_solver`` set, the tolerances,
+    ``maximum_iterations``, ``relaxation_parameter``,
+    ``error_on_nonconvergence``, ``report``, ``linear_solver``,
+    ``preconditioner``, ``lu_solver`` and ``krylov_solver`` are used, as
+    well as
+
+    - ``jacobian_update``: ``"newton"`` to rebuild the Jacobian in every
+      iteration or ``"modified"`` to reuse it,
+    - ``jacobian_rebuild_ratio``: the Jacobian is rebuilt in the next
+      iteration when the ratio of two consecutive residual norms exceeds
+      this value.
+
+    The linear solver of every Newton iteration is selected by the
+    ``linear_solver`` parameter of the ``Solver`` set of the solid
+    parameters. ``"direct"`` uses the linear solver of the
+    ``newton_solver`` set, which defaults to LU. ``"iterative"`` uses a
+    Krylov method (``krylov_method``) that scales to large 3D meshes. For a
+    displacement-only formulation, it is preconditioned by smoothed
+    aggregation AMG (``amg``) with the rigid body modes as near-nullspace.
+    For a displacement-pressure formulation of incompressible materials, it
+    is preconditioned by a Schur complement field split, with AMG on the
+    displacement block and the ``schur_preconditioner`` on the approximate
+    Schur complement of the pressure block.
 
-    def __init__(self, form, time, interval, dt, parameters, **kwargs):
+    Activation and cavity pressures change smoothly in time, so every step
+    starts from a secant extrapolation of the last two converged states if
+    the ``predictor`` parameter of the ``Solver`` set is ``"secant"``. If
+    the Newton iteration fails, the step is cut back: the state is reset to
+    the last converged one and the change of pressures and activation is
+    applied in substeps, which are halved on every failure up to
+    ``maximum_step_cuts`` times. If the step still fails, the state and
+    loads of the last converged substep are kept, and the failure is
+    raised or logged depending on ``error_on_nonconvergence``.
+    """
+
+    def __init__(self, form, time, interval, dt, parameters, problem=None,
+                                                                    **kwargs):
+        if problem is None:
+            msg = "The solid solver requires the SolidProblem."
+            raise ValueError(msg)
+        self.problem = problem
         super().__init__(form, time, interval, dt, parameters, **kwargs)
+
+
+    def _init_solver(self):
+        self._jacobian = self.problem._jacobian
+        self._bcs = self.problem.dirichlet_bcs
+        # Newton updates vanish on the Dirichlet boundary
+        self._bcs_homogeneous = []
+        for bc in self._bcs:
+            bc = copy.copy(bc)
+            bc.homogenize()
+            self._bcs_homogeneous.append(bc)
+        self._robin = self.problem.robin_matrices()
+        self._increment = Function(self.problem.state_space)
+        self._work = self._increment.vector().copy()
+        # Converged states and loads of the last steps, for the predictor
+        # and step cuts
+        self._history = []
+        self._loads = self._get_loads()
+        # The Jacobian is reassembled into the same matrix, which keeps its
+        # sparsity pattern and the near-nullspace of the AMG preconditioner
+        self._A = None
+        self._jacobian_outdated = True
+        self._b = None
+        self._linear_solver = None
+
+
+    def invalidate(self):
+        """Marks the Jacobian as outdated, e.g. after parameters of the
+        problem have changed. It is rebuilt in the next Newton iteration.
+        """
+        self._jacobian_outdated = True
+
+
+    def step(self, time=None):
+        """Solves for the state of the solid problem at the given time. The
+        Newton iteration starts from a prediction of the state, and if it
+        fails, the change of the loads since the last step is applied in
+        smaller substeps.
+
+        Parameters
+        ----------
+        time : float, optional
+            The time at the end of the step, which is used by the
+            predictor. Defaults to the internal time of the solver.
+
+        Returns
+        -------
+        int
+            Number of Newton iterations.
+        """
+        time = float(self.time) if time is None else time
+        parameters = self.parameters["Solver"]
+        state = self.problem.state.vector()
+        converged_state = state.copy()
+        if parameters["predictor"] == "secant":
+            self._predict(time)
+
+        target = self._get_loads()
+        iterations, converged = self._newton()
+        if not converged:
+            # Cut back and approach the new loads from the loads of the
+            # last converged step. Every failure halves the increment.
+            cuts = 1
+            count("step_cuts")
+            fraction, increment = 0.0, 0.5
+            while fraction < 1.0:
+                self._set_state(converged_state)
+                if cuts > parameters["maximum_step_cuts"]:
+                    # Keep the state and loads of the last converged
+                    # fraction, from which the next step starts
+                    self._set_loads(self._loads, target, fraction)
+                    self._loads = self._get_loads()
+                    self._fail(iterations)
+                    return iterations
+                next_fraction = min(1.0, fraction + increment)
+                self._set_loads(self._loads, target, next_fraction)
+                newton_iterations, converged = self._newton()
+                iterations += newton_iterations
+                if converged:
+                    fraction = next_fraction
+                    converged_state = state.copy()
+                else:
+                    increment /= 2
+                    cuts += 1
+                    count("step_cuts")
+            log(LogLevel.PROGRESS, "{} step at t = {} took {} step "\
+                    "cuts".format(Physics.SOLID, time, cuts))
+
+        self._accept(time, target)
+        return iterations
+
+
+    def _accept(self, time, loads):
+        # Stores the converged state and loads of a step
+        self._loads = loads
+        if self._history and self._history[-1][0] == time:
+            self._history.pop()
+        self._history.append((time, self.problem.state.vector().copy()))
+        self._history = self._history[-2:]
+
+
+    def _newton(self):
+        # Returns the number of iterations and whether the iteration has
+        # converged
+        newton = self.parameters["nonlinear_variational_solver"]\
+                                                            ["newton_solver"]
+        modified = newton["jacobian_update"] == "modified"
+        if not modified:
+            self._jacobian_outdated = True
+        state = self.problem.state
+        for bc in self._bcs:
+            bc.apply(state.vector())
+
+        residual = self._assemble_residual()
+        residual_0 = residual
+        iteration = 0
+        converged = residual < newton["absolute_tolerance"]
+        while not converged and iteration < newton["maximum_iterations"]:
+            if self._jacobian_outdated:
+                self._assemble_jacobian()
+
+            with timer("solve"):
+                try:
+                    iterations = self._linear_solver.solve(
+                                        self._increment.vector(), self._b)
+                except RuntimeError:
+                    # E.g. a Krylov solver that did not converge
+                    self._jacobian_outdated = True
+                    return iteration, False
+                if isinstance(self._linear_solver, PETScKrylovSolver):
+                    count("krylov_iterations", iterations)
+            state.vector().axpy(-newton["relaxation_parameter"],
+                                                    self._increment.vector())
+            iteration += 1
+            count("newton_iterations")
+
+            previous, residual = residual, self._assemble_residual()
+            if not np.isfinite(residual):
+                self._jacobian_outdated = True
+                return iteration, False
+            if newton["report"]:
+                self._report(iteration, residual, residual/residual_0)
+            converged = residual < newton["absolute_tolerance"]\
+                        or residual/residual_0 < newton["relative_tolerance"]
+            if not modified or residual/previous\
+                                        > newton["jacobian_rebuild_ratio"]:
+                self._jacobian_outdated = True
+        return iteration, converged
+
+
+    def _fail(self, iterations):
+        newton = self.parameters["nonlinear_variational_solver"]\
+                                                            ["newton_solver"]
+        msg = "Newton solver for {} did not converge after {} iterations "\
+                "and {} step cuts.".format(Physics.SOLID, iterations,
+                                self.parameters["Solver"]["maximum_step_cuts"])
+        if newton["error_on_nonconvergence"]:
+            raise RuntimeError(msg)
+        log(LogLevel.WARNING, msg)
+
+
+    def _predict(self, time):
+        # Secant extrapolation of the last two converged states
+        if len(self._history) < 2:
+            return
+        (t0, u0), (t1, u1) = self._history
+        if not t0 < t1 < time:
+            return
+        state = self.problem.state.vector()
+        state.zero()
+        state.axpy(1.0 + (time - t1)/(t1 - t0), u1)
+        state.axpy(-(time - t1)/(t1 - t0), u0)
+
+
+    def _get_loads(self):
+        # Current values of the loads, i.e. the cavity pressures and the
+        # activation
+        loads = [float(bc.traction) for bc in self.problem.bcs.neumann]
+        activation = getattr(self.problem.material, "activation", None)
+        if isinstance(activation, Function):
+            loads.append(activation.vector().get_local())
+        elif activation is not None:
+            loads.append(float(activation))
+        return loads
+
+
+    def _set_loads(self, start, end, fraction):
+        values = [(1 - fraction)*a + fraction*b for a, b in zip(start, end)]
+        for bc, value in zip(self.problem.bcs.neumann, values):
+            bc.traction.assign(value)
+        activation = getattr(self.problem.material, "activation", None)
+        if isinstance(activation, Function):
+            activation.vector().set_local(values[-1])
+            activation.vector().apply("insert")
+        elif activation is not None:
+            activation.assign(values[-1])
+
+
+    def _set_state(self, vector):
+        state = self.problem.state.vector()
+        state.set_local(vector.get_local())
+        state.apply("insert")
+
+
+    def _assemble_residual(self):
+        with timer("assemble_residual"):
+            self._b = assemble(self._form, tensor=self._b)
+            state = self.problem.state.vector()
+            for spring, matrix in self._robin:
+                matrix.mult(state, self._work)
+                self._b.axpy(float(spring), self._work)
+            for bc in self._bcs_homogeneous:
+                bc.apply(self._b)
+        return self._b.norm("l2")
+
+
+    def _assemble_jacobian(self):
+        with timer("assemble_jacobian"):
+            self._A = assemble(self._jacobian, tensor=self._A)
+            if self._robin:
+                from petsc4py import PETSc
+                # The pattern of the boundary terms is part of the one of
+                # the Jacobian
+                structure = PETSc.Mat.Structure.SUBSET_NONZERO_PATTERN
+                A = as_backend_type(self._A).mat()
+                for spring, matrix in self._robin:
+                    A.axpy(float(spring), as_backend_type(matrix).mat(),
+                                                        structure=structure)
+            for bc in self._bcs_homogeneous:
+                bc.apply(self._A)
+        self._jacobian_outdated = False
+        count("jacobian_assemblies")
+        if self._linear_solver is None:
+            self._init_linear_solver()
+        else:
+            # Triggers a new factorization or preconditioner
+            self._linear_solver.set_operator(self._A)
+
+
+    def _init_linear_solver(self):
+        if self.parameters["Solver"]["linear_solver"] == "iterative":
+            self._init_iterative_solver()
+            return
+        # Same choice of solver as BasicBidomainSolver
+        parameters = self.parameters["nonlinear_variational_solver"]\
+                                                            ["newton_solver"]
+        method = parameters["linear_solver"]
+        if method in ("default", "direct", "lu") or has_lu_solver_method(method):
+            method = "default" if method in ("direct", "lu") else method
+            self._linear_solver = LUSolver(self._A, method)
+            self._linear_solver.parameters.update(parameters["lu_solver"])
+        else:
+            self._linear_solver = PETScKrylovSolver(method,
+                                                parameters["preconditioner"])
+            self._linear_solver.parameters.update(parameters["krylov_solver"])
+            self._linear_solver.set_operator(self._A)
+
+
+    def _init_iterative_solver(self):
+        from petsc4py import PETSc
+
+        parameters = self.parameters["Solver"]
+        krylov = self.parameters["nonlinear_variational_solver"]\
+                                            ["newton_solver"]["krylov_solver"]
+        W = self.problem.state_space
+        comm = W.mesh().mpi_comm()
+        modes = rigid_body_modes(W)
+        vectors = [as_backend_type(modes[i]).vec()
+                                            for i in range(modes.dim())]
+
+        self._linear_solver = PETScKrylovSolver()
+        ksp = self._linear_solver.ksp()
+        prefix = "m3h3_solid_{}_".format(id(self))
+        ksp.setOptionsPrefix(prefix)
+        ksp.setType(parameters["krylov_method"])
+        ksp.setTolerances(rtol=krylov["relative_tolerance"],
+                          atol=krylov["absolute_tolerance"],
+                          max_it=krylov["maximum_iterations"])
+        ksp.setInitialGuessNonzero(krylov["nonzero_initial_guess"])
+
+        options = PETSc.Options(prefix)
+        pc = ksp.getPC()
+        if W.sub(0).num_sub_spaces() == 0:
+            nullspace = PETSc.NullSpace().create(vectors=vectors, comm=comm)
+            as_backend_type(self._A).mat().setNearNullSpace(nullspace)
+            pc.setType(parameters["amg"])
+        else:
+            u_dofs = W.sub(0).dofmap().dofs()
+            p_dofs = W.sub(1).dofmap().dofs()
+            is_u = PETSc.IS().createGeneral(u_dofs, comm=comm)
+            is_p = PETSc.IS().createGeneral(p_dofs, comm=comm)
+            # The field split passes a near-nullspace composed with the
+            # index set on to the displacement block
+            u_vectors = []
+            for vector in vectors:
+                sub = vector.getSubVector(is_u)
+                u_vectors.append(sub.copy())
+                vector.restoreSubVector(is_u, sub)
+            is_u.compose("nearnullspace",
+                    PETSc.NullSpace().create(vectors=u_vectors, comm=comm))
+
+            pc.setType("fieldsplit")
+            pc.setFieldSplitIS(("u", is_u), ("p", is_p))
+            pc.setFieldSplitType(PETSc.PC.CompositeType.SCHUR)
+            pc.setFieldSplitSchurFactType(
+                                    PETSc.PC.SchurFactType.FULL)
+            pc.setFieldSplitSchurPreType(PETSc.PC.SchurPreType.SELFP)
+            options["fieldsplit_u_ksp_type"] = "preonly"
+            options["fieldsplit_u_pc_type"] = parameters["amg"]
+            options["fieldsplit_p_ksp_type"] = "preonly"
+            options["fieldsplit_p_pc_type"] = \
+                                        parameters["schur_preconditioner"]
+        ksp.setFromOptions()
+        self._linear_solver.set_operator(self._A)
+
+
+    def _report(self, iteration, residual, relative):
+        log(LogLevel.INFO, "Newton iteration {}: r (abs) = {:.3e}, r (rel) "\
+                            "= {:.3e}".format(iteration, residual, relative))
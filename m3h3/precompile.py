@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""Ahead-of-time compilation of the forms of an M3H3 simulation.
+
+dolfin compiles every form just in time on its first use. In an MPI job all
+processes wait for rank 0 while it compiles, which can take minutes for the
+optimized uflacs kernels. This command sets up the problems of a simulation
+on a minimal mesh of the same cell type, with the same parameters and
+compiler flags, and runs one time step, which compiles every form, element
+and expression that the setup and the solvers need into the dolfin JIT
+cache. Every compilation is recorded, with its time and whether it was
+found in the cache. As compiled forms only depend on the form and the
+element, not on the mesh, a production run with the same configuration then
+finds all of them in the cache. The cache can be shared on a cluster file
+system by setting the cache directory.
+
+Example of usage::
+
+    python -m m3h3.precompile parameters.json --cell tetrahedron \\
+        --material HolzapfelOgden --cache-dir /shared/dijitso
+
+The warm-up geometry has to match the production geometry in whether it
+has fibers (``--no-fibers``) and in its markers (``--markers``), as both
+change the forms.
+
+The parameter file is a JSON dict with the top-level M3H3 parameters and a
+parameter dict for every physics, e.g.
+``{"end_time": 100.0, "Electro": {"polynomial_degree": 1}}``.
+"""
+
+import argparse
+import json
+import os
+import time
+from collections import OrderedDict
+
+import dolfin as df
+from dolfin import LogLevel
+
+from m3h3.setup_parameters import Parameters, Physics
+from m3h3.utils import log
+
+
+MARKERS = {'BASE': (10, 1), 'ENDO': (30, 1), 'EPI': (40, 1),
+           'STIMULUS': (1, 2), 'NONE': (0, 2)}
+
+
+def load_parameters(filename):
+    """Returns M3H3 parameters updated with the values of a JSON parameter
+    file.
+    """
+    with open(filename) as f:
+        values = json.load(f)
+    parameters = Parameters("M3H3")
+    for label, physics_values in values.items():
+        if not Physics.has_value(label):
+            parameters[label] = physics_values
+            continue
+        getattr(parameters, "set_{}_parameters".format(label.lower()))()
+        _update(parameters[label], physics_values)
+    return parameters
+
+
+def precompile(parameters, cell="tetrahedron", material=None,
+                            active_model="active_stress", ecg=False,
+                            fibers=True, markers=None):
+    """Compiles all forms, elements and expressions that
+    :py:class:`m3h3.M3H3` needs for the given parameters into the dolfin JIT
+    cache, by setting up a simulation and running one time step.
+
+    Parameters
+    ----------
+    parameters : :py:class:`m3h3.Parameters`
+        Simulation parameters.
+    cell : str
+        Cell type of the production mesh, ``"triangle"`` or
+        ``"tetrahedron"``.
+    material : str, optional
+        Name of the material model in :py:mod:`m3h3.material`. Required if
+        the parameters contain solid mechanics.
+    active_model : str
+        Active model of the material.
+    ecg : bool
+        If True, the pseudo-ECG form is compiled as well.
+    fibers : bool
+        Whether the production geometry has a microstructure. With fibers,
+        the conductivities are tensors, which changes the forms.
+    markers : list of str, optional
+        Names of the markers of the production geometry, of ``BASE``,
+        ``ENDO``, ``EPI`` and ``STIMULUS``, which determine the boundary
+        conditions and the stimulus. Defaults to all of them.
+
+    Returns
+    -------
+    dict
+        Maps ``<phase>/<module>`` of every JIT compilation, where phase is
+        ``setup``, ``step`` or ``ecg`` and module is the name of the
+        compiled module, e.g. ``ffc_form_<signature>``, to its status and
+        time. The status is ``"hit"`` or ``"miss"`` of the JIT cache, or
+        ``"compiled"`` if the cache directory is unknown.
+    """
+    recorder = _JitRecorder()
+    with recorder:
+        _setup_and_step(recorder, parameters, cell, material, active_model,
+                                                    ecg, fibers, markers)
+    return recorder.report
+
+
+def _setup_and_step(recorder, parameters, cell, material, active_model, ecg,
+                                                            fibers, markers):
+    from m3h3 import M3H3, Interaction
+
+    recorder.phase = "setup"
+    geometry = _geometry(cell, fibers, markers)
+    physics = [Physics(p) for p in parameters.keys() if Physics.has_value(p)]
+    kwargs = {}
+    if Physics.SOLID in physics:
+        if material is None:
+            msg = "A material model is required to compile the solid forms."
+            raise ValueError(msg)
+        kwargs['material'] = _material(geometry, material, active_model)
+    if len(physics) > 1:
+        kwargs['interactions'] = [Interaction(physics[0], p)
+                                                        for p in physics[1:]]
+    model = M3H3(geometry, parameters, **kwargs)
+
+    # The solvers assemble their forms on the first step
+    recorder.phase = "step"
+    try:
+        model.step()
+    except RuntimeError as e:
+        # The forms are compiled before a solver can fail to converge
+        log(LogLevel.WARNING, "Time step of the precompilation failed: "\
+                                                            "{}".format(e))
+
+    if ecg and Physics.ELECTRO in physics:
+        from m3h3.ecg import lead_field_form
+        recorder.phase = "ecg"
+        point = [2.0]*geometry.mesh.geometry().dim()
+        # Same conductivity as M3H3.add_ecg
+        tensors = model.electro_problem.conductivity_tensors
+        conductivity = tensors[0].function if tensors is not None\
+                                                    else df.Constant(1.0)
+        df.Form(lead_field_form(model.electro_problem.current_space,
+                                df.Constant(point), conductivity))
+
+
+class _JitRecorder(object):
+    # Records every compilation through dijitso, which dolfin and FFC call
+    # for forms, elements, expressions and subdomains. Only the first
+    # compilation of a module is recorded.
+
+    def __init__(self):
+        self.phase = None
+        self.report = OrderedDict()
+
+
+    def __enter__(self):
+        import dijitso
+
+        self._dijitso = dijitso
+        self._jit = dijitso.jit
+
+        def jit(jitable, name, *args, **kwargs):
+            before = _cached_libraries()
+            start = time.perf_counter()
+            try:
+                return self._jit(jitable, name, *args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                after = _cached_libraries()
+                if before is None or after is None:
+                    status = "compiled"
+                else:
+                    status = "miss" if len(after - before) > 0 else "hit"
+                key = "{}/{}".format(self.phase, name)
+                if not any(k.endswith("/" + name) for k in self.report):
+                    self.report[key] = OrderedDict([("status", status),
+                                                    ("time", elapsed)])
+
+        dijitso.jit = jit
+        return self
+
+
+    def __exit__(self, *args):
+        self._dijitso.jit = self._jit
+
+
+def _update(parameters, values):
+    for key, value in values.items():
+        if isinstance(value, dict):
+            _update(parameters[key], value)
+        else:
+            parameters[key] = value
+
+
+def _cached_libraries():
+    # Compiled libraries in the dijitso cache, or None if it is unknown
+    cache_dir = os.environ.get("DIJITSO_CACHE_DIR",
+                    os.path.join(os.path.expanduser("~"), ".cache", "dijitso"))
+    if not os.path.isdir(cache_dir):
+        return None
+    libraries = set()
+    for root, _, files in os.walk(cache_dir):
+        libraries.update(os.path.join(root, f) for f in files
+                                                        if f.endswith(".so"))
+    return libraries
+
+
+def _geometry(cell, fibers=True, markers=None):
+    from dolfin import (Constant, MeshFunction, UnitCubeMesh, UnitSquareMesh,
+                        VectorFunctionSpace, interpolate)
+    from geometry import (Geometry2D, HeartGeometry, MarkerFunctions,
+                          MarkerFunctions2D, Microstructure)
+
+    if cell == "triangle":
+        mesh = UnitSquareMesh(df.MPI.comm_self, 1, 1)
+    elif cell == "tetrahedron":
+        mesh = UnitCubeMesh(df.MPI.comm_self, 1, 1, 1)
+    else:
+        msg = "Unsupported cell type {}. Use 'triangle' or "\
+                "'tetrahedron'.".format(cell)
+        raise ValueError(msg)
+    dim = mesh.topology().dim()
+
+    available = [name for name in MARKERS if name != 'NONE']
+    names = available if markers is None else markers
+    unknown = set(names) - set(available)
+    if unknown:
+        msg = "Unknown markers {}. Use some of {}.".format(sorted(unknown),
+                                                                    available)
+        raise ValueError(msg)
+    used = {name: MARKERS[name] for name in list(names) + ['NONE']}
+
+    ffun = MeshFunction("size_t", mesh, dim - 1, MARKERS['NONE'][0])
+    for name, x in (('BASE', (1, 0.0)), ('ENDO', (0, 0.0)), ('EPI', (0, 1.0))):
+        if name not in used:
+            continue
+        subdomain = df.CompiledSubDomain("on_boundary && near(x[i], c)",
+                                            i=x[0], c=x[1])
+        subdomain.mark(ffun, MARKERS[name][0])
+    cfun = MeshFunction("size_t", mesh, dim, MARKERS['NONE'][0])
+    if 'STIMULUS' in used:
+        cfun[0] = MARKERS['STIMULUS'][0]
+
+    kwargs = {}
+    if fibers:
+        V = VectorFunctionSpace(mesh, "P", 1)
+        unit = [[1.0 if i == j else 0.0 for j in range(dim)]
+                                                        for i in range(dim)]
+        f = [interpolate(Constant(e), V) for e in unit]
+        kwargs['microstructure'] = Microstructure(f0=f[0], s0=f[1],
+                                            n0=f[2] if dim == 3 else None)
+    if dim == 2:
+        return Geometry2D(mesh, markers=used,
+                    markerfunctions=MarkerFunctions2D(ffun=ffun, cfun=cfun),
+                    **kwargs)
+    return HeartGeometry(mesh, markers=used,
+                    markerfunctions=MarkerFunctions(ffun=ffun, cfun=cfun),
+                    **kwargs)
+
+
+def _material(geometry, name, active_model):
+    from dolfin import Function, FunctionSpace
+    import m3h3.material
+
+    Material = getattr(m3h3.material, name)
+    activation = Function(FunctionSpace(geometry.mesh, "R", 0))
+    return Material(activation=activation,
+                    parameters=Material.default_parameters(),
+                    active_model=active_model,
+                    f0=getattr(geometry, "f0", None),
+                    s0=getattr(geometry, "s0", None),
+                    n0=getattr(geometry, "n0", None))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("parameters", nargs="?", default=None,
+                        help="JSON parameter file. Defaults to the default "
+                             "electrophysiology parameters.")
+    parser.add_argument("--cell", default="tetrahedron",
+                        choices=["triangle", "tetrahedron"])
+    parser.add_argument("--material", default=None,
+                        help="material model for the solid forms, e.g. "
+                             "HolzapfelOgden")
+    parser.add_argument("--active-model", default="active_stress",
+                        choices=["active_stress", "active_strain"])
+    parser.add_argument("--ecg", action="store_true",
+                        help="also compile the pseudo-ECG form")
+    parser.add_argument("--no-fibers", action="store_true",
+                        help="the production geometry has no microstructure")
+    parser.add_argument("--markers", nargs="+", default=None,
+                        choices=[name for name in MARKERS if name != 'NONE'],
+                        help="markers of the production geometry, defaults "
+                             "to all")
+    parser.add_argument("--cache-dir", default=None,
+                        help="dolfin JIT cache directory, e.g. on a shared "
+                             "file system")
+    parser.add_argument("--output", default=None,
+                        help="write the report as JSON to this file")
+    args = parser.parse_args()
+
+    if args.cache_dir is not None:
+        os.environ["DIJITSO_CACHE_DIR"] = os.path.abspath(args.cache_dir)
+        os.makedirs(args.cache_dir, exist_ok=True)
+    if args.parameters is not None:
+        parameters = load_parameters(args.parameters)
+    else:
+        parameters = Parameters("M3H3")
+        parameters.set_electro_parameters()
+
+    report = precompile(parameters, cell=args.cell, material=args.material,
+                        active_model=args.active_model, ecg=args.ecg,
+                        fibers=not args.no_fibers, markers=args.markers)
+    for name, entry in report.items():
+        print("{:<60} {:<8} {:8.2f} s".format(name, entry["status"],
+                                                            entry["time"]))
+    misses = sum(1 for entry in report.values() if entry["status"] == "miss")
+    print("{} compiled modules, {} cache misses".format(len(report), misses))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""This module implements point probes, e.g. virtual electrodes, that sample
+a field at a fixed set of points.
+
+The cells containing the points and the basis function weights of the
+points are computed once. Every process then holds the weights of all
+probes with respect to the dofs it owns, so that sampling all probes is a
+single sparse matrix-vector product with the owned part of the dof vector
+followed by one reduction to rank 0. Samples are buffered in memory on rank
+0 and appended to an HDF5 time series in blocks by a
+:py:class:`m3h3.output.TimeSeries`.
+"""
+
+import numpy as np
+from mpi4py import MPI
+
+import dolfin as df
+from dolfin import LogLevel, Point
+
+from m3h3.output import TimeSeries
+from m3h3.utils import log
+
+
+class Probes(object):
+    """Samples a function at a set of points.
+
+    Parameters
+    ----------
+    function : :py:class:`dolfin.Function`
+        The sampled field. May be a subfunction of a mixed function, e.g.
+        the displacement of the solid state.
+    points : array_like or dict
+        Coordinates of the probes, either as an (N, gdim) array or as a dict
+        that maps probe names to coordinates.
+    filename : str, optional
+        HDF5 file the samples are written to. If None, samples are only kept
+        in memory.
+    buffer_size : int
+        Number of samples that are buffered before they are written.
+
+    The HDF5 file contains the datasets ``points`` (N, gdim), ``time`` (T,)
+    and ``values`` (T, N) or (T, N, value_size), and the probe names in the
+    ``names`` attribute of ``values``.
+    """
+
+    def __init__(self, function, points, filename=None, buffer_size=1000):
+        if isinstance(points, dict):
+            self.names = [str(name) for name in points.keys()]
+            points = list(points.values())
+        else:
+            self.names = None
+        self.function = function
+        self.points = np.array(points, dtype=float, ndmin=2)
+
+        V = function.function_space()
+        self.comm = V.mesh().mpi_comm()
+        self.rank = df.MPI.rank(self.comm)
+        self.value_size = int(np.prod(function.ufl_shape))
+        self._locate(V)
+
+        self.series = TimeSeries(filename, self.comm, names=self.names,
+                                 metadata={"points": self.points},
+                                 buffer_size=buffer_size)
+
+
+    def __call__(self, time, solution_fields=None):
+        """Samples the probes. Can be registered as a callback with
+        :py:meth:`m3h3.M3H3.register_callback`.
+        """
+        self.sample(time)
+
+
+    def evaluate(self):
+        """Returns the values of all probes on rank 0 and None on all other
+        ranks. Probes outside the mesh evaluate to NaN. This is a collective
+        call.
+        """
+        values = self.function.vector().get_local()
+        partial = np.bincount(self._rows, weights=self._weights*
+                                values[self._columns], minlength=self._size)
+        total = np.empty_like(partial) if self.rank == 0 else None
+        self.comm.Reduce(partial, total, op=MPI.SUM, root=0)
+        if self.rank != 0:
+            return None
+        total = total.reshape((len(self.points), self.value_size))
+        total[self._missing] = np.nan
+        return total[:, 0] if self.function.ufl_shape == () else total
+
+
+    def sample(self, time):
+        """Evaluates the probes and appends the values to the time series.
+        This is a collective call.
+        """
+        self.series.append(time, self.evaluate())
+
+
+    def values(self):
+        """Returns the times and values of the samples that are held in
+        memory on rank 0, i.e. all samples if there is no file.
+        """
+        return self.series.values()
+
+
+    def close(self):
+        """Writes all remaining samples.
+        """
+        self.series.close()
+
+
+    def _locate(self, V):
+        mesh = V.mesh()
+        tree = mesh.bounding_box_tree()
+        num_cells = mesh.num_cells()
+        num_probes = len(self.points)
+
+        # Every probe is evaluated by the lowest rank that contains it
+        cells = np.full(num_probes, -1, dtype=np.int64)
+        for i, x in enumerate(self.points):
+            cell = tree.compute_first_entity_collision(Point(*x))
+            if cell < num_cells:
+                cells[i] = cell
+        size = df.MPI.size(self.comm)
+        local_rank = np.where(cells >= 0, self.rank, size).astype(np.int64)
+        owner = np.empty_like(local_rank)
+        self.comm.Allreduce(local_rank, owner, op=MPI.MIN)
+        self._missing = owner == size
+        if np.any(self._missing) and self.rank == 0:
+            log(LogLevel.WARNING, "{} of {} probes are outside of the "\
+                    "mesh.".format(np.count_nonzero(self._missing),
+                                                                num_probes))
+
+        # Basis function weights with respect to global dofs
+        element = V.element()
+        dofmap = V.dofmap()
+        vs = self.value_size
+        outgoing = [[] for _ in range(size)]
+        first, last = dofmap.ownership_range()
+        ranges = np.array(self.comm.allgather(first))
+        for i in np.flatnonzero(owner == self.rank):
+            cell = df.Cell(mesh, int(cells[i]))
+            basis = element.evaluate_basis_all(self.points[i],
+                            cell.get_vertex_coordinates(), cell.orientation())
+            basis = basis.reshape((-1, vs))
+            for local, phi in zip(dofmap.cell_dofs(cell.index()), basis):
+                dof = dofmap.local_to_global_index(local)
+                dest = int(np.searchsorted(ranges, dof, side="right") - 1)
+                for j in np.flatnonzero(phi):
+                    outgoing[dest].append((i*vs + j, dof, phi[j]))
+
+        # Send the weights to the owners of the dofs
+        incoming = [w for ws in self.comm.alltoall(outgoing) for w in ws]
+        weights = np.array(incoming, dtype=float).reshape((-1, 3))
+        self._rows = weights[:, 0].astype(np.int64)
+        self._columns = (weights[:, 1] - first).astype(np.int64)
+        self._weights = weights[:, 2]
+        self._size = num_probes*vs
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""This module implements low-overhead, hierarchical timers for the phases of
+an M3H3 simulation.
+
+Timers are nested by using :py:func:`timer` as a context manager; the name
+of a timer is prefixed by the names of all enclosing timers, e.g.
+``M3H3/Electro/solve``. All timers are recorded in a module-wide
+:py:class:`Profiler`, in the same way that dolfin keeps its timings in a
+global registry. Besides wall times, the profiler accumulates counters such
+as solver iteration counts for the enclosing phase.
+"""
+
+import json
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import dolfin as df
+
+
+class Profiler(object):
+    """Records wall times and counters of nested simulation phases.
+
+    Parameters
+    ----------
+    enabled : bool
+        If False, timers and counters are ignored.
+    petsc_stages : bool
+        If True, every timer also pushes a PETSc log stage of the same name,
+        so that PETSc's ``-log_view`` output is split by phase. Requires
+        petsc4py.
+    """
+
+    def __init__(self, enabled=True, petsc_stages=False):
+        self.enabled = enabled
+        self._stack = []
+        self._times = OrderedDict()
+        self._calls = OrderedDict()
+        self._counters = OrderedDict()
+        self._petsc_stages = None
+        if petsc_stages:
+            self.enable_petsc_stages()
+
+
+    def enable_petsc_stages(self):
+        """Starts PETSc logging and pushes a PETSc log stage for every timer.
+        """
+        from petsc4py import PETSc
+        PETSc.Log.begin()
+        self._petsc_stages = {}
+
+
+    @contextmanager
+    def timer(self, name):
+        """Context manager that times the enclosed block as a child of the
+        currently running timer.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        self._stack.append(name)
+        path = "/".join(self._stack)
+        stage = self._push_petsc_stage(path)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if stage is not None:
+                stage.pop()
+            self._times[path] = self._times.get(path, 0.0) + elapsed
+            self._calls[path] = self._calls.get(path, 0) + 1
+            self._stack.pop()
+
+
+    def count(self, name, value=1):
+        """Adds value to the counter name of the currently running timer,
+        e.g. the number of linear solver iterations.
+        """
+        if not self.enabled:
+            return
+        path = "/".join(self._stack + [name])
+        self._counters[path] = self._counters.get(path, 0) + value
+
+
+    def local_times(self):
+        """Returns the total times of all timers on this process.
+        """
+        return OrderedDict(self._times)
+
+
+    def reset(self):
+        """Clears all recorded timings and counters.
+        """
+        self._times.clear()
+        self._calls.clear()
+        self._counters.clear()
+
+
+    def report(self, comm=None, dolfin_timings=True):
+        """Returns a structured report of all timers and counters aggregated
+        across the processes of comm. This is a collective call.
+
+        Parameters
+        ----------
+        comm : MPI communicator, optional
+            Defaults to ``dolfin.MPI.comm_world``.
+        dolfin_timings : bool
+            If True, the summary of dolfin's own timings is included as
+            text.
+
+        Returns
+        -------
+        dict
+            ``report["timers"][name]`` holds the number of calls and the
+            minimum, mean and maximum total time over all processes,
+            ``report["counters"][name]`` the same statistics for the
+            counters.
+        """
+        comm = comm if comm is not None else df.MPI.comm_world
+        all_times = comm.allgather(dict(self._times))
+        all_calls = comm.allgather(dict(self._calls))
+        all_counters = comm.allgather(dict(self._counters))
+
+        report = OrderedDict()
+        report["num_processes"] = len(all_times)
+        report["timers"] = OrderedDict()
+        for name in _ordered_keys(all_times):
+            stats = _statistics([t.get(name, 0.0) for t in all_times])
+            stats["calls"] = max(c.get(name, 0) for c in all_calls)
+            report["timers"][name] = stats
+        report["counters"] = OrderedDict()
+        for name in _ordered_keys(all_counters):
+            report["counters"][name] = _statistics(
+                                    [c.get(name, 0) for c in all_counters])
+
+        if dolfin_timings:
+            table = df.timings(df.TimingClear.keep, [df.TimingType.wall])
+            report["dolfin"] = table.str(True)
+        return report
+
+
+    def dump(self, filename, comm=None):
+        """Writes the report as JSON from rank 0. This is a collective call.
+        """
+        comm = comm if comm is not None else df.MPI.comm_world
+        report = self.report(comm)
+        if comm.rank == 0:
+            with open(filename, "w") as f:
+                json.dump(report, f, indent=2)
+        return report
+
+
+    def _push_petsc_stage(self, path):
+        if self._petsc_stages is None:
+            return None
+        if path not in self._petsc_stages:
+            from petsc4py import PETSc
+            self._petsc_stages[path] = PETSc.Log.Stage(path)
+        stage = self._petsc_stages[path]
+        stage.push()
+        return stage
+
+
+def _ordered_keys(dicts):
+    keys = OrderedDict()
+    for d in dicts:
+        for key in d.keys():
+            keys[key] = None
+    return list(keys.keys())
+
+
+def _statistics(values):
+    return OrderedDict([("min", min(values)),
+                        ("mean", sum(values)/len(values)),
+                        ("max", max(values))])
+
+
+profiler = Profiler()
+
+
+def timer(name):
+    """Times the enclosed block with the module-wide profiler.
+
+    Example of usage::
+
+        with timer("assemble"):
+            A = assemble(a)
+    """
+    return profiler.timer(name)
+
+
+def count(name, value=1):
+    """Adds value to a counter of the currently running timer of the
+    module-wide profiler.
+    """
+    profiler.count(name, value)
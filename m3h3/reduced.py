@@ -0,0 +1,445 @@
+# -*- coding: utf-8 -*-
+"""This module implements a reduced-order model of the solid mechanics for
+many-query problems such as parameter estimation.
+
+In the offline phase, :py:class:`Snapshots` collects converged states of
+full :py:class:`m3h3.pde.solver.SolidSolver` solves for a range of
+material and activation parameters, :py:func:`pod_basis` computes a proper
+orthogonal decomposition (POD) basis of them, and :py:func:`ecsw_weights`
+selects a small set of weighted cells by energy conserving sampling and
+weighting (ECSW), on which the virtual work is integrated online.
+
+In the online phase, :py:class:`ReducedSolidSolver` solves the Galerkin
+projection of the balance of momentum onto the basis with a Newton method
+in the reduced coordinates. Only the sampled cells are assembled and the
+linear systems are dense with the size of the basis. The boundary terms of
+the cavity pressures are cheap and assembled in full, and the Robin terms
+are projected once. A residual-based error estimate falls back to the full
+solver when the basis does not represent the state well enough.
+
+Example of usage::
+
+    snapshots = Snapshots(m3h3.solid_problem)
+    for member in training_parameters:
+        m3h3.update_parameters(Physics.SOLID, member)
+        m3h3.solid_solver.step()
+        snapshots.add()
+    basis, _ = pod_basis(snapshots, tolerance=1e-4)
+    cells, weights = ecsw_weights(m3h3.solid_solver, basis,
+                                  snapshots.states)
+    m3h3.use_reduced_solid(basis, cells, weights)
+"""
+
+import numpy as np
+
+import dolfin as df
+from dolfin import Function, FunctionSpace, LogLevel, MeshFunction
+from ufl import Form
+
+from m3h3.profiling import count, timer
+from m3h3.setup_parameters import Physics
+from m3h3.utils import log
+
+
+class Snapshots(object):
+    """Collects states of a :py:class:`m3h3.pde.SolidProblem`. It can be
+    registered as a callback of :py:meth:`m3h3.M3H3.register_callback` to
+    collect the states during a simulation.
+    """
+
+    def __init__(self, problem):
+        self.problem = problem
+        self.states = []
+
+
+    def __call__(self, time, solution_fields=None):
+        self.add()
+
+
+    def __len__(self):
+        return len(self.states)
+
+
+    def add(self, vector=None):
+        """Adds the local values of vector, which defaults to the current
+        state of the problem.
+        """
+        if vector is None:
+            vector = self.problem.state.vector()
+        self.states.append(vector.get_local().copy())
+
+
+    @property
+    def matrix(self):
+        """The local values of the states as columns of an array.
+        """
+        return np.column_stack(self.states)
+
+
+def pod_basis(snapshots, tolerance=1e-4, max_size=None, comm=None):
+    """Computes a POD basis of snapshots with the method of snapshots, i.e.
+    from the eigenvalues of their small correlation matrix, which works on
+    the local values of distributed vectors.
+
+    Parameters
+    ----------
+    snapshots : :py:class:`Snapshots` or array
+        The snapshots, or an array of their local values as columns.
+    tolerance : float
+        The basis is the smallest one whose projection error of the
+        snapshots, relative to their norm, is below tolerance.
+    max_size : int, optional
+        Maximum number of basis vectors.
+    comm : MPI communicator, optional
+        Defaults to ``dolfin.MPI.comm_world``.
+
+    Returns
+    -------
+    basis : array
+        Local values of the orthonormal basis vectors as columns.
+    singular_values : array
+        Singular values of the snapshot matrix in decreasing order.
+    """
+    comm = comm if comm is not None else df.MPI.comm_world
+    S = snapshots.matrix if isinstance(snapshots, Snapshots)\
+                                                    else np.asarray(snapshots)
+    correlation = comm.allreduce(S.T.dot(S))
+    eigenvalues, vectors = np.linalg.eigh(correlation)
+    order = np.argsort(eigenvalues)[::-1]
+    eigenvalues = np.clip(eigenvalues[order], 0.0, None)
+    vectors = vectors[:, order]
+    if eigenvalues[0] == 0.0:
+        msg = "The snapshots are all zero."
+        raise ValueError(msg)
+
+    energy = np.cumsum(eigenvalues)/eigenvalues.sum()
+    size = int(np.searchsorted(energy, 1.0 - tolerance**2)) + 1
+    # Modes of round-off size cannot be normalized
+    size = min(size, int(np.sum(eigenvalues > 1e-12*eigenvalues[0])))
+    if max_size is not None:
+        size = min(size, max_size)
+    singular_values = np.sqrt(eigenvalues)
+    basis = S.dot(vectors[:, :size])/singular_values[:size]
+    log(LogLevel.INFO, "POD basis of {} vectors from {} snapshots".format(
+                                                        size, S.shape[1]))
+    return basis, singular_values
+
+
+def ecsw_weights(solver, basis, states, tolerance=1e-2,
+                                                    max_iterations=None):
+    """Selects cells and weights for the hyper-reduction of the virtual work
+    by ECSW. The weighted sum of the contributions of the selected cells to
+    the reduced residual and to the reduced Jacobian times the state
+    approximates the sum over all cells for the projections of the training
+    states onto the basis.
+
+    The training loops over all cells for every state, so it is run in
+    serial, offline.
+
+    Parameters
+    ----------
+    solver : :py:class:`m3h3.pde.solver.SolidSolver`
+        The full solver, whose problem provides the forms and loads.
+    basis : array
+        POD basis, see :py:func:`pod_basis`.
+    states : list of arrays
+        Training states, e.g. :py:attr:`Snapshots.states`.
+    tolerance : float
+        Relative accuracy of the weighted sums for the training states.
+    max_iterations : int, optional
+        Maximum number of iterations of the non-negative least squares
+        solver, which bounds the number of selected cells.
+
+    Returns
+    -------
+    cells : array
+        Indices of the selected cells.
+    weights : array
+        Positive weights of the selected cells.
+    """
+    problem = solver.problem
+    mesh = problem.geometry.mesh
+    if df.MPI.size(mesh.mpi_comm()) > 1:
+        msg = "ECSW weights are computed in serial."
+        raise ValueError(msg)
+    residual = _cell_integrals(problem._form)
+    jacobian = _cell_integrals(problem._jacobian)
+    dofmap = problem.state_space.dofmap()
+    state = problem.state.vector()
+    initial = state.get_local()
+
+    size = basis.shape[1]
+    G = np.zeros((2*size*len(states), mesh.num_cells()))
+    with timer("ecsw_training"):
+        for i, x in enumerate(states):
+            q = basis.T.dot(x)
+            state.set_local(basis.dot(q))
+            state.apply("insert")
+            rows = slice(2*size*i, 2*size*(i + 1))
+            for cell in df.cells(mesh):
+                dofs = dofmap.cell_dofs(cell.index())
+                V = basis[dofs]
+                r = df.assemble_local(residual, cell)
+                J = df.assemble_local(jacobian, cell)
+                G[rows, cell.index()] = np.concatenate([V.T.dot(r),
+                                                V.T.dot(J.dot(V.dot(q)))])
+            # Equal weight for the residual and Jacobian rows of all states
+            for block in (slice(rows.start, rows.start + size),
+                          slice(rows.start + size, rows.stop)):
+                norm = np.linalg.norm(G[block].sum(axis=1))
+                if norm > 0:
+                    G[block] /= norm
+    state.set_local(initial)
+    state.apply("insert")
+
+    weights = _nnls(G, G.sum(axis=1), tolerance, max_iterations)
+    cells = np.flatnonzero(weights > 0)
+    log(LogLevel.INFO, "ECSW selected {} of {} cells".format(len(cells),
+                                                        mesh.num_cells()))
+    return cells, weights[cells]
+
+
+class ReducedSolidSolver(object):
+    """Solves the solid mechanics in the coordinates of a POD basis, as a
+    replacement of a :py:class:`m3h3.pde.solver.SolidSolver` with the same
+    :py:meth:`step`.
+
+    The basis vectors must vanish on the Dirichlet boundary, as the
+    snapshots do for a fixed base.
+
+    Every ``check_every`` steps, and whenever the reduced Newton iteration
+    fails, the error is estimated by the norm of the full residual of the
+    reduced solution relative to the full residual of the state at the
+    start of the step. If it exceeds ``tolerance``, the step is repeated
+    with the full solver, starting from the reduced solution, and the
+    reduced coordinates are set to the projection of its solution.
+
+    Parameters
+    ----------
+    solver : :py:class:`m3h3.pde.solver.SolidSolver`
+        The full solver, which provides the tolerances and loads, and is
+        used as fallback.
+    basis : array
+        Local values of an orthonormal basis as columns, see
+        :py:func:`pod_basis`.
+    cells, weights : array, optional
+        Cells and weights of the hyper-reduction, see
+        :py:func:`ecsw_weights`. Defaults to integration over all cells.
+    tolerance : float
+        Relative residual above which the full solver is used.
+    check_every : int
+        Number of steps between two error estimates.
+    """
+
+    def __init__(self, solver, basis, cells=None, weights=None,
+                                            tolerance=1e-2, check_every=1):
+        self.solver = solver
+        self.problem = solver.problem
+        self.parameters = solver.parameters
+        self.basis = np.asarray(basis)
+        self.tolerance = tolerance
+        self.check_every = check_every
+        self.comm = self.problem.state_space.mesh().mpi_comm()
+
+        problem = self.problem
+        if cells is None:
+            self._residual, self._jacobian = problem._form, problem._jacobian
+        else:
+            self._residual = _hyper_reduced(problem._form,
+                                    problem.geometry.mesh, cells, weights)
+            self._jacobian = df.derivative(self._residual, problem.state)
+        self._work = problem.state.vector().copy()
+        self._b = None
+        self._A = None
+        # The Robin terms are linear, so they are projected once
+        self._robin = [(spring, self._project_matrix(matrix))
+                                        for spring, matrix in solver._robin]
+        self.coordinates = self._project(problem.state.vector())
+        self._steps = 0
+
+
+    def invalidate(self):
+        """Marks the Jacobian of the full solver as outdated. The reduced
+        Jacobian is assembled in every iteration.
+        """
+        self.solver.invalidate()
+
+
+    def step(self, time=None):
+        """Solves for the state at the given time in reduced coordinates,
+        or with the full solver if the error estimate is too large.
+
+        Returns
+        -------
+        int
+            Number of Newton iterations, reduced and full.
+        """
+        time = float(self.solver.time) if time is None else time
+        check = self._steps % self.check_every == 0
+        self._steps += 1
+        if check:
+            self._set_state(self.coordinates)
+            initial = self.solver._assemble_residual()
+
+        iterations, converged = self._newton()
+        if check or not converged:
+            if not check:
+                self._set_state(self.coordinates)
+                initial = self.solver._assemble_residual()
+            self._set_state(self.coordinates + self._increment)
+            residual = self.solver._assemble_residual()
+            absolute = self.parameters["nonlinear_variational_solver"]\
+                                    ["newton_solver"]["absolute_tolerance"]
+            if not converged or (residual > absolute
+                                and residual > self.tolerance*initial):
+                log(LogLevel.PROGRESS, "Reduced {} step at t = {} has a "\
+                        "relative residual of {:.2e}, using the full "\
+                        "solver".format(Physics.SOLID, time,
+                                        residual/max(initial, 1e-300)))
+                count("reduced_fallbacks")
+                iterations += self.solver.step(time)
+                self.coordinates = self._project(self.problem.state.vector())
+                return iterations
+
+        self.coordinates = self.coordinates + self._increment
+        self._set_state(self.coordinates)
+        self.solver._accept(time, self.solver._get_loads())
+        return iterations
+
+
+    def _newton(self):
+        # Newton iteration for the increment of the reduced coordinates.
+        # Returns the number of iterations and whether it has converged.
+        newton = self.parameters["nonlinear_variational_solver"]\
+                                                            ["newton_solver"]
+        q = self.coordinates.copy()
+        residual = self._reduced_residual(q)
+        norm_0 = norm = np.linalg.norm(residual)
+        iteration = 0
+        converged = norm < newton["absolute_tolerance"]
+        while not converged and iteration < newton["maximum_iterations"]:
+            with timer("reduced_solve"):
+                try:
+                    q -= np.linalg.solve(self._reduced_jacobian(), residual)
+                except np.linalg.LinAlgError:
+                    break
+            iteration += 1
+            count("reduced_newton_iterations")
+            residual = self._reduced_residual(q)
+            norm = np.linalg.norm(residual)
+            if not np.isfinite(norm):
+                break
+            converged = norm < newton["absolute_tolerance"]\
+                                    or norm/norm_0 < newton["relative_tolerance"]
+        self._increment = q - self.coordinates
+        return iteration, converged
+
+
+    def _reduced_residual(self, q):
+        self._set_state(q)
+        with timer("assemble_reduced_residual"):
+            self._b = df.assemble(self._residual, tensor=self._b)
+        residual = self._project(self._b)
+        for spring, matrix in self._robin:
+            residual += float(spring)*matrix.dot(q)
+        return residual
+
+
+    def _reduced_jacobian(self):
+        with timer("assemble_reduced_jacobian"):
+            self._A = df.assemble(self._jacobian, tensor=self._A)
+        jacobian = self._project_matrix(self._A)
+        for spring, matrix in self._robin:
+            jacobian += float(spring)*matrix
+        return jacobian
+
+
+    def _project(self, vector):
+        return self.comm.allreduce(self.basis.T.dot(vector.get_local()))
+
+
+    def _project_matrix(self, matrix):
+        # Basis transpose times matrix times basis
+        product = np.empty((self.basis.shape[1],)*2)
+        for k in range(self.basis.shape[1]):
+            self._work.set_local(self.basis[:, k])
+            self._work.apply("insert")
+            column = self._work.copy()
+            matrix.mult(self._work, column)
+            product[:, k] = self._project(column)
+        return product
+
+
+    def _set_state(self, q):
+        state = self.problem.state.vector()
+        state.set_local(self.basis.dot(q))
+        state.apply("insert")
+
+
+def _cell_integrals(form):
+    return Form([integral for integral in form.integrals()
+                                    if integral.integral_type() == "cell"])
+
+
+def _hyper_reduced(form, mesh, cells, weights):
+    # The form with the cell integrals restricted to the selected cells and
+    # weighted, such that the assembler skips all other cells
+    markers = MeshFunction("size_t", mesh, mesh.topology().dim(), 0)
+    markers.array()[cells] = 1
+    weight = Function(FunctionSpace(mesh, "DG", 0))
+    dofmap = weight.function_space().dofmap()
+    values = weight.vector().get_local()
+    for cell, value in zip(cells, weights):
+        values[dofmap.cell_dofs(int(cell))[0]] = value
+    weight.vector().set_local(values)
+    weight.vector().apply("insert")
+
+    integrals = []
+    for integral in form.integrals():
+        if integral.integral_type() == "cell":
+            integral = integral.reconstruct(
+                                    integrand=weight*integral.integrand(),
+                                    subdomain_id=1, subdomain_data=markers)
+        integrals.append(integral)
+    return Form(integrals)
+
+
+def _nnls(G, b, tolerance, max_iterations=None):
+    # Non-negative least squares by the active set method of Lawson and
+    # Hanson, stopped as soon as the relative residual is below tolerance,
+    # which gives sparse solutions
+    n = G.shape[1]
+    max_iterations = 3*n if max_iterations is None else max_iterations
+    x = np.zeros(n)
+    active = np.zeros(n, dtype=bool)
+    target = tolerance*np.linalg.norm(b)
+    residual = b.copy()
+    for _ in range(max_iterations):
+        if np.linalg.norm(residual) <= target:
+            break
+        gradient = G.T.dot(residual)
+        gradient[active] = -np.inf
+        j = np.argmax(gradient)
+        if gradient[j] <= 0:
+            break
+        active[j] = True
+        while True:
+            indices = np.flatnonzero(active)
+            z = np.linalg.lstsq(G[:, indices], b, rcond=None)[0]
+            if (z > 0).all():
+                x[:] = 0.0
+                x[indices] = z
+                break
+            # Move towards z until a weight becomes zero and drop it
+            negative = z <= 0
+            current = x[indices]
+            alpha = np.min(current[negative]/(current[negative]
+                                                        - z[negative]))
+            x[indices] = current + alpha*(z - current)
+            dropped = indices[x[indices] <= 1e-14*max(1.0, x.max())]
+            x[dropped] = 0.0
+            active[dropped] = False
+            if not active.any():
+                break
+        residual = b - G.dot(x)
+    return x
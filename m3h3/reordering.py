@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""This module implements bandwidth-reducing reordering of meshes.
+
+Meshes arrive in the order of the mesh generator, so the vertices of a cell
+and the cells that share a vertex are far apart in memory, and assembly and
+the vertex-wise ODE sweeps fetch a new cache line for almost every entity.
+:py:func:`reorder_geometry` renumbers the vertices of a serial mesh by
+reverse Cuthill-McKee of the vertex graph or along a Morton (Z-order)
+space-filling curve, orders the cells along the new vertex numbering, and
+transfers the marker functions and microstructure to the reordered mesh.
+
+The dofs are numbered by dolfin from the mesh, and renumbered by a graph
+ordering of the dofmap if ``reorder_dofs_serial`` is set, which is the
+default. Its library is selected by the ``dof_ordering_library``
+parameter of dolfin, e.g. ``"Boost"`` for reverse Cuthill-McKee, which
+numbers the dofs of the subspaces of a mixed space node by node.
+:py:class:`m3h3.M3H3` sets it from the ``dof_ordering`` partitioning
+parameter while it sets up its problems, and restores it afterwards.
+
+A distributed mesh cannot be renumbered in place. Its cells are ordered
+along a space-filling curve within every process by
+:py:func:`m3h3.partitioning.partition_geometry` with ``reorder=True``.
+"""
+
+import numpy as np
+
+from dolfin import (Function, FunctionSpace, LagrangeInterpolator, LogLevel,
+                    Mesh, MeshEditor, MeshFunction)
+import dolfin as df
+
+from m3h3.partitioning import MARKER_FUNCTIONS, MICROSTRUCTURE, _VALUE_TYPES
+from m3h3.utils import log
+
+
+METHODS = ("rcm", "morton")
+
+
+def reverse_cuthill_mckee(cells, num_vertices):
+    """Returns the reverse Cuthill-McKee ordering of the vertices of a mesh,
+    a breadth first search of the vertex graph that visits the neighbours
+    of a vertex by increasing degree, starting every connected component at
+    a vertex of minimum degree.
+
+    Parameters
+    ----------
+    cells : array
+        Vertex indices of the cells.
+    num_vertices : int
+        Number of vertices.
+
+    Returns
+    -------
+    array
+        The old indices of the vertices in the new order.
+    """
+    indptr, indices = _vertex_graph(cells, num_vertices)
+    degree = np.diff(indptr)
+    visited = np.zeros(num_vertices, dtype=bool)
+    order = np.empty(num_vertices, dtype=np.intp)
+    head = tail = 0
+    for start in np.argsort(degree, kind="stable"):
+        if visited[start]:
+            continue
+        visited[start] = True
+        order[tail] = start
+        tail += 1
+        while head < tail:
+            vertex = order[head]
+            head += 1
+            neighbours = indices[indptr[vertex]:indptr[vertex + 1]]
+            neighbours = neighbours[~visited[neighbours]]
+            neighbours = neighbours[np.argsort(degree[neighbours],
+                                                            kind="stable")]
+            visited[neighbours] = True
+            order[tail:tail + len(neighbours)] = neighbours
+            tail += len(neighbours)
+    return order[::-1]
+
+
+def morton_order(points):
+    """Returns the order of points along a Morton (Z-order) space-filling
+    curve through their bounding box.
+
+    Parameters
+    ----------
+    points : array
+        Coordinates of the points.
+
+    Returns
+    -------
+    array
+        The indices of the points in the new order.
+    """
+    points = np.asarray(points, dtype=float)
+    dim = points.shape[1]
+    bits = min(31, 63//dim)
+    lower = points.min(axis=0)
+    extent = max(float((points.max(axis=0) - lower).max()), 1e-300)
+    grid = ((points - lower)/extent*(2**bits - 1)).astype(np.uint64)
+    keys = np.zeros(len(points), dtype=np.uint64)
+    for bit in range(bits):
+        for axis in range(dim):
+            keys |= ((grid[:, axis] >> np.uint64(bit)) & np.uint64(1))\
+                                            << np.uint64(bit*dim + axis)
+    return np.argsort(keys, kind="stable")
+
+
+def bandwidth(cells):
+    """Returns the largest difference of the vertex indices of a cell,
+    which bounds the bandwidth of the matrices of linear elements.
+    """
+    cells = np.asarray(cells)
+    if len(cells) == 0:
+        return 0
+    return int((cells.max(axis=1) - cells.min(axis=1)).max())
+
+
+def reorder_geometry(geometry, method="rcm", markers=None):
+    """Returns a copy of a serial geometry whose vertices and cells are
+    numbered for locality of memory access.
+
+    Parameters
+    ----------
+    geometry : :py:class:`geometry.HeartGeometry`
+        Geometry to reorder. Marker functions and microstructure are
+        transferred to the new mesh. The microstructure has to be in a
+        Lagrange space.
+    method : str
+        ``"rcm"`` numbers the vertices by :py:func:`reverse_cuthill_mckee`
+        and the cells by their smallest vertex, ``"morton"`` numbers both
+        along the :py:func:`morton_order` of the vertices and cell
+        midpoints.
+    markers : :py:class:`dolfin.MeshFunction`, optional
+        Another marker function to transfer, e.g. the regions of a
+        :py:class:`m3h3.ode.MultiCellModel`.
+
+    Returns
+    -------
+    (geometry, markers)
+        The reordered geometry and marker function.
+    """
+    mesh = geometry.mesh
+    if df.MPI.size(mesh.mpi_comm()) > 1:
+        msg = "Only serial meshes can be reordered, use weighted "\
+                "partitioning to order the cells of a distributed mesh."
+        raise NotImplementedError(msg)
+    if method not in METHODS:
+        msg = "Unknown reordering method {}, expected one of {}.".format(
+                                                        method, METHODS)
+        raise ValueError(msg)
+
+    cells = mesh.cells()
+    coordinates = mesh.coordinates()
+    if method == "rcm":
+        vertex_order = reverse_cuthill_mckee(cells, len(coordinates))
+    else:
+        vertex_order = morton_order(coordinates)
+    new_index = np.empty_like(vertex_order)
+    new_index[vertex_order] = np.arange(len(vertex_order))
+    new_cells = new_index[cells]
+    if method == "rcm":
+        cell_order = np.lexsort((new_cells.max(axis=1),
+                                                    new_cells.min(axis=1)))
+    else:
+        cell_order = morton_order(coordinates[cells].mean(axis=1))
+
+    new_mesh = _build_mesh(mesh, coordinates[vertex_order],
+                                                    new_cells[cell_order])
+    log(LogLevel.PROGRESS, "Reordered mesh by {}: bandwidth {} "\
+            "(before {})".format(method, bandwidth(new_mesh.cells()),
+                                                        bandwidth(cells)))
+
+    orders = {0: vertex_order, mesh.topology().dim(): cell_order}
+    markerfunctions = {}
+    for name in MARKER_FUNCTIONS:
+        mf = getattr(geometry, name, None)
+        if mf is not None:
+            markerfunctions[name] = _transfer_markers(mf, new_mesh, new_index,
+                                                                        orders)
+    new_markers = None
+    if markers is not None and markers is geometry.cfun:
+        new_markers = markerfunctions["cfun"]
+    elif markers is not None:
+        new_markers = _transfer_markers(markers, new_mesh, new_index, orders)
+
+    microstructure = {}
+    for name in MICROSTRUCTURE:
+        f = getattr(geometry, name, None)
+        if f is not None:
+            V = FunctionSpace(new_mesh, f.function_space().ufl_element())
+            microstructure[name] = Function(V)
+            LagrangeInterpolator.interpolate(microstructure[name], f)
+
+    kwargs = {"markers": geometry.markers}
+    if markerfunctions:
+        kwargs["markerfunctions"] = type(geometry.markerfunctions)(
+                                                            **markerfunctions)
+    if microstructure:
+        kwargs["microstructure"] = type(geometry.microstructure)(
+                                                            **microstructure)
+    return type(geometry)(new_mesh, **kwargs), new_markers
+
+
+def _vertex_graph(cells, num_vertices):
+    # Compressed rows of the vertices that share a cell with each vertex
+    cells = np.asarray(cells, dtype=np.int64)
+    rows = np.repeat(cells, cells.shape[1], axis=1).ravel()
+    columns = np.tile(cells, (1, cells.shape[1])).ravel()
+    keys = np.unique(rows*num_vertices + columns)
+    rows, columns = keys//num_vertices, keys % num_vertices
+    edges = rows != columns
+    rows, columns = rows[edges], columns[edges]
+    indptr = np.zeros(num_vertices + 1, dtype=np.int64)
+    np.add.at(indptr, rows + 1, 1)
+    return np.cumsum(indptr), columns
+
+
+def _build_mesh(mesh, coordinates, cells):
+    new_mesh = Mesh(mesh.mpi_comm())
+    editor = MeshEditor()
+    editor.open(new_mesh, mesh.ufl_cell().cellname(),
+                            mesh.topology().dim(), mesh.geometry().dim())
+    editor.init_vertices(len(coordinates))
+    editor.init_cells(len(cells))
+    for i, x in enumerate(coordinates):
+        editor.add_vertex(i, x)
+    for i, c in enumerate(cells.astype(np.uintp)):
+        editor.add_cell(i, c)
+    editor.close()
+    return new_mesh
+
+
+def _transfer_markers(mf, new_mesh, new_index, orders):
+    # Cells and vertices are permuted, other entities are matched by their
+    # vertices in the new numbering
+    dim = mf.dim()
+    new_mf = MeshFunction(_VALUE_TYPES[type(mf).__name__], new_mesh, dim)
+    if dim in orders:
+        new_mf.array()[:] = mf.array()[orders[dim]]
+        return new_mf
+    mesh = mf.mesh()
+    mesh.init(dim, 0)
+    new_mesh.init(dim, 0)
+    old_keys = np.sort(new_index[mesh.topology()(dim, 0)().reshape(
+                                                    -1, dim + 1)], axis=1)
+    new_keys = np.sort(new_mesh.topology()(dim, 0)().reshape(-1, dim + 1),
+                                                                    axis=1)
+    new_mf.array()[:] = mf.array()[_match_rows(new_keys, old_keys)]
+    return new_mf
+
+
+def _match_rows(a, b):
+    # Index into b of every row of a, where both contain the same rows
+    _, inverse = np.unique(np.concatenate([a, b]), axis=0,
+                                                        return_inverse=True)
+    inverse = inverse.ravel()
+    position = np.empty(inverse.max() + 1, dtype=np.intp)
+    position[inverse[len(a):]] = np.arange(len(b))
+    return position[inverse[:len(a)]]
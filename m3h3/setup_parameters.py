@@ -8,8 +8,6 @@ import dolfin as df
 from dolfin import (LogLevel, LUSolver, PETScKrylovSolver,
                     NonlinearVariationalSolver)
 
-import cbcbeat
-
 import m3h3
 
 
@@ -68,6 +66,14 @@ class Parameters(df.Parameters):
         self.add("start_time", 0.0)
         self.add("end_time", 1.0)
 
+        partitioning = df.Parameters("Partitioning")
+        partitioning.add("weighted", False)
+        partitioning.add("assembly_cost", 1.0)
+        partitioning.add("cache_dir", "")
+        partitioning.add("reordering", "none")
+        partitioning.add("dof_ordering", "")
+        self.add(partitioning)
+
 
     def set_electro_parameters(self, parameters=None):
         """Sets parameters for electrophysiology problems and solver. If
@@ -117,8 +123,14 @@ class Parameters(df.Parameters):
         electro.add("theta", 0.5)
         electro.add("polynomial_degree", 1)
         electro.add("use_average_u_constraint", False)
+        # Conductivities along the fibers, and along the sheets (_t) and
+        # normals (_n), which only apply to geometries with fibers
         electro.add("M_i", 1.0)
         electro.add("M_e", 2.0)
+        electro.add("M_i_t", 1.0)
+        electro.add("M_i_n", 1.0)
+        electro.add("M_e_t", 2.0)
+        electro.add("M_e_n", 2.0)
         electro.add("I_a", 0.0)
         electro.add(df.Parameters("I_s"))
         electro["I_s"].add("period", 0)
@@ -127,6 +139,19 @@ class Parameters(df.Parameters):
         electro.add("cell_model", "Tentusscher_panfilov_2006_M_cell")
         electro.add("pde_model", "bidomain")
 
+        # Parameters of pde_model "eikonal": conduction velocity along the
+        # fibers, comma separated stimulus markers and their activation
+        # times, and the active tension profile
+        electro.add(df.Parameters("Eikonal"))
+        electro["Eikonal"].add("conduction_velocity", 0.6)
+        electro["Eikonal"].add("stimulus_markers", "STIMULUS")
+        electro["Eikonal"].add("stimulus_times", "0.0")
+        electro["Eikonal"].add("tolerance", 1e-6)
+        electro["Eikonal"].add("peak_tension", 60.0)
+        electro["Eikonal"].add("rise_time", 20.0)
+        electro["Eikonal"].add("decay_time", 80.0)
+        electro["Eikonal"].add("duration", 300.0)
+
         electro.add(df.Parameters("ODESolver"))
         electro["ODESolver"].add("scheme", "RL1")
 
@@ -143,19 +168,32 @@ class Parameters(df.Parameters):
         # Add boundary condtion parameters
         solid.add(df.Parameters("BoundaryConditions"))
         solid["BoundaryConditions"].add("base_bc", "fixed")
-        solid["BoundaryConditions"].add("lv_pressure", 10.0)
+        solid["BoundaryConditions"].add("lv_pressure", 0.0)
         solid["BoundaryConditions"].add("rv_pressure", 0.0)
         solid["BoundaryConditions"].add("pericardium_spring", 0.0)
         solid["BoundaryConditions"].add("base_spring", 0.0)
 
         # Add default parameters from both LU and Krylov solvers
         solid.add(NonlinearVariationalSolver.default_parameters())
+        # Reuse of the Jacobian by the Newton solver, either "newton" or
+        # "modified"
+        newton = solid["nonlinear_variational_solver"]["newton_solver"]
+        newton.add("jacobian_update", "modified")
+        newton.add("jacobian_rebuild_ratio", 0.5)
         solid.add(LUSolver.default_parameters())
         solid.add(PETScKrylovSolver.default_parameters())
 
-        # Add solver parameters
+        # Add solver parameters. The linear solver of the Newton iterations
+        # is either "direct" or "iterative", see
+        # m3h3.pde.solver.SolidSolver
         solid.add(df.Parameters("Solver"))
         solid["Solver"].add("dummy_parameter", False)
+        solid["Solver"].add("linear_solver", "direct")
+        solid["Solver"].add("krylov_method", "gmres")
+        solid["Solver"].add("amg", "gamg")
+        solid["Solver"].add("schur_preconditioner", "jacobi")
+        solid["Solver"].add("predictor", "secant")
+        solid["Solver"].add("maximum_step_cuts", 4)
 
         self.add(solid)
 
@@ -164,6 +202,19 @@ class Parameters(df.Parameters):
         fluid = df.Parameters(Physics.FLUID.value)
         fluid.add("dt", 1e-3)
         fluid.add("dummy_parameter", False)
+        fluid.add("density", 1.0)
+        fluid.add("viscosity", 1.0)
+        fluid.add("velocity_degree", 2)
+        fluid.add("pressure_degree", 1)
+
+        # Add boundary condition parameters. Markers are comma separated
+        # names of geometry markers.
+        fluid.add(df.Parameters("BoundaryConditions"))
+        fluid["BoundaryConditions"].add("no_slip", "ENDO")
+        fluid["BoundaryConditions"].add("inflow", "")
+        fluid["BoundaryConditions"].add("outflow", "")
+        fluid["BoundaryConditions"].add("inflow_pressure", 0.0)
+        fluid["BoundaryConditions"].add("outflow_pressure", 0.0)
 
         # Add default parameters from both LU and Krylov solvers
         fluid.add(LUSolver.default_parameters())
@@ -172,6 +223,13 @@ class Parameters(df.Parameters):
         # Add solver parameters
         fluid.add(df.Parameters("Solver"))
         fluid["Solver"].add("dummy_parameter", False)
+        fluid["Solver"].add("convection", "explicit")
+        fluid["Solver"].add("velocity_solver", "bicgstab")
+        fluid["Solver"].add("velocity_preconditioner", "jacobi")
+        fluid["Solver"].add("pressure_solver", "gmres")
+        fluid["Solver"].add("pressure_preconditioner", "amg")
+        fluid["Solver"].add("correction_solver", "gmres")
+        fluid["Solver"].add("correction_preconditioner", "jacobi")
 
         self.add(fluid)
 
@@ -180,6 +238,21 @@ class Parameters(df.Parameters):
         porous = df.Parameters(Physics.POROUS.value)
         porous.add("dt", 1e-3)
         porous.add("dummy_parameter", False)
+        porous.add("polynomial_degree", 1)
+
+        # Compartments of the perfusion model, with comma separated
+        # coefficients, see PorousProblem
+        porous.add("num_compartments", 3)
+        porous.add("compliances", "1.0, 1.0, 1.0")
+        porous.add("permeabilities", "10.0, 1.0, 0.1")
+        porous.add("transfer_coefficients", "0.1, 0.0, 0.1")
+
+        # Add boundary condition parameters
+        porous.add(df.Parameters("BoundaryConditions"))
+        porous["BoundaryConditions"].add("inflow", "")
+        porous["BoundaryConditions"].add("inflow_flux", 0.0)
+        porous["BoundaryConditions"].add("drainage", 0.1)
+        porous["BoundaryConditions"].add("venous_pressure", 0.0)
 
         # Add default parameters from both LU and Krylov solvers
         porous.add(LUSolver.default_parameters())
@@ -188,5 +261,8 @@ class Parameters(df.Parameters):
         # Add solver parameters
         porous.add(df.Parameters("Solver"))
         porous["Solver"].add("dummy_parameter", False)
+        porous["Solver"].add("linear_solver", "iterative")
+        porous["Solver"].add("krylov_method", "cg")
+        porous["Solver"].add("amg", "gamg")
 
         self.add(porous)
\ No newline at end of file
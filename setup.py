@@ -8,4 +8,6 @@ setup(name='m3h3',
       author_email='alexandra@simula.no',
       license='BSD3',
       packages=find_namespace_packages(),
+      entry_points={
+          "console_scripts": ["m3h3-precompile=m3h3.precompile:main"]},
       zip_safe=False)
@@ -0,0 +1,34 @@
+import numpy as np
+
+import dolfin as df
+from m3h3.activation import ActivationRecorder
+
+
+def test_activation_recorder():
+    mesh = df.UnitIntervalMesh(4)
+    v = df.Function(df.FunctionSpace(mesh, "P", 1))
+    v.vector()[:] = -80.0
+    recorder = ActivationRecorder(v, threshold=-40.0,
+                                    repolarization_threshold=-70.0)
+
+    for t, value in ((1.0, -60.0), (2.0, 20.0), (3.0, -60.0), (4.0, -80.0),
+                     (5.0, 20.0)):
+        v.vector()[:] = value
+        recorder(t, v)
+
+    assert np.allclose(recorder.activation, 1.25)
+    assert np.allclose(recorder.repolarization, 3.5)
+
+
+def test_activation_recorder_latest():
+    mesh = df.UnitIntervalMesh(4)
+    v = df.Function(df.FunctionSpace(mesh, "P", 1))
+    v.vector()[:] = -80.0
+    recorder = ActivationRecorder(v, threshold=-40.0, mode="latest")
+
+    for t, value in ((1.0, 0.0), (2.0, -80.0), (3.0, 0.0)):
+        v.vector()[:] = value
+        recorder(t, v)
+
+    assert np.allclose(recorder.activation, 2.5)
+    assert np.all(np.isnan(recorder.repolarization))
@@ -0,0 +1,46 @@
+import dolfin as df
+
+from m3h3.benchmarks import niederer_slab, single_cell
+from m3h3.benchmarks.common import summarize
+from m3h3.ode import Tentusscher_panfilov_2006_M_cell
+
+
+def test_niederer_slab():
+    results = niederer_slab.run(dx=1.0, dt=0.1, end_time=30.0,
+                                comm=df.MPI.comm_self)
+    times = results["activation_times"]
+    # The upstroke starts in the stimulated corner and travels along the
+    # fibres to the far end of the slab
+    assert times["P1"] is not None and times["P1"] < 5.0
+    assert times["P9"] is not None and times["P1"] < times["P9"]
+    assert times["P3"] is None or times["P9"] < times["P3"]
+    assert results["num_steps"] == 300
+
+
+def test_single_cell():
+    results = single_cell.run(dt=0.1, num_beats=1, cycle_length=1000.0)
+    action_potential = results["action_potential"]
+    assert action_potential["v_rest"] < -80.0
+    assert action_potential["v_peak"] > 0.0
+    assert 200.0 < action_potential["apd90"] < 500.0
+
+
+def test_summarize():
+    mesh = df.UnitSquareMesh(df.MPI.comm_self, 4, 4)
+    V = df.FunctionSpace(mesh, "P", 1)
+    cfun = df.MeshFunction("size_t", mesh, 2, 0)
+    cfun.array()[:8] = 1
+    results = summarize("test", {"dx": 0.25}, df.MPI.comm_self, 2.0, 10.0,
+                        V.dim(), 100, mesh=mesh, function_space=V,
+                        cfun=cfun,
+                        cell_model=Tentusscher_panfilov_2006_M_cell(),
+                        error=0.5)
+    assert results["benchmark"] == "test"
+    assert results["wall_time_per_ms"] == 0.2
+    assert results["dofs_per_second"] == V.dim()*100/2.0
+    assert results["per_rank"][0]["cells"] == 32
+    assert results["per_rank"][0]["dofs"] == 25
+    assert results["per_rank"][0]["regions"] == {"0": 24, "1": 8}
+    assert results["region_costs"]["costs"] == {}
+    assert results["region_costs"]["default"] > 1.0
+    assert results["error"] == 0.5
@@ -0,0 +1,57 @@
+from pytest import fixture
+
+import dolfin as df
+from m3h3 import *
+from geometry import Geometry2D, MarkerFunctions2D
+
+
+def test_checkpoint_roundtrip(geo, parameters, tmpdir):
+    path = str(tmpdir.join("checkpoint.h5"))
+    model = M3H3(geo, parameters)
+    model.electro_problem.prev_current.vector()[:] = 1.0
+    model.time.assign(0.5)
+    written = model.save_checkpoint(path)
+    assert "/Electro/prev_current" in written
+
+    restarted = M3H3.from_checkpoint(path, geo, parameters)
+    assert float(restarted.time) == 0.5
+    v = restarted.electro_problem.prev_current.vector()
+    assert abs(v.max() - 1.0) < 1e-12 and abs(v.min() - 1.0) < 1e-12
+
+
+def test_checkpoint_incremental(geo, parameters, tmpdir):
+    path = str(tmpdir.join("checkpoint.h5"))
+    model = M3H3(geo, parameters)
+    model.save_checkpoint(path)
+    model.electro_problem.prev_current.vector()[:] = 2.0
+    written = model.save_checkpoint(path)
+    assert written == ["/Electro/prev_current"]
+
+    # A permutation of the values has the same norms, but is a change
+    v = model.electro_problem.prev_current.vector()
+    values = v.get_local()
+    values[:len(values)//2] = 3.0
+    v.set_local(values)
+    v.apply("insert")
+    model.save_checkpoint(path)
+    v.set_local(values[::-1].copy())
+    v.apply("insert")
+    written = model.save_checkpoint(path)
+    assert written == ["/Electro/prev_current"]
+    assert model.save_checkpoint(path) == []
+
+
+@fixture
+def parameters():
+    parameters = Parameters("M3H3")
+    parameters.set_electro_parameters()
+    return parameters
+
+
+@fixture
+def geo():
+    mesh = df.UnitSquareMesh(4, 4)
+    ffun = df.MeshFunction("size_t", mesh, mesh.topology().dim()-1)
+    ffun.set_all(0)
+    return Geometry2D(mesh, markers={'NONE': 0},
+                        markerfunctions=MarkerFunctions2D(ffun=ffun))
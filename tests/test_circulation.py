@@ -0,0 +1,28 @@
+import numpy as np
+
+from m3h3.circulation import closed_loop, windkessel
+
+
+def test_windkessel():
+    model = windkessel(120.0, {"arterial_pressure": 80.0})
+    lv = model.cavities.index("lv")
+    # Ejection while the cavity pressure exceeds the arterial pressure
+    volumes = model.step(10.0, [120.0], num_steps=10)
+    assert volumes[model.names.index("lv")] < 120.0
+    flows = model.flows(volumes, [120.0])
+    assert flows[model.connections.index("lv-arterial")] > 0
+    assert flows[model.connections.index("venous-lv")] == 0
+    # Filling through the mitral valve at low cavity pressure
+    flows = model.flows(volumes, [2.0])
+    assert flows[model.connections.index("lv-arterial")] == 0
+    assert flows[model.connections.index("venous-lv")] > 0
+    assert np.allclose(model.cavity_volumes()[lv], volumes[1])
+
+
+def test_closed_loop_conserves_volume():
+    model = closed_loop({"lv": 120.0, "rv": 110.0})
+    total = model.volumes.sum()
+    for p in ([100.0, 20.0], [5.0, 2.0]):
+        model.step(100.0, p, num_steps=100)
+    assert np.isclose(model.volumes.sum(), total)
+    assert np.isclose(total, 5000.0)
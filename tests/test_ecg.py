@@ -0,0 +1,57 @@
+import numpy as np
+
+import dolfin as df
+from m3h3.ecg import ECG, STANDARD_LEADS
+
+
+def test_pseudo_ecg():
+    mesh = df.UnitSquareMesh(8, 8)
+    V = df.FunctionSpace(mesh, "P", 1)
+    v = df.interpolate(df.Expression("x[0]*x[0] + x[1]", degree=2), V)
+    electrodes = {"A": (2.0, 0.5), "B": (-1.0, 2.0)}
+    ecg = ECG(v, electrodes, leads={"AB": {"A": 1.0, "B": -1.0}},
+                                            conductivity=2.0)
+
+    x = df.SpatialCoordinate(mesh)
+    potentials = []
+    for point in electrodes.values():
+        r = df.sqrt(df.inner(x - df.Constant(point), x - df.Constant(point)))
+        potentials.append(df.assemble(2.0*df.inner(df.grad(v),
+                                        df.grad(1/r))*df.dx)/(4*np.pi))
+
+    ecg(0.0)
+    values = ecg.evaluate()
+    if df.MPI.rank(mesh.mpi_comm()) == 0:
+        assert np.allclose(values, [potentials[0] - potentials[1]])
+        times, samples = ecg.values()
+        assert np.allclose(times, [0.0]) and samples.shape == (1, 1)
+
+
+def test_standard_leads():
+    assert len(STANDARD_LEADS) == 12
+    # Einthoven's law: I + III = II
+    I, II, III = (STANDARD_LEADS[name] for name in ("I", "II", "III"))
+    for electrode in ("RA", "LA", "LL"):
+        assert I.get(electrode, 0) + III.get(electrode, 0)\
+                                                == II.get(electrode, 0)
+
+
+def test_pseudo_ecg_conductivity_tensor():
+    mesh = df.UnitSquareMesh(8, 8)
+    V = df.FunctionSpace(mesh, "P", 1)
+    v = df.interpolate(df.Expression("x[0]*x[0] + x[1]", degree=2), V)
+    M_i = df.interpolate(df.Constant(((2.0, 0.0), (0.0, 0.5))),
+                            df.TensorFunctionSpace(mesh, "DG", 0))
+    electrodes = {"A": (2.0, 0.5)}
+    ecg = ECG(v, electrodes, conductivity=M_i)
+
+    x = df.SpatialCoordinate(mesh)
+    r = df.sqrt(df.inner(x - df.Constant((2.0, 0.5)),
+                                            x - df.Constant((2.0, 0.5))))
+    potential = df.assemble(df.inner(M_i*df.grad(v),
+                                        df.grad(1/r))*df.dx)/(4*np.pi)
+    isotropic = ECG(v, electrodes, conductivity=2.0).evaluate()
+    values = ecg.evaluate()
+    if df.MPI.rank(mesh.mpi_comm()) == 0:
+        assert np.allclose(values, [potential])
+        assert not np.allclose(values, isotropic)
@@ -0,0 +1,98 @@
+import numpy as np
+
+import dolfin as df
+from m3h3 import *
+from m3h3.pde.eikonal_problem import tension_profile
+from m3h3.pde.solver.eikonal_solver import (fast_iterative_method,
+                                            _triangles)
+from geometry import Geometry2D, MarkerFunctions2D
+
+
+def grid(n):
+    x, y = np.meshgrid(np.linspace(0, 1, n + 1), np.linspace(0, 1, n + 1))
+    points = np.column_stack([x.ravel(), y.ravel()])
+    index = np.arange((n + 1)**2).reshape(n + 1, n + 1)
+    a, b = index[:-1, :-1].ravel(), index[:-1, 1:].ravel()
+    c, d = index[1:, :-1].ravel(), index[1:, 1:].ravel()
+    triangles = np.concatenate([np.column_stack([a, b, d]),
+                                np.column_stack([a, d, c])])
+    return points, triangles
+
+
+def cube(n):
+    # Kuhn triangulation of the unit cube into 6 tetrahedra per cell
+    x = np.linspace(0, 1, n + 1)
+    points = np.stack(np.meshgrid(x, x, x, indexing="ij"), -1).reshape(-1, 3)
+    index = np.arange((n + 1)**3).reshape(n + 1, n + 1, n + 1)
+    corners = [index[a:n + a, b:n + b, c:n + c].ravel()
+                            for a in (0, 1) for b in (0, 1) for c in (0, 1)]
+    tetrahedra = [np.column_stack([corners[0], corners[i], corners[j],
+                                                                corners[7]])
+                  for i, j in ((1, 3), (1, 5), (2, 3), (2, 6), (4, 5),
+                                                                    (4, 6))]
+    return points, np.concatenate(tetrahedra)
+
+
+def test_fast_iterative_method():
+    points, triangles = grid(20)
+    # Velocity 2 along x and 1 along y
+    metric = np.diag([1/4.0, 1.0])
+    metrics = np.tile(metric, (len(triangles), 1, 1))
+    times = fast_iterative_method(points, triangles, metrics, [0], [1.0])
+    exact = 1.0 + np.sqrt(np.einsum("ni,ij,nj->n", points, metric, points))
+    assert np.abs(times - exact).max() < 0.05
+    assert times[0] == 1.0
+
+
+def test_fast_iterative_method_3d():
+    points, tetrahedra = cube(6)
+    # A planar front at velocity 2 along x and 1 along y and z, whose
+    # normal is not aligned with the faces
+    metric = np.diag([1/4.0, 1.0, 1.0])
+    normal = np.array([1.0, 0.3, 0.6])/np.linalg.norm([1.0, 0.3, 0.6])
+    speed = np.sqrt(normal.dot(np.linalg.inv(metric)).dot(normal))
+    exact = points.dot(normal)/speed
+    sources = np.flatnonzero((points == 0).any(axis=1))
+
+    metrics = np.tile(metric, (len(tetrahedra), 1, 1))
+    triangles, triangle_metrics = _triangles(tetrahedra, metrics)
+    faces = fast_iterative_method(points, triangles, triangle_metrics,
+                                    sources, exact[sources])
+    times = fast_iterative_method(points, triangles, triangle_metrics,
+                                    sources, exact[sources],
+                                    tetrahedra=tetrahedra,
+                                    tetrahedron_metrics=metrics)
+    assert np.abs(times - exact).max() < 1e-10
+    assert np.abs(faces - exact).max() > 1e-3
+
+
+def test_tension_profile():
+    tension = tension_profile([-1.0, 0.0, 50.0, 300.0, 400.0], 60.0, 20.0,
+                              80.0, 300.0)
+    assert tension[0] == tension[1] == tension[3] == tension[4] == 0.0
+    assert 0.0 < tension[2] < 60.0
+
+
+def test_eikonal_model():
+    mesh = df.UnitSquareMesh(8, 8)
+    ffun = df.MeshFunction("size_t", mesh, 1, 0)
+    cfun = df.MeshFunction("size_t", mesh, 2, 0)
+    cfun[0] = 1
+    geo = Geometry2D(mesh, markers={'NONE': 0, 'STIMULUS': 1},
+                markerfunctions=MarkerFunctions2D(ffun=ffun, cfun=cfun))
+    parameters = Parameters("M3H3")
+    parameters.set_electro_parameters()
+    parameters[str(Physics.ELECTRO)]["pde_model"] = "eikonal"
+    m3h3 = M3H3(geo, parameters)
+    next(m3h3.solve((0.0, 0.01)))
+    times = m3h3.electro_problem.activation_time.vector()
+    latest = times.max()
+    assert times.min() == 0.0
+    assert 1.0 < latest < 3.0
+
+    m3h3.parameters[str(Physics.ELECTRO)]["Eikonal"]\
+                                                ["conduction_velocity"] = 1.2
+    m3h3.update_parameters(Physics.ELECTRO, {})
+    assert m3h3.electro_solver._activation_times is None
+    next(m3h3.solve((0.01, 0.02)))
+    assert np.isclose(times.max(), latest/2)
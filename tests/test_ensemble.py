@@ -0,0 +1,49 @@
+import numpy as np
+
+import dolfin as df
+from m3h3 import *
+from m3h3.ensemble import Ensemble
+from geometry import Geometry2D, MarkerFunctions2D
+
+
+def setup(comm):
+    mesh = df.UnitSquareMesh(comm, 4, 4)
+    ffun = df.MeshFunction("size_t", mesh, mesh.topology().dim()-1, 0)
+    geo = Geometry2D(mesh, markers={'NONE': 0},
+                        markerfunctions=MarkerFunctions2D(ffun=ffun))
+    parameters = Parameters("M3H3")
+    parameters["end_time"] = 2e-3
+    parameters.set_electro_parameters()
+    parameters[str(Physics.ELECTRO)]["I_a"] = 1.0
+    return M3H3(geo, parameters)
+
+
+def outputs(model):
+    v = model.electro_problem.prev_current.vector()
+    return {"v_max": np.array(v.max())}
+
+
+def test_ensemble(tmpdir):
+    cache_dir = str(tmpdir.join("cache"))
+    members = [{"Electro": {"M_i": 1.0}}, {"Electro": {"M_i": 2.0}}]
+    ensemble = Ensemble(setup, outputs, num_groups=1, cache_dir=cache_dir)
+    form = ensemble.model.electro_problem._form
+
+    results = ensemble.run(members, str(tmpdir.join("sweep.h5")))
+    assert ensemble.model.electro_problem._form is form
+    assert float(ensemble.model.electro_problem.M_i) == 2.0
+
+    cached = ensemble.run(members)
+    if df.MPI.rank(df.MPI.comm_world) == 0:
+        assert len(results) == 2
+        for result, cached_result in zip(results, cached):
+            assert np.allclose(result["v_max"], cached_result["v_max"])
+
+
+def test_ensemble_restores_base_parameters():
+    ensemble = Ensemble(setup, outputs, num_groups=1)
+    problem = ensemble.model.electro_problem
+    base = float(problem.M_i)
+    ensemble.run([{"Electro": {"M_i": 2.0*base}}, {"Electro": {"M_e": 1.5}}])
+    assert float(problem.M_i) == base
+    assert ensemble.model.parameters[str(Physics.ELECTRO)]["M_i"] == base
@@ -1,3 +1,4 @@
+import numpy as np
 from pytest import fixture, raises
 
 import dolfin as df
@@ -29,8 +30,293 @@ def test_setup_problems(m3h3):
 
 
 def test_solve(m3h3):
-    # TODO:
-    pass
+    times = [time for time, _ in m3h3.solve((0.0, 0.01), yield_every=0.005)]
+    assert times == [0.005, 0.01]
+    with raises(ValueError):
+        next(m3h3.solve((0.0, 0.01), yield_every=0.0015))
+
+
+def test_solve_callbacks(m3h3):
+    calls = []
+    def stop(time, solution_fields):
+        calls.append(time)
+        return len(calls) == 3
+    m3h3.register_callback(stop, every=0.002)
+    times = [time for time, _ in m3h3.solve((0.0, 0.01))]
+    assert len(calls) == 3
+    assert times == [calls[-1]]
+
+
+def test_update_parameters(m3h3):
+    form = m3h3.electro_problem._form
+    next(m3h3.solve((0.0, 0.002)))
+    assert m3h3.electro_solver._A is not None
+
+    m3h3.update_parameters(Physics.ELECTRO, {"M_i": 3.0, "I_a": 1.0})
+    assert m3h3.electro_problem._form is form
+    assert float(m3h3.electro_problem.M_i) == 3.0
+    assert m3h3.electro_solver._A is None
+
+    next(m3h3.solve((0.002, 0.004)))
+    m3h3.update_parameters(Physics.ELECTRO, {"I_a": 2.0})
+    assert m3h3.electro_solver._A is not None
+
+    m3h3.update_parameters(Physics.SOLID,
+                                {"BoundaryConditions": {"lv_pressure": 2.0}})
+    assert float(m3h3.solid_problem.lv_pressure) == 2.0
+
+    # Pressures set in place, e.g. by a circulation model, are kept
+    m3h3.solid_problem.lv_pressure.assign(5.0)
+    m3h3.update_parameters(Physics.SOLID, {"dt": 1e-3})
+    assert float(m3h3.solid_problem.lv_pressure) == 5.0
+
+
+def test_conductivity_tensors(m3h3):
+    problem = m3h3.electro_problem
+    form = problem._form
+    M_i = problem.conductivity_tensors[0].function
+    m3h3.update_parameters(Physics.ELECTRO, {"M_i_t": 0.5, "M_i_n": 0.25})
+    assert problem._form is form
+    assert m3h3.electro_solver._A is None
+    values = M_i.vector().get_local().reshape(-1, 3, 3)
+    assert np.allclose(values, np.diag([1.0, 0.5, 0.25]))
+
+
+def test_solid_solver(m3h3):
+    solver = m3h3.solid_solver
+    assert solver.step() > 0
+    # The state is converged, and is kept in the next step
+    assert solver.step() == 0
+    u = m3h3.solid_problem.state.vector().copy()
+
+    m3h3.solid_problem.state.vector().zero()
+    newton = solver.parameters["nonlinear_variational_solver"]["newton_solver"]
+    newton["jacobian_update"] = "newton"
+    solver.step()
+    assert (m3h3.solid_problem.state.vector() - u).norm("linf")\
+                                                        < 1e-6*u.norm("linf")
+
+
+def test_solid_iterative_solver(m3h3):
+    m3h3.solid_solver.step()
+    u = m3h3.solid_problem.state.vector().copy()
+
+    m3h3.solid_problem.state.vector().zero()
+    m3h3.solid_solver.parameters["Solver"]["linear_solver"] = "iterative"
+    m3h3.solid_solver._linear_solver = None
+    m3h3.solid_solver.invalidate()
+    m3h3.solid_solver.step()
+    assert isinstance(m3h3.solid_solver._linear_solver, df.PETScKrylovSolver)
+    assert (m3h3.solid_problem.state.vector() - u).norm("linf")\
+                                                        < 1e-4*u.norm("linf")
+
+    # Rebuilds of the Jacobian keep the matrix and its near-nullspace
+    A = df.as_backend_type(m3h3.solid_solver._A).mat()
+    newton = m3h3.solid_solver.parameters["nonlinear_variational_solver"]\
+                                                            ["newton_solver"]
+    newton["jacobian_update"] = "newton"
+    m3h3.solid_problem.lv_pressure.assign(12.0)
+    m3h3.solid_solver.invalidate()
+    assert m3h3.solid_solver.step() > 0
+    assert df.as_backend_type(m3h3.solid_solver._A).mat().handle == A.handle
+    assert len(A.getNearNullSpace().getVecs()) == 6
+
+
+def test_solid_continuation(m3h3):
+    solver = m3h3.solid_solver
+    lv_pressure = m3h3.solid_problem.lv_pressure
+    for n, pressure in enumerate([0.5, 1.0]):
+        lv_pressure.assign(pressure)
+        solver.step(time=float(n))
+    # The secant predictor is exact for a linear increase of the load
+    lv_pressure.assign(1.5)
+    solver._predict(2.0)
+    predicted = m3h3.solid_problem.state.vector().copy()
+    solver.step(time=2.0)
+    assert len(solver._history) == 2
+    assert (m3h3.solid_problem.state.vector() - predicted).norm("linf")\
+                < 0.1*m3h3.solid_problem.state.vector().norm("linf")
+
+    # A step that keeps failing is cut back and ends at the new loads
+    newton = solver.parameters["nonlinear_variational_solver"]["newton_solver"]
+    newton["maximum_iterations"] = 1
+    newton["error_on_nonconvergence"] = False
+    lv_pressure.assign(10.0)
+    solver.step(time=3.0)
+    assert float(lv_pressure) == 10.0
+    newton["error_on_nonconvergence"] = True
+    with raises(RuntimeError):
+        lv_pressure.assign(20.0)
+        solver.step(time=4.0)
+
+
+def test_reduced_solid_solver(m3h3):
+    from m3h3.profiling import profiler
+    from m3h3.reduced import Snapshots, ReducedSolidSolver, ecsw_weights,\
+                                                                    pod_basis
+
+    def fallbacks():
+        counters = profiler.report(df.MPI.comm_self,
+                                   dolfin_timings=False)["counters"]
+        return counters.get("reduced_fallbacks", {"max": 0})["max"]
+
+    solver = m3h3.solid_solver
+    problem = m3h3.solid_problem
+    snapshots = Snapshots(problem)
+    for n, pressure in enumerate([2.0, 4.0, 6.0, 8.0, 10.0]):
+        problem.lv_pressure.assign(pressure)
+        solver.step(time=float(n))
+        snapshots.add()
+    problem.lv_pressure.assign(7.0)
+    solver.step(time=5.0)
+    u = problem.state.vector().copy()
+    problem.lv_pressure.assign(10.0)
+    solver.step(time=6.0)
+
+    basis, _ = pod_basis(snapshots, tolerance=1e-6, comm=df.MPI.comm_self)
+    cells, weights = ecsw_weights(solver, basis, snapshots.states,
+                                                            tolerance=1e-3)
+    assert 0 < len(cells) < problem.geometry.mesh.num_cells()
+    reduced = m3h3.use_reduced_solid(basis, cells, weights, tolerance=0.2)
+    assert isinstance(m3h3.solid_solver, ReducedSolidSolver)
+
+    # A load within the training range is solved in reduced coordinates
+    before = fallbacks()
+    problem.lv_pressure.assign(7.0)
+    reduced.step(time=7.0)
+    assert fallbacks() == before
+    assert (problem.state.vector() - u).norm("linf") < 1e-2*u.norm("linf")
+
+    # A basis that does not represent the state falls back to the full
+    # solver
+    rng = np.random.RandomState(0)
+    poor = rng.rand(len(basis), 1)
+    for bc in problem.dirichlet_bcs:
+        poor[bc.dofs] = 0.0
+    poor /= np.linalg.norm(poor)
+    reduced = m3h3.use_reduced_solid(poor, tolerance=1e-2)
+    assert reduced.solver is solver
+    problem.lv_pressure.assign(10.0)
+    reduced.step(time=8.0)
+    problem.lv_pressure.assign(7.0)
+    reduced.step(time=9.0)
+    assert fallbacks() > before
+    assert (problem.state.vector() - u).norm("linf") < 1e-6*u.norm("linf")
+
+
+def test_circulation_coupling(m3h3):
+    from m3h3.circulation import LumpedModel, cavity_volume_form
+
+    problem = m3h3.solid_problem
+    solver = m3h3.solid_solver
+    volume = df.Form(cavity_volume_form(problem,
+                                        problem.geometry.get_lv_marker()))
+    # Compliance of the cavity at the fixture pressure
+    solver.step()
+    V0 = df.assemble(volume)
+    problem.lv_pressure.assign(11.0)
+    solver.step()
+    compliance = df.assemble(volume) - V0
+    assert compliance > 0
+    problem.lv_pressure.assign(10.0)
+    solver.step()
+
+    # Filling from a reservoir, with a time constant of five steps
+    dt = max(m3h3.parameters[str(p)]["dt"]
+                                    for p in (Physics.ELECTRO, Physics.SOLID))
+    model = LumpedModel([{"name": "venous", "kind": "reservoir",
+                          "pressure": 12.0}, {"name": "lv", "kind": "cavity"}],
+                        [("venous", "lv", 5*dt/compliance, False)],
+                        {"lv": V0})
+    circulation = m3h3.add_circulation(model, compliance=compliance)
+    for _ in m3h3.solve((0.0, 10*dt)):
+        pass
+
+    times, samples = circulation.values()
+    assert len(times) == 10
+    names = circulation.series.names
+    lv_pressure = samples[:, names.index("lv_pressure")]
+    lumped = samples[:, names.index("lv_volume")]
+    mechanics = samples[:, names.index("lv_mechanics_volume")]
+    assert 10.0 < lv_pressure[-1] < 12.0
+    assert np.all(np.diff(lumped) > 0)
+    # The mechanics solve of every step reaches the volume of the
+    # circulation of the previous step
+    assert np.abs(mechanics[1:] - lumped[:-1]).max()\
+                                                < 1e-2*(lumped[-1] - V0)
+
+
+def test_solid_boundary_data(m3h3):
+    problem = m3h3.solid_problem
+    assert problem.rv_pressure is None and problem.robin_bcs == []
+    for bc, precomputed in zip(problem._dirichlet_bc
+                    if isinstance(problem._dirichlet_bc, list)
+                    else [problem._dirichlet_bc], problem.dirichlet_bcs):
+        x = df.Function(problem.state_space).vector()
+        y = x.copy()
+        x[:] = 3.0
+        y[:] = 3.0
+        bc.apply(x)
+        precomputed.apply(y)
+        assert (x - y).norm("linf") == 0.0
+
+
+def test_fluid_solver(geo):
+    from m3h3.pde import FluidProblem
+    from m3h3.pde.solver import FluidSolver
+    parameters = Parameters("M3H3")
+    parameters.set_fluid_parameters()
+    fluid_parameters = parameters[str(Physics.FLUID)]
+    fluid_parameters["velocity_degree"] = 1
+    fluid_parameters["BoundaryConditions"]["inflow"] = "BASE"
+    fluid_parameters["BoundaryConditions"]["outflow"] = "EPI"
+    fluid_parameters["BoundaryConditions"]["inflow_pressure"] = 1.0
+    problem = FluidProblem(geo, df.Constant(0.0), fluid_parameters)
+    solver = FluidSolver(problem._form, df.Constant(0.0), (0.0, 1.0),
+                         fluid_parameters["dt"], fluid_parameters,
+                         problem=problem)
+    solver.step()
+    matrices = solver._matrices
+    solver.step()
+    assert solver._matrices is matrices
+    assert problem.velocity.vector().norm("l2") > 0
+    for bc in problem.velocity_bcs:
+        assert (problem.velocity.vector()[bc.dofs] == 0.0).all()
+
+    fluid_parameters["viscosity"] = 2.0
+    assert problem.update_parameters(fluid_parameters)
+    assert not problem.update_parameters(fluid_parameters)
+    solver.invalidate()
+    assert solver._matrices is None
+
+
+def test_porous_solver(geo):
+    from m3h3.pde import PorousProblem
+    from m3h3.pde.solver import PorousSolver
+    parameters = Parameters("M3H3")
+    parameters.set_porous_parameters()
+    porous_parameters = parameters[str(Physics.POROUS)]
+    porous_parameters["BoundaryConditions"]["inflow"] = "BASE"
+    porous_parameters["BoundaryConditions"]["inflow_flux"] = 1.0
+    pressures = {}
+    for method in ("direct", "iterative"):
+        porous_parameters["Solver"]["linear_solver"] = method
+        problem = PorousProblem(geo, df.Constant(0.0), porous_parameters)
+        solver = PorousSolver(problem._form, df.Constant(0.0), (0.0, 1.0),
+                              porous_parameters["dt"], porous_parameters,
+                              problem=problem)
+        solver.step()
+        A = solver._A
+        solver.step()
+        assert solver._A is A
+        pressures[method] = problem.pressure.vector().get_local()
+        arterial, capillary = problem.compartment(0), problem.compartment(2)
+        assert arterial.vector().max() > capillary.vector().max() > 0
+    assert abs(pressures["direct"] - pressures["iterative"]).max() < 1e-4
+
+    porous_parameters["transfer_coefficients"] = "0.1, 0.0"
+    with raises(ValueError):
+        PorousProblem(geo, df.Constant(0.0), porous_parameters)
 
 
 @fixture
@@ -38,6 +324,8 @@ def m3h3(geo, linear_elastic_material):
     parameters = Parameters("M3H3")
     parameters.set_electro_parameters()
     parameters.set_solid_parameters()
+    # A cavity load, as the default unloaded problem is solved by u = 0
+    parameters[str(Physics.SOLID)]["BoundaryConditions"]["lv_pressure"] = 10.0
     ia = Interaction(Physics.ELECTRO, Physics.SOLID)
     return M3H3(geo, parameters, interactions=[ia],
                 material=linear_elastic_material)
@@ -0,0 +1,35 @@
+import os
+
+from pytest import raises
+
+import dolfin as df
+from m3h3.output import OutputManager
+
+
+def test_output_intervals(tmpdir):
+    mesh = df.UnitSquareMesh(4, 4)
+    u = df.Function(df.FunctionSpace(mesh, "P", 1))
+    w = df.Function(df.VectorFunctionSpace(mesh, "P", 1))
+    output = OutputManager(str(tmpdir.join("out.xdmf")), mesh, queue_size=2)
+    output.add_field("u", u, interval=1.0)
+    output.add_field("w", w)
+    for step in range(1, 11):
+        output.write(0.5*step)
+    output.close()
+
+    assert output._times["u"] == [1.0, 2.0, 3.0, 4.0, 5.0]
+    assert len(output._times["w"]) == 10
+    assert os.path.isfile(str(tmpdir.join("out_u.xdmf")))
+    assert os.path.isfile(str(tmpdir.join("out_w.xdmf")))
+
+
+def test_output_writer_error(tmpdir):
+    mesh = df.UnitSquareMesh(4, 4)
+    u = df.Function(df.FunctionSpace(mesh, "P", 1))
+    # The writer cannot create its file in a missing directory
+    output = OutputManager(str(tmpdir.join("missing", "out.xdmf")), mesh)
+    output.add_field("u", u)
+    with raises(RuntimeError):
+        for step in range(100):
+            output.write(float(step))
+        output.close()
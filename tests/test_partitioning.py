@@ -0,0 +1,73 @@
+from pytest import fixture
+
+import numpy as np
+
+import dolfin as df
+from geometry import Geometry2D, MarkerFunctions2D
+
+from m3h3.ode import MultiCellModel, Tentusscher_panfilov_2006_M_cell
+from m3h3.partitioning import cell_costs, partition_geometry, weighted_rcb
+
+
+def test_weighted_rcb():
+    points = np.column_stack((np.linspace(0, 1, 100), np.zeros(100)))
+    weights = np.ones(100)
+    weights[:20] = 9.0
+    parts = weighted_rcb(points, weights, 2)
+    assert abs(weights[parts == 0].sum() - weights[parts == 1].sum()) <= 9.0
+    assert np.count_nonzero(parts == 0) < np.count_nonzero(parts == 1)
+
+
+def test_cell_costs(geo):
+    cheap = Tentusscher_panfilov_2006_M_cell()
+    cheap.cost = 1.0
+    expensive = Tentusscher_panfilov_2006_M_cell()
+    model = MultiCellModel((cheap, expensive), (0, 1), geo.cfun)
+    costs, default = cell_costs(model, assembly_cost=0.5)
+    assert costs == {0: 1.5, 1: 19.5}
+    assert default == 19.5
+
+
+def test_partition_geometry(geo, tmpdir):
+    costs = {0: 1.0, 1: 10.0}
+    cache_dir = str(tmpdir)
+    new_geo, markers = partition_geometry(geo, costs, cache_dir=cache_dir)
+    assert markers is new_geo.cfun
+    assert new_geo.mesh.num_entities_global(2) == geo.mesh.num_entities_global(2)
+    expensive = df.MPI.sum(geo.mesh.mpi_comm(),
+                    float(np.count_nonzero(markers.array() == 1)))
+    assert expensive == df.MPI.sum(geo.mesh.mpi_comm(),
+                    float(np.count_nonzero(geo.cfun.array() == 1)))
+    assert len(tmpdir.listdir()) == 1
+
+    cached_geo, _ = partition_geometry(geo, costs, cache_dir=cache_dir)
+    assert cached_geo.mesh.num_cells() == new_geo.mesh.num_cells()
+
+
+def test_m3h3_weighted_partitioning(geo, monkeypatch):
+    import m3h3.m3h3
+    from m3h3 import M3H3, Parameters
+
+    def reorder_geometry(*args, **kwargs):
+        raise AssertionError("The geometry is reordered twice.")
+    monkeypatch.setattr(m3h3.m3h3, "reorder_geometry", reorder_geometry)
+
+    parameters = Parameters("M3H3")
+    parameters.set_electro_parameters()
+    parameters["Partitioning"]["weighted"] = True
+    parameters["Partitioning"]["reordering"] = "morton"
+    cell_model = MultiCellModel((Tentusscher_panfilov_2006_M_cell(),)*2,
+                                (0, 1), geo.cfun)
+    model = M3H3(geo, parameters, cell_model=cell_model)
+    mesh = model.electro_problem.geometry.mesh
+    assert cell_model.mesh().id() == mesh.id()
+
+
+@fixture
+def geo():
+    mesh = df.UnitSquareMesh(8, 8)
+    cfun = df.MeshFunction("size_t", mesh, mesh.topology().dim(), 0)
+    df.CompiledSubDomain("x[0] < 0.25").mark(cfun, 1)
+    ffun = df.MeshFunction("size_t", mesh, mesh.topology().dim()-1, 0)
+    return Geometry2D(mesh, markers={'NONE': 0},
+                        markerfunctions=MarkerFunctions2D(ffun=ffun, cfun=cfun))
@@ -0,0 +1,53 @@
+import json
+import subprocess
+import sys
+
+from pytest import raises
+
+from m3h3.precompile import load_parameters, precompile
+from m3h3.setup_parameters import Parameters, Physics
+
+
+def test_precompile(tmpdir):
+    filename = str(tmpdir.join("parameters.json"))
+    with open(filename, "w") as f:
+        json.dump({"end_time": 1.0, "Electro": {"M_i": 2.0}}, f)
+
+    parameters = load_parameters(filename)
+    assert parameters["end_time"] == 1.0
+    assert parameters[str(Physics.ELECTRO)]["M_i"] == 2.0
+
+    # Fresh processes, so that no module is loaded from memory
+    cache_dir = str(tmpdir.join("dijitso"))
+    reports = []
+    for run in range(2):
+        output = str(tmpdir.join("report{}.json".format(run)))
+        subprocess.check_call([sys.executable, "-m", "m3h3.precompile",
+                                filename, "--cell", "triangle", "--ecg",
+                                "--cache-dir", cache_dir, "--output", output])
+        with open(output) as f:
+            reports.append(json.load(f))
+
+    first, second = reports
+    phases = set(name.split("/")[0] for name in first)
+    assert phases == {"setup", "step", "ecg"}
+    assert any("ffc_form" in name for name in first)
+    # Everything is compiled on the first run and found on the second
+    assert all(entry["status"] == "miss" for entry in first.values())
+    assert set(second.keys()) == set(first.keys())
+    assert all(entry["status"] == "hit" for entry in second.values())
+
+
+def test_precompile_geometry():
+    parameters = Parameters("M3H3")
+    parameters.set_electro_parameters()
+    # Fibers and markers of the production geometry change the forms
+    modules = []
+    for fibers, markers in ((True, None), (False, ["BASE"])):
+        report = precompile(parameters, cell="triangle", fibers=fibers,
+                            markers=markers)
+        modules.append(set(name.split("/")[1] for name in report
+                                                    if "ffc_form" in name))
+    assert modules[0] != modules[1]
+    with raises(ValueError):
+        precompile(parameters, cell="triangle", markers=["APEX"])
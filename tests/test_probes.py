@@ -0,0 +1,38 @@
+import numpy as np
+
+import dolfin as df
+from m3h3.probes import Probes
+
+
+def test_probes_scalar(tmpdir):
+    mesh = df.UnitSquareMesh(8, 8)
+    V = df.FunctionSpace(mesh, "P", 1)
+    u = df.interpolate(df.Expression("1 + x[0] + 2*x[1]", degree=1), V)
+    points = {"a": (0.3, 0.2), "b": (1.0, 1.0), "outside": (2.0, 0.0)}
+    filename = str(tmpdir.join("probes.h5"))
+    probes = Probes(u, points, filename=filename, buffer_size=2)
+
+    for t in range(3):
+        probes(float(t))
+    probes.close()
+
+    values = probes.evaluate()
+    if df.MPI.rank(mesh.mpi_comm()) == 0:
+        assert np.allclose(values[:2], [1.7, 4.0])
+        assert np.isnan(values[2])
+
+        import h5py
+        with h5py.File(filename, "r") as f:
+            assert np.allclose(f["time"][...], [0.0, 1.0, 2.0])
+            assert f["values"].shape == (3, 3)
+            assert np.allclose(f["values"][:, 0], 1.7)
+
+
+def test_probes_vector():
+    mesh = df.UnitSquareMesh(4, 4)
+    V = df.VectorFunctionSpace(mesh, "P", 2)
+    u = df.interpolate(df.Expression(("x[0]*x[0]", "x[1]"), degree=2), V)
+    probes = Probes(u, [(0.5, 0.25), (0.1, 0.9)])
+    values = probes.evaluate()
+    if df.MPI.rank(mesh.mpi_comm()) == 0:
+        assert np.allclose(values, [[0.25, 0.25], [0.01, 0.9]])
@@ -0,0 +1,25 @@
+from m3h3.profiling import Profiler
+
+
+def test_nested_timers():
+    profiler = Profiler()
+    for _ in range(3):
+        with profiler.timer("Electro"):
+            with profiler.timer("solve"):
+                profiler.count("iterations", 4)
+    report = profiler.report(dolfin_timings=False)
+
+    assert report["timers"]["Electro"]["calls"] == 3
+    assert report["timers"]["Electro/solve"]["calls"] == 3
+    assert report["timers"]["Electro"]["max"] >=\
+                                    report["timers"]["Electro/solve"]["max"]
+    assert report["counters"]["Electro/solve/iterations"]["mean"] == 12
+
+
+def test_disabled_profiler():
+    profiler = Profiler(enabled=False)
+    with profiler.timer("Electro"):
+        profiler.count("iterations")
+    report = profiler.report(dolfin_timings=False)
+    assert len(report["timers"]) == 0
+    assert len(report["counters"]) == 0
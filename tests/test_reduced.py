@@ -0,0 +1,31 @@
+import numpy as np
+from pytest import raises
+
+import dolfin as df
+from m3h3.reduced import _nnls, pod_basis
+
+
+def test_pod_basis():
+    rng = np.random.RandomState(0)
+    modes = np.linalg.qr(rng.randn(50, 3))[0]
+    snapshots = modes.dot(rng.randn(3, 10))
+    basis, singular_values = pod_basis(snapshots, tolerance=1e-8,
+                                       comm=df.MPI.comm_self)
+    assert basis.shape == (50, 3)
+    assert np.allclose(basis.T.dot(basis), np.eye(3))
+    assert np.allclose(basis.dot(basis.T.dot(snapshots)), snapshots)
+    assert np.all(np.diff(singular_values) <= 0)
+    basis, _ = pod_basis(snapshots, max_size=2, comm=df.MPI.comm_self)
+    assert basis.shape == (50, 2)
+    with raises(ValueError):
+        pod_basis(np.zeros((50, 2)), comm=df.MPI.comm_self)
+
+
+def test_nnls_is_sparse():
+    rng = np.random.RandomState(1)
+    G = np.abs(rng.randn(20, 200))
+    b = G.sum(axis=1)
+    x = _nnls(G, b, 1e-2)
+    assert np.all(x >= 0)
+    assert np.linalg.norm(G.dot(x) - b) <= 1e-2*np.linalg.norm(b)
+    assert np.count_nonzero(x) <= 20
@@ -0,0 +1,80 @@
+from pytest import fixture, mark
+
+import numpy as np
+
+import dolfin as df
+from geometry import Geometry2D, MarkerFunctions2D, Microstructure
+
+from m3h3.reordering import (bandwidth, morton_order, reorder_geometry,
+                             reverse_cuthill_mckee)
+
+
+def test_reverse_cuthill_mckee():
+    # A chain of segments with shuffled vertex numbers
+    labels = np.random.RandomState(0).permutation(50)
+    cells = np.column_stack((labels[:-1], labels[1:]))
+    order = reverse_cuthill_mckee(cells, 50)
+    assert sorted(order) == list(range(50))
+    new_index = np.empty(50, dtype=int)
+    new_index[order] = np.arange(50)
+    assert bandwidth(cells) > 1
+    assert bandwidth(new_index[cells]) == 1
+
+
+def test_morton_order():
+    points = np.array([[1.0, 1.0], [0.0, 0.0], [1.0, 0.0], [0.0, 1.0]])
+    assert list(morton_order(points)) == [1, 2, 3, 0]
+
+
+@mark.parametrize("method", ["rcm", "morton"])
+def test_reorder_geometry(geo, method):
+    new_geo, markers = reorder_geometry(geo, method, markers=geo.cfun)
+    mesh, new_mesh = geo.mesh, new_geo.mesh
+    assert markers is new_geo.cfun
+    assert new_mesh.num_cells() == mesh.num_cells()
+    assert bandwidth(new_mesh.cells()) <= bandwidth(mesh.cells())
+
+    # Markers and fibers are unchanged at the same points
+    for name in ("cfun", "ffun"):
+        old, new = getattr(geo, name), getattr(new_geo, name)
+        dim = old.dim()
+        old_values = {tuple(np.round(e.midpoint().array(), 8)): old[e]
+                                            for e in df.entities(mesh, dim)}
+        for e in df.entities(new_mesh, dim):
+            assert new[e] == old_values[tuple(np.round(e.midpoint().array(),
+                                                                        8))]
+    x = np.array([0.3, 0.7])
+    assert np.allclose(new_geo.f0(x), geo.f0(x))
+
+
+def test_m3h3_reordering(geo):
+    from m3h3 import M3H3, Parameters
+    from m3h3.ode import MultiCellModel, Tentusscher_panfilov_2006_M_cell
+
+    parameters = Parameters("M3H3")
+    parameters.set_electro_parameters()
+    parameters["Partitioning"]["reordering"] = "rcm"
+    parameters["Partitioning"]["dof_ordering"] = "Boost"
+    cell_model = MultiCellModel((Tentusscher_panfilov_2006_M_cell(),)*2,
+                                (0, 1), geo.cfun)
+    library = df.parameters["dof_ordering_library"]
+    m3h3 = M3H3(geo, parameters, cell_model=cell_model)
+    # The dof ordering is only changed during the setup
+    assert df.parameters["dof_ordering_library"] == library
+    mesh = m3h3.electro_problem.geometry.mesh
+    assert mesh.id() != geo.mesh.id()
+    assert cell_model.mesh().id() == mesh.id()
+
+
+@fixture
+def geo():
+    mesh = df.UnitSquareMesh(8, 8)
+    cfun = df.MeshFunction("size_t", mesh, mesh.topology().dim(), 0)
+    df.CompiledSubDomain("x[0] < 0.25").mark(cfun, 1)
+    ffun = df.MeshFunction("size_t", mesh, mesh.topology().dim()-1, 0)
+    df.CompiledSubDomain("near(x[1], 0.0)").mark(ffun, 2)
+    V = df.VectorFunctionSpace(mesh, "P", 1)
+    f0 = df.interpolate(df.Expression(("x[1]", "1.0 - x[0]"), degree=1), V)
+    return Geometry2D(mesh, markers={'NONE': 0},
+                        markerfunctions=MarkerFunctions2D(ffun=ffun, cfun=cfun),
+                        microstructure=Microstructure(f0=f0))
@@ -0,0 +1,69 @@
+from pytest import approx
+
+from m3h3.benchmarks.scaling import analyze, format_table, imbalance
+
+
+def runs():
+    region_costs = {"costs": {"1": 3.0}, "default": 1.0}
+    serial = {"num_processes": 1, "num_dofs": 1000, "wall_time": 8.0,
+              "region_costs": region_costs,
+              "per_rank": [{"timers": {"Electro": 6.0, "ode": 2.0},
+                            "dofs": 1000, "cells": 100,
+                            "regions": {"0": 80, "1": 20}}]}
+    parallel = {"num_processes": 2, "num_dofs": 1000, "wall_time": 5.0,
+                "region_costs": region_costs,
+                "per_rank": [{"timers": {"Electro": 3.0, "ode": 1.5},
+                              "dofs": 600, "cells": 50,
+                              "regions": {"0": 50}},
+                             {"timers": {"Electro": 3.0, "ode": 0.5},
+                              "dofs": 400, "cells": 50,
+                              "regions": {"0": 30, "1": 20}}]}
+    return [serial, parallel]
+
+
+def test_imbalance():
+    assert imbalance([1.0, 3.0]) == 1.5
+    assert imbalance([0.0, 0.0]) is None
+
+
+def test_analyze_strong():
+    serial, parallel = analyze(runs(), "strong")
+    assert serial["efficiency"] == 1.0
+    assert serial["workload_imbalance"] == 1.0
+    assert parallel["speedup"] == approx(1.6)
+    assert parallel["efficiency"] == approx(0.8)
+    assert parallel["dof_imbalance"] == approx(1.2)
+    assert parallel["cell_imbalance"] == 1.0
+    assert parallel["phases"]["Electro"]["imbalance"] == 1.0
+    assert parallel["phases"]["ode"]["max"] == 1.5
+    assert parallel["phases"]["ode"]["imbalance"] == approx(1.5)
+
+    # Region 1 has no default cost and sits on one rank
+    regions = parallel["region_imbalance"]
+    assert regions["0"]["cost"] == 1.0
+    assert regions["0"]["max_workload"] == 50.0
+    assert regions["0"]["imbalance"] == approx(1.25)
+    assert regions["1"]["cost"] == 3.0
+    assert regions["1"]["max_workload"] == 60.0
+    assert regions["1"]["imbalance"] == approx(2.0)
+    # Workloads of 50 and 30 + 3*20 = 90
+    assert parallel["workload_imbalance"] == approx(90.0/70.0)
+
+
+def test_analyze_weak():
+    _, parallel = analyze(runs(), "weak")
+    assert parallel["efficiency"] == approx(1.6)
+
+
+def test_analyze_without_costs():
+    data = runs()
+    for run in data:
+        del run["region_costs"]
+    _, parallel = analyze(data, "strong")
+    assert parallel["region_imbalance"]["1"]["cost"] == 1.0
+    assert parallel["workload_imbalance"] == approx(1.0)
+
+    table = format_table(analyze(data, "strong")).splitlines()
+    assert "load imb." in table[0]
+    assert len(table) == 3
+    assert "ode (1.50)" in table[2]
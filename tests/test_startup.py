@@ -0,0 +1,16 @@
+from m3h3.benchmarks.startup import run
+
+
+def test_lazy_physics_imports():
+    results = run(repeats=1)
+    assert results["eagerly_loaded"] == []
+    assert results["import_time"]["min"] > 0
+
+
+def test_lazy_attributes():
+    import m3h3.pde
+    from m3h3.pde import SolidProblem
+    from m3h3.ode import Tentusscher_panfilov_2006_M_cell
+    assert "SolidProblem" in dir(m3h3.pde)
+    assert Tentusscher_panfilov_2006_M_cell.__name__\
+                                        == "Tentusscher_panfilov_2006_M_cell"